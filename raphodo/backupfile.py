@@ -24,7 +24,6 @@ __copyright__ = "Copyright 2011-2017, Damon Lynch"
 import pickle
 import os
 import errno
-import hashlib
 from datetime import datetime
 import shutil
 import logging
@@ -45,10 +44,10 @@ from raphodo.constants import (FileType, DownloadStatus, BackupStatus)
 from raphodo.rpdfile import RPDFile
 from raphodo.cache import FdoCacheNormal, FdoCacheLarge
 
-from raphodo.copyfiles import copy_file_metadata
+from raphodo.copyfiles import copy_file_metadata, hash_file
 from raphodo.problemnotification import (
     BackingUpProblems, BackupSubfolderCreationProblem, make_href, BackupOverwrittenProblem,
-    BackupAlreadyExistsProblem, FileWriteProblem
+    BackupAlreadyExistsProblem, FileWriteProblem, FileVerificationProblem
 )
 from raphodo.storage import get_uri
 
@@ -95,14 +94,58 @@ class BackupFilesWorker(WorkerInPublishPullPipeline, FileCopy):
             # ignore any metadata copying errors
             copy_file_metadata(full_file_name, full_dest_name)
 
+    def move_fan_out_file(self, fan_out_full_file_name: str, backup_full_file_name: str) -> bool:
+        """
+        Move a backup written while the file was being downloaded into place
+
+        :return: True if the move succeeded, else False
+        """
+
+        try:
+            os.rename(fan_out_full_file_name, backup_full_file_name)
+        except OSError as e:
+            logging.warning(
+                "Could not move %s to %s (%s: %s): copying it instead",
+                fan_out_full_file_name, backup_full_file_name, e.errno, e.strerror
+            )
+            return False
+        return True
+
+    def backup_digest(self, backup_full_file_name: str) -> str:
+        """
+        :return: the digest of the backup file, or an empty string if it could not
+         be read
+        """
+
+        try:
+            return hash_file(backup_full_file_name, self.hash_algorithm)
+        except OSError as e:
+            logging.error(
+                "Could not read backup %s to verify it (%s: %s)",
+                backup_full_file_name, e.errno, e.strerror
+            )
+            return ''
+
     def do_backup(self, data: BackupFileData) -> None:
         rpd_file = data.rpd_file
         backup_succeeded = False
         self.scan_id = rpd_file.scan_id
-        self.verify_file = data.verify_file
+        # The file is verified against the digest generated when it was downloaded
+        self.verify_file = data.verify_file and bool(rpd_file.digest)
+        if self.verify_file:
+            self.hash_algorithm = rpd_file.digest_algorithm
+        if data.copy_engine is not None:
+            self.copy_engine = data.copy_engine
 
         mdata_exceptions = None
 
+        # A backup may have been written while the file was downloaded, in
+        # which case progress has already been reported for the bytes written
+        fan_out_full_file_name, bytes_reported = rpd_file.backup_fan_out.get(
+            self.device_id, ('', 0)
+        )
+        self.amount_downloaded = self.bytes_downloaded = bytes_reported
+
         if not (data.move_succeeded and data.do_backup):
             backup_full_file_name = ''
         else:
@@ -190,11 +233,30 @@ class BackupFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                               data.download_count, self.device_name)
                 source = rpd_file.download_full_file_name
                 destination = backup_full_file_name
-                backup_succeeded = self.copy_from_filesystem(source, destination, rpd_file)
-                if backup_succeeded and self.verify_file:
-                    md5 = hashlib.md5(open(backup_full_file_name).read()).hexdigest()
-                    if md5 != rpd_file.md5:
-                        pass
+                moved = bool(fan_out_full_file_name) and self.move_fan_out_file(
+                    fan_out_full_file_name, destination
+                )
+                if moved:
+                    backup_succeeded = True
+                    self.update_progress(rpd_file.size, rpd_file.size)
+                    if self.verify_file:
+                        # Read back what was written to the backup device while
+                        # downloading
+                        self.digest = self.backup_digest(backup_full_file_name)
+                else:
+                    backup_succeeded = self.copy_from_filesystem(source, destination, rpd_file)
+                if backup_succeeded and self.verify_file and self.digest != rpd_file.digest:
+                    logging.error(
+                        "Verification of backup %s failed: digest %s does not match %s",
+                        backup_full_file_name, self.digest, rpd_file.digest
+                    )
+                    self.problems.append(
+                        FileVerificationProblem(
+                            name=rpd_file.download_name,
+                            uri=get_uri(full_file_name=backup_full_file_name)
+                        )
+                    )
+                    backup_succeeded = False
                 if backup_succeeded:
                     logging.debug("...backing up file %s on device %s succeeded",
                                   data.download_count, self.device_name)
@@ -219,8 +281,14 @@ class BackupFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                 if rpd_file.download_log_full_name:
                     self.backup_associate_file(dest_dir, rpd_file.download_log_full_name)
 
+        if fan_out_full_file_name and os.path.exists(fan_out_full_file_name):
+            try:
+                os.remove(fan_out_full_file_name)
+            except OSError as e:
+                logging.error("Could not remove %s: %s", fan_out_full_file_name, e.strerror)
+
         self.total_downloaded += rpd_file.size
-        bytes_not_downloaded = rpd_file.size - self.amount_downloaded
+        bytes_not_downloaded = rpd_file.size - max(self.amount_downloaded, self.bytes_downloaded)
         if bytes_not_downloaded and data.do_backup:
             self.content = pickle.dumps(
                 BackupResults(
@@ -56,21 +56,26 @@ import hashlib
 from urllib.request import pathname2url
 import time
 import shutil
+import mmap
 from collections import namedtuple
-from typing import Optional, Tuple, Union
+from typing import Optional, Tuple, Union, Dict, Iterable, List
 import sqlite3
 
-from PyQt5.QtCore import QSize
+from PyQt5.QtCore import QSize, QBuffer, QIODevice
 from PyQt5.QtGui import QImage
+from tenacity import RetryError
 
 from raphodo.storage import get_program_cache_directory, get_fdo_cache_thumb_base_directory
 from raphodo.utilities import GenerateRandomFileName, format_size_for_user
 from raphodo.constants import ThumbnailCacheDiskStatus
-from raphodo.rpdsql import CacheSQL
+from raphodo.rpdsql import CacheSQL, InCache
 
 
 GetThumbnail = namedtuple('GetThumbnail', 'disk_status, thumbnail, path')
-GetThumbnailPath = namedtuple('GetThumbnailPath', 'disk_status, path, mdatatime, orientation_unknown')
+GetThumbnailPath = namedtuple(
+    'GetThumbnailPath', 'disk_status, path, mdatatime, orientation_unknown, packed'
+)
+PackedLocation = namedtuple('PackedLocation', 'md5_name, segment, offset, length')
 
 class MD5Name:
     """Generate MD5 hashes for file names."""
@@ -366,11 +371,201 @@ class FdoCacheLarge(Cache):
         super().__init__(cache_dir, failure_dir)
 
 
+class PackedThumbnailStore:
+    """
+    Thumbnails appended to large segment files, instead of each being saved
+    in its own file.
+
+    Each PackedThumbnailStore appends to segment files of its own, so that
+    processes saving thumbnails at the same time do not need to coordinate
+    their writes. The location of each thumbnail in its segment file is
+    recorded in the thumbnail database.
+
+    Segment files are read using memory maps.
+    """
+
+    extension = 'pack'
+
+    def __init__(self, path: str, max_segment_size: int=64 * 1024 * 1024) -> None:
+        """
+        :param path: directory in which the segment files are saved. It
+         is created when the first thumbnail is saved.
+        :param max_segment_size: size in bytes beyond which a new segment
+         file is started
+        """
+
+        self.path = path
+        self.max_segment_size = max_segment_size
+        self.random_filename = GenerateRandomFileName()
+        # The segment file being appended to
+        self.segment = None  # type: Optional[str]
+        self.fd = None  # type: Optional[int]
+        self.segment_size = 0
+        # Memory maps of segment files being read from
+        self.maps = dict()  # type: Dict[str, mmap.mmap]
+
+    def segments(self) -> List[str]:
+        """
+        :return: names of all segment files
+        """
+
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return [name for name in names if name.endswith('.{}'.format(self.extension))]
+
+    def _new_segment(self) -> None:
+        os.makedirs(self.path, 0o700, exist_ok=True)
+        while True:
+            segment = self.random_filename.name(extension=self.extension)
+            try:
+                self.fd = os.open(
+                    os.path.join(self.path, segment),
+                    os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o600
+                )
+            except FileExistsError:
+                continue
+            break
+        self.segment = segment
+        self.segment_size = 0
+
+    def close_segment(self) -> None:
+        """
+        Stop appending to the current segment file
+        """
+
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.segment = None
+
+    def append(self, data: Union[bytes, memoryview]) -> Tuple[str, int]:
+        """
+        Append a thumbnail to the current segment file, starting a new
+        segment file if necessary.
+
+        :param data: the thumbnail
+        :return: the segment file and offset in it the thumbnail was written to
+        """
+
+        if self.fd is None or self.segment_size + len(data) > self.max_segment_size:
+            self.close_segment()
+            self._new_segment()
+        segment, offset = self.segment, self.segment_size
+        view = memoryview(data)
+        try:
+            while view:
+                view = view[os.write(self.fd, view):]
+        except OSError:
+            # The segment file may now end with part of the thumbnail, so
+            # do not append any more to it
+            self.close_segment()
+            raise
+        self.segment_size += len(data)
+        return segment, offset
+
+    def sync(self) -> None:
+        """
+        Ensure what has been appended to the current segment file is on disk
+        """
+
+        if self.fd is not None:
+            os.fsync(self.fd)
+
+    @staticmethod
+    def _close_map(mapped: mmap.mmap) -> None:
+        try:
+            mapped.close()
+        except BufferError:
+            # A memoryview of it is still in use. It is unmapped once the
+            # memoryview is released.
+            pass
+
+    def read(self, segment: str, offset: int, length: int) -> Optional[memoryview]:
+        """
+        Read a thumbnail from a segment file.
+
+        The memoryview remains valid even if the segment file is later
+        deleted.
+
+        :param segment: the segment file
+        :param offset: offset of the thumbnail in the segment file
+        :param length: length in bytes of the thumbnail
+        :return: the thumbnail, or None if it could not be read
+        """
+
+        end = offset + length
+        mapped = self.maps.get(segment)
+        if mapped is None or end > len(mapped):
+            # The segment file has not yet been mapped, or it has grown since it was
+            previous = mapped
+            try:
+                with open(os.path.join(self.path, segment), 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                logging.error("Could not read thumbnail segment file %s: %s", segment, e)
+                return None
+            if previous is not None:
+                self._close_map(previous)
+            self.maps[segment] = mapped
+        if end > len(mapped):
+            logging.error("Thumbnail segment file %s is shorter than expected", segment)
+            return None
+        return memoryview(mapped)[offset:end]
+
+    def remove(self, segment: str) -> None:
+        """
+        Delete a segment file
+
+        :param segment: the segment file
+        """
+
+        if segment == self.segment:
+            self.close_segment()
+        mapped = self.maps.pop(segment, None)
+        if mapped is not None:
+            self._close_map(mapped)
+        try:
+            os.remove(os.path.join(self.path, segment))
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        self.close_segment()
+        for mapped in self.maps.values():
+            self._close_map(mapped)
+        self.maps = dict()
+
+
 class ThumbnailCacheSql:
 
-    not_found = GetThumbnailPath(ThumbnailCacheDiskStatus.not_found, None, None, None)
+    """
+    Rapid Photo Downloader's thumbnail cache.
+
+    Thumbnails are saved either in their own file, or packed into segment
+    files. Thumbnails saved either way can be read, regardless of how new
+    thumbnails are saved.
+    """
+
+    not_found = GetThumbnailPath(ThumbnailCacheDiskStatus.not_found, None, None, None, None)
+
+    def __init__(self, create_table_if_not_exists: bool, batch_size: int=1,
+                 packed: bool=False) -> None:
+        """
+        :param create_table_if_not_exists: create the database table if
+         it does not already exist
+        :param batch_size: how many thumbnails to buffer before writing
+         them to the database. If greater than 1, flush() must be called
+         when finished saving thumbnails.
+        :param packed: if True, save thumbnails in segment files rather
+         than each in its own file
+        """
 
-    def __init__(self, create_table_if_not_exists: bool) -> None:
+        self.packed = packed
+
+        # Results of look_up_thumbnails(), keyed by uri, size and modification time
+        self.looked_up = dict()  # type: Dict[Tuple[str, int, float], Optional[InCache]]
         self.cache_dir = get_program_cache_directory(create_if_not_exist=True)
         self.valid = self.cache_dir is not None
         if not self.valid:
@@ -398,7 +593,10 @@ class ThumbnailCacheSql:
         else:
             self.random_filename = GenerateRandomFileName()
             self.md5 = MD5Name()
-            self.thumb_db = CacheSQL(self.cache_dir, create_table_if_not_exists)
+            self.thumb_db = CacheSQL(
+                self.cache_dir, create_table_if_not_exists, batch_size=batch_size
+            )
+            self.store = PackedThumbnailStore(os.path.join(self.cache_dir, 'packed'))
 
     def save_thumbnail(self, full_file_name: str, size: int,
                        mtime: float,
@@ -424,8 +622,8 @@ class ThumbnailCacheSql:
          resized. Will be ignored if generation_failed is True.
         :param camera_model: optional camera model. If the thumbnail is
          not from a camera, then should be None.
-        :return the path of the saved file, else None if operation
-        failed
+        :return the path of the saved file, or if packed the path of the
+        segment file, else None if operation failed
         """
 
         if not self.valid:
@@ -439,12 +637,18 @@ class ThumbnailCacheSql:
         else:
             logging.debug("Saving thumbnail for %s in RPD thumbnail cache", uri)
 
+        if self.packed and not generation_failed:
+            return self._save_packed_thumbnail(
+                uri=uri, size=size, mtime=mtime, mdatatime=mdatatime, md5_name=md5_name,
+                orientation_unknown=orientation_unknown, thumbnail=thumbnail
+            )
+
         try:
             self.thumb_db.add_thumbnail(uri=uri, size=size, mtime=mtime,
                                     mdatatime=mdatatime,
                                     md5_name=md5_name, orientation_unknown=orientation_unknown,
                                     failure=generation_failed)
-        except sqlite3.OperationalError as e:
+        except (sqlite3.OperationalError, RetryError) as e:
             logging.error("Database error adding thumbnail for %s: %s. Will not retry.", uri, e)
             return None
 
@@ -465,6 +669,35 @@ class ThumbnailCacheSql:
             return md5_full_name
         return None
 
+    def _save_packed_thumbnail(self, uri: str,
+                               size: int,
+                               mtime: float,
+                               mdatatime: float,
+                               md5_name: str,
+                               orientation_unknown: bool,
+                               thumbnail: QImage) -> Optional[str]:
+        buffer = QBuffer()
+        buffer.open(QIODevice.WriteOnly)
+        if not thumbnail.save(buffer, 'jpg', quality=75):
+            return None
+        data = bytes(buffer.data())
+        try:
+            segment, offset = self.store.append(data)
+        except OSError as e:
+            logging.error("Could not save thumbnail for %s: %s", uri, e)
+            return None
+
+        try:
+            self.thumb_db.add_thumbnail(
+                uri=uri, size=size, mtime=mtime, mdatatime=mdatatime, md5_name=md5_name,
+                orientation_unknown=orientation_unknown, failure=False, segment=segment,
+                offset=offset, length=len(data)
+            )
+        except (sqlite3.OperationalError, RetryError) as e:
+            logging.error("Database error adding thumbnail for %s: %s. Will not retry.", uri, e)
+            return None
+        return os.path.join(self.store.path, segment)
+
     def get_thumbnail_path(self, full_file_name: str, mtime, size: int,
                            camera_model: str=None) -> GetThumbnailPath:
         """
@@ -481,22 +714,38 @@ class ThumbnailCacheSql:
         :return a GetThumbnailPath tuple of (1) ThumbnailCacheDiskStatus,
          to indicate whether the thumbnail was found, a failure, or
          missing, (2) the path (including the md5 name), else None,
-         (3) the file's metadata time, and (4) a bool indicating whether
-         the orientation of the thumbnail is unknown
+         (3) the file's metadata time, (4) a bool indicating whether
+         the orientation of the thumbnail is unknown, and (5) if the
+         thumbnail is packed, its location, else None. Use
+         read_thumbnail() to read the thumbnail.
         """
 
         if not self.valid:
             return self.not_found
 
         uri = self.md5.get_uri(full_file_name, camera_model)
-        in_cache = self.thumb_db.have_thumbnail(uri, size, mtime)
+        key = (uri, size, mtime)
+        if key in self.looked_up:
+            in_cache = self.looked_up.pop(key)
+        else:
+            in_cache = self.thumb_db.have_thumbnail(uri, size, mtime)
 
         if in_cache is None:
             return self.not_found
 
         if in_cache.failure:
             return GetThumbnailPath(ThumbnailCacheDiskStatus.failure, None,
-                                    in_cache.mdatatime, None)
+                                    in_cache.mdatatime, None, None)
+
+        if in_cache.segment is not None:
+            # The segment file is checked when the thumbnail is read
+            return GetThumbnailPath(
+                ThumbnailCacheDiskStatus.found, None, in_cache.mdatatime,
+                in_cache.orientation_unknown,
+                PackedLocation(
+                    in_cache.md5_name, in_cache.segment, in_cache.offset, in_cache.length
+                )
+            )
 
         path = os.path.join(self.cache_dir, in_cache.md5_name)
         if not os.path.exists(path):
@@ -504,8 +753,88 @@ class ThumbnailCacheSql:
             return self.not_found
 
         return GetThumbnailPath(ThumbnailCacheDiskStatus.found, path,
-                                in_cache.mdatatime, in_cache.orientation_unknown)
+                                in_cache.mdatatime, in_cache.orientation_unknown, None)
+
+    def read_thumbnail(self, get_thumbnail: GetThumbnailPath,
+                       as_memoryview: bool=False) -> Optional[Union[bytes, memoryview]]:
+        """
+        Read a thumbnail found by get_thumbnail_path()
+
+        :param get_thumbnail: the value returned by get_thumbnail_path()
+        :param as_memoryview: if True, return a memoryview, which for
+         packed thumbnails avoids copying the thumbnail out of the
+         memory map of its segment file
+        :return: the thumbnail as a JPEG, or None if it could not be read
+        """
+
+        if get_thumbnail.disk_status != ThumbnailCacheDiskStatus.found:
+            return None
 
+        packed = get_thumbnail.packed  # type: PackedLocation
+        if packed is not None:
+            data = self.store.read(packed.segment, packed.offset, packed.length)
+            if data is None:
+                self.thumb_db.delete_thumbnails([packed.md5_name])
+                return None
+            self.thumb_db.thumbnail_accessed(packed.md5_name)
+            if as_memoryview:
+                return data
+            return data.tobytes()
+
+        try:
+            with open(get_thumbnail.path, 'rb') as thumbnail:
+                data = thumbnail.read()
+        except OSError as e:
+            logging.error("Could not read thumbnail %s: %s", get_thumbnail.path, e)
+            return None
+        if as_memoryview:
+            return memoryview(data)
+        return data
+
+
+    def look_up_thumbnails(self, files: Iterable[Tuple[str, float, int, Optional[str]]]) -> None:
+        """
+        Look up many files in the thumbnail database at once, so that
+        subsequent calls to get_thumbnail_path() for these files do not
+        need to query the database.
+
+        :param files: full path of the file (including file name),
+         modification time, size in bytes and camera model (None if not
+         from a camera) of each file
+        """
+
+        if not self.valid:
+            return
+
+        keys = [
+            (self.md5.get_uri(full_file_name, camera_model), size, mtime)
+            for full_file_name, mtime, size, camera_model in files
+        ]
+        try:
+            in_cache = self.thumb_db.have_thumbnails(keys)
+        except RetryError as e:
+            logging.error("Database error looking up %s thumbnails: %s", len(keys), e)
+            return
+        self.looked_up.update((key, in_cache.get(key)) for key in keys)
+
+    def flush(self) -> None:
+        """
+        Write any buffered thumbnails to the database
+        """
+
+        if self.valid:
+            try:
+                self.thumb_db.flush()
+            except RetryError as e:
+                logging.error("Database error saving thumbnails: %s", e)
+
+    def pending(self) -> bool:
+        """
+        :return: True if thumbnails are buffered and not yet written to
+         the database
+        """
+
+        return self.valid and len(self.thumb_db.pending) > 0
 
     def cleanup_cache(self, days: int=30) -> None:
         """
@@ -518,6 +847,14 @@ class ThumbnailCacheSql:
             i = 0
             now = time.time()
             deleted_thumbnails = []
+            if self.store.segments():
+                deleted = self.thumb_db.delete_packed_thumbnails(accessed_before=now - time_period)
+                if deleted:
+                    logging.debug(
+                        'Deleted {} packed thumbnails that had not been accessed for {} or more '
+                        'days'.format(deleted, days)
+                    )
+                self.compact()
             for name in os.listdir(self.cache_dir):
                 thumbnail = os.path.join(self.cache_dir, name)
                 if (os.path.isfile(thumbnail) and
@@ -540,6 +877,10 @@ class ThumbnailCacheSql:
         """
         if self.valid:
             if self.cache_dir is not None and os.path.isdir(self.cache_dir):
+                self.thumb_db.pending = []
+                self.thumb_db.accessed = []
+                self.thumb_db.close()
+                self.store.close()
                 # Delete the sqlite3 database too
                 shutil.rmtree(self.cache_dir)
 
@@ -563,21 +904,85 @@ class ThumbnailCacheSql:
         os.chdir(self.cache_dir)
         s = sum(os.path.getsize(f) for f in os.listdir('.') if os.path.isfile(f))
         os.chdir(cwd)
+        s += sum(
+            os.path.getsize(os.path.join(self.store.path, segment))
+            for segment in self.store.segments()
+        )
         return s
 
     def db_size(self) -> int:
         """
-        :return: the size in bytes of the sql database file
+        :return: the size in bytes of the sql database file, including its write-ahead log
+        """
+
+        if not self.valid:
+            return 0
+        size = os.path.getsize(self.thumb_db.db)
+        wal = '{}-wal'.format(self.thumb_db.db)
+        if os.path.exists(wal):
+            size += os.path.getsize(wal)
+        return size
+
+    def compact(self, threshold: float=0.5, min_age: float=60.0) -> int:
+        """
+        Rewrite segment files in which less than a proportion of the space
+        is used by thumbnails in the database, and delete segment files
+        with no thumbnails in the database.
+
+        Should only be called when no other process is saving thumbnails.
+
+        :param threshold: proportion of a segment file that must be used
+         for it not to be rewritten
+        :param min_age: seconds since a segment file was modified before
+         it can be rewritten, in case another process is still
+         appending to it
+        :return: bytes freed
         """
 
         if not self.valid:
             return 0
-        return os.path.getsize(self.thumb_db.db)
+
+        # Thumbnails looked up in bulk may be about to move
+        self.looked_up = dict()
+        usage = self.thumb_db.segment_usage()
+        now = time.time()
+        freed = 0
+        for segment in self.store.segments():
+            full_name = os.path.join(self.store.path, segment)
+            try:
+                stat = os.stat(full_name)
+            except FileNotFoundError:
+                continue
+            used = usage.get(segment, 0)
+            if segment == self.store.segment or stat.st_mtime > now - min_age or \
+                    used >= stat.st_size * threshold:
+                continue
+            if used:
+                moves = []
+                try:
+                    for thumbnail in self.thumb_db.packed_thumbnails(segment):
+                        data = self.store.read(segment, thumbnail.offset, thumbnail.length)
+                        if data is not None:
+                            new_segment, new_offset = self.store.append(data)
+                            moves.append((new_segment, new_offset, thumbnail.rowid))
+                    self.store.sync()
+                except OSError as e:
+                    logging.error("Could not compact thumbnail segment file %s: %s", segment, e)
+                    continue
+                self.thumb_db.move_packed_thumbnails(moves)
+                logging.debug(
+                    "Compacted %s thumbnails from segment file %s", len(moves), segment
+                )
+            self.store.remove(segment)
+            freed += stat.st_size - used
+        self.store.close_segment()
+        return freed
 
     def optimize(self) -> Tuple[int, int, int]:
         """
         Check for any thumbnails in the db that are not in the file system
         Check for any thumbnails exist on the file system that are not in the db
+        Compact segment files of packed thumbnails
         Vacuum the db
 
         :return db rows removed, file system photos removed, db size reduction in bytes
@@ -591,8 +996,13 @@ class ThumbnailCacheSql:
         to_delete_from_db = {md5 for md5 in rows if not os.path.exists(md5)}
         if len(to_delete_from_db):
             self.thumb_db.delete_thumbnails(list(to_delete_from_db))
+        db_rows_removed = len(to_delete_from_db)
 
-        md5s = {md5 for md5 in os.listdir('.')} - {self.thumb_db.db_fs_name()}
+        db_name = self.thumb_db.db_fs_name()
+        # Exclude the database and its write-ahead log and shared memory files
+        md5s = {md5 for md5 in os.listdir('.') if os.path.isfile(md5)} - {
+            db_name, '{}-wal'.format(db_name), '{}-shm'.format(db_name)
+        }
         to_delete_from_fs = md5s - rows
         if len(to_delete_from_fs):
             for md5 in to_delete_from_fs:
@@ -600,10 +1010,21 @@ class ThumbnailCacheSql:
 
         os.chdir(cwd)
 
+        segments = set(self.store.segments())
+        missing_segments = set(self.thumb_db.segment_usage()) - segments
+        if missing_segments:
+            deleted = self.thumb_db.delete_packed_thumbnails(segments=list(missing_segments))
+            db_rows_removed += deleted
+            logging.debug(
+                "Removed %s packed thumbnails in missing segment files from the database", deleted
+            )
+        # Other processes may still be appending to recently modified segment files
+        self.compact()
+
         size = self.db_size()
         self.thumb_db.vacuum()
 
-        return len(to_delete_from_db), len(to_delete_from_fs), size - self.db_size()
+        return db_rows_removed, len(to_delete_from_fs), size - self.db_size()
 
 
 if __name__ == '__main__':
@@ -25,9 +25,11 @@ __copyright__ = "Copyright 2015-2020, Damon Lynch. Copyright 2012-2015 Jim Easte
 import logging
 import os
 import io
+import queue
+import threading
 from collections import namedtuple
 import re
-from typing import Optional, List, Tuple, Union
+from typing import Optional, List, Tuple, Union, Dict
 
 import gphoto2 as gp
 from raphodo.storage import StorageSpace
@@ -135,6 +137,223 @@ class CameraProblemEx(CameraError):
             return str(super())
 
 
+class FanOutFile:
+    """
+    An additional file a ChunkWriter writes each chunk to, e.g. a backup.
+
+    An error writing to it does not affect the other files being written:
+    the partially written file is removed, and no more chunks are written
+    to it.
+    """
+
+    def __init__(self, full_file_name: str) -> None:
+        self.full_file_name = full_file_name
+        self.bytes_written = 0
+        # The error that caused writing to fail, if any
+        self.exception = None  # type: Optional[OSError]
+        self.dest_file = None
+
+    @property
+    def failed(self) -> bool:
+        return self.exception is not None
+
+    def fail(self, exception: OSError) -> None:
+        if self.exception is None:
+            logging.error(
+                "Error writing %s. Error %s: %s",
+                self.full_file_name, exception.errno, exception.strerror
+            )
+            self.exception = exception
+        self.close()
+        self.remove()
+
+    def close(self) -> None:
+        if self.dest_file is not None:
+            dest_file = self.dest_file
+            self.dest_file = None
+            try:
+                dest_file.close()
+            except OSError as ex:
+                self.fail(ex)
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.full_file_name)
+        except OSError:
+            pass
+
+
+class ChunkWriter:
+    """
+    Write chunks of a file to disk in a separate thread, using a fixed number
+    of reusable buffers.
+
+    To write a chunk, get a buffer, fill it, and pass it to write(). The
+    buffer is returned to the pool once the chunk has been written.
+
+    The same chunks can also be written to other files, each in its own
+    thread. The buffers are shared: a buffer is returned to the pool only
+    once it has been written to every file.
+    """
+
+    def __init__(self, dest_full_filename: str,
+                 chunk_size: int,
+                 hasher=None,
+                 keep_bytes: bool=False,
+                 no_buffers: Optional[int]=None,
+                 fan_out: Optional[List[FanOutFile]]=None) -> None:
+        """
+        :param dest_full_filename: the file to write to. It is opened
+         immediately, which will raise OSError if it cannot be.
+        :param chunk_size: size of the buffers
+        :param hasher: if specified, a hash object to update with each chunk
+        :param keep_bytes: if True, accumulate the chunks in file_bytes
+        :param no_buffers: how many buffers to allocate. Two allows one buffer
+         to be filled while the other is written. Defaults to two, plus one
+         for each fan out file.
+        :param fan_out: other files to write the chunks to. Unlike
+         dest_full_filename, a file that cannot be written to does not
+         raise an error.
+        """
+
+        self.dest_name = dest_full_filename
+        self.dest_file = io.open(dest_full_filename, 'wb')
+        self.hasher = hasher
+        self.file_bytes = bytearray() if keep_bytes else None  # type: Optional[bytearray]
+        # The first error encountered while writing
+        self.exception = None  # type: Optional[OSError]
+
+        self.fan_out = fan_out or []  # type: List[FanOutFile]
+        for destination in self.fan_out:
+            try:
+                destination.dest_file = io.open(destination.full_file_name, 'wb')
+            except OSError as ex:
+                destination.fail(ex)
+
+        if no_buffers is None:
+            no_buffers = 2 + len(self.fan_out)
+        self.free_buffers = queue.Queue()
+        for i in range(no_buffers):
+            self.free_buffers.put(memoryview(bytearray(chunk_size)))
+
+        # Buffer id: how many threads are yet to write the buffer
+        self.pending = dict()  # type: Dict[int, int]
+        self.pending_lock = threading.Lock()
+
+        self.threads = []  # type: List[threading.Thread]
+        self.queues = []  # type: List[queue.Queue]
+        for destination in [None] + self.fan_out:
+            chunks = queue.Queue()
+            thread = threading.Thread(
+                target=self._write_chunks, args=(destination, chunks), daemon=True
+            )
+            self.queues.append(chunks)
+            self.threads.append(thread)
+            thread.start()
+
+    def _write_chunks(self, destination: Optional[FanOutFile], chunks: queue.Queue) -> None:
+        """
+        Write chunks to the primary destination if destination is None,
+        else to the fan out file
+        """
+
+        while True:
+            item = chunks.get()
+            if item is None:
+                break
+            buffer, length = item
+            if length:
+                chunk = buffer[:length]
+                if destination is None:
+                    self._write_chunk(chunk)
+                elif destination.dest_file is not None:
+                    try:
+                        destination.dest_file.write(chunk)
+                    except OSError as ex:
+                        destination.fail(ex)
+                    else:
+                        destination.bytes_written += length
+            self._release_buffer(buffer)
+
+    def _write_chunk(self, chunk: memoryview) -> None:
+        if self.exception is None:
+            try:
+                self.dest_file.write(chunk)
+            except OSError as ex:
+                self.exception = ex
+            else:
+                if self.hasher is not None:
+                    self.hasher.update(chunk)
+                if self.file_bytes is not None:
+                    self.file_bytes += chunk
+
+    def _release_buffer(self, buffer: memoryview) -> None:
+        with self.pending_lock:
+            self.pending[id(buffer)] -= 1
+            free = not self.pending[id(buffer)]
+        if free:
+            self.free_buffers.put(buffer)
+
+    def get_buffer(self) -> memoryview:
+        """
+        :return: a buffer to fill, waiting if all buffers are being written
+        """
+
+        return self.free_buffers.get()
+
+    def write(self, buffer: memoryview, length: int) -> None:
+        """
+        Queue the buffer to be written.
+
+        :param buffer: buffer returned by get_buffer()
+        :param length: how many bytes of the buffer to write
+        """
+
+        with self.pending_lock:
+            self.pending[id(buffer)] = len(self.queues)
+        for chunks in self.queues:
+            chunks.put((buffer, length))
+
+    def _finish(self) -> None:
+        for chunks in self.queues:
+            chunks.put(None)
+        for thread in self.threads:
+            thread.join()
+        for destination in self.fan_out:
+            destination.close()
+
+    def close(self) -> None:
+        """
+        Wait for all queued chunks to be written, and close the files.
+
+        Raises the first error encountered while writing the primary
+        destination, if any. Errors writing fan out files are recorded in
+        each file's exception.
+        """
+
+        self._finish()
+        self.dest_file.close()
+        if self.exception is not None:
+            raise self.exception
+
+    def abandon(self) -> None:
+        """
+        Stop writing and remove the partially written files, including any
+        fan out files.
+        """
+
+        try:
+            self.close()
+        except OSError:
+            pass
+        try:
+            os.remove(self.dest_name)
+        except OSError:
+            pass
+        for destination in self.fan_out:
+            destination.remove()
+
+
 def generate_devname(camera_port: str) -> Optional[str]:
     """
      Generate udev DEVNAME.
@@ -572,8 +791,17 @@ class Camera:
                             progress_callback,
                             check_for_command,
                             return_file_bytes = False,
-                            chunk_size=1048576) -> Optional[bytes]:
+                            chunk_size=1048576,
+                            hasher=None,
+                            fan_out: Optional[List[FanOutFile]]=None) -> Optional[bytearray]:
         """
+        Save the file from the camera to a local destination, writing each
+        chunk to disk as soon as it has been read.
+
+        Chunks are written in a separate thread, so that reading the next chunk
+        from the camera overlaps with writing the previous one. Memory use is
+        bounded by the chunk size, regardless of the size of the file.
+
         :param dir_name: directory on the camera
         :param file_name: the photo or video
         :param size: the size of the file in bytes
@@ -582,31 +810,50 @@ class Camera:
         :param progress_callback: a function with which to update
          copy progress
         :param check_for_command: a function with which to check to see
-         if the execution should pause, resume or stop
+         if the execution should pause, resume or stop. If it stops
+         the execution, the partially written files are removed.
         :param return_file_bytes: if True, return a copy of the file's
          bytes, else make that part of the return value None
         :param chunk_size: the size of the chunks to copy. The default
          is 1MB.
-        :return: True if the file was successfully saved, else False,
-         and the bytes that were copied
+        :param hasher: if specified, a hash object (e.g. from hashlib)
+         to update with each chunk as it is written
+        :param fan_out: if specified, other files to simultaneously write
+         the chunks to, e.g. backups. Errors writing them are recorded in
+         each file's exception, rather than raised.
+        :return: the bytes that were copied if return_file_bytes is True,
+         else None
         """
 
-        src_bytes = None
-        view = memoryview(bytearray(size))
+        try:
+            writer = ChunkWriter(
+                dest_full_filename=dest_full_filename, chunk_size=chunk_size, hasher=hasher,
+                keep_bytes=return_file_bytes, fan_out=fan_out
+            )
+        except (OSError, PermissionError) as ex:
+            logging.error(
+                'Error saving file %s from camera %s. Error %s: %s',
+                os.path.join(dir_name, file_name), self.display_name, ex.errno, ex.strerror
+            )
+            raise CameraProblemEx(code=CameraErrorCode.write, py_exception=ex)
+
         amount_downloaded = 0
-        for offset in range(0, size, chunk_size):
-            check_for_command()
-            stop = min(offset + chunk_size, size)
+        while amount_downloaded < size and writer.exception is None:
+            try:
+                check_for_command()
+            except SystemExit:
+                # The download was stopped
+                writer.abandon()
+                raise
+            buffer = writer.get_buffer()
+            to_read = min(chunk_size, size - amount_downloaded)
             try:
                 bytes_read = gp.check_result(
                     self.camera.file_read(
-                        dir_name, file_name, gp.GP_FILE_TYPE_NORMAL, offset, view[offset:stop],
-                        self.context
+                        dir_name, file_name, gp.GP_FILE_TYPE_NORMAL, amount_downloaded,
+                        buffer[:to_read], self.context
                     )
                 )
-                amount_downloaded += bytes_read
-                if progress_callback is not None:
-                    progress_callback(amount_downloaded, size)
             except gp.GPhoto2Error as ex:
                 logging.error(
                     'Error copying file %s from camera %s: %s',
@@ -615,25 +862,34 @@ class Camera:
                 )
                 if progress_callback is not None:
                     progress_callback(size, size)
+                writer.abandon()
                 raise CameraProblemEx(code=CameraErrorCode.read, gp_exception=ex)
 
-        dest_file = None
+            writer.write(buffer, bytes_read)
+            if not bytes_read:
+                logging.warning(
+                    'Reached end of file %s from camera %s after %s of %s bytes',
+                    os.path.join(dir_name, file_name), self.display_name,
+                    amount_downloaded, size
+                )
+                break
+            amount_downloaded += bytes_read
+            if progress_callback is not None:
+                progress_callback(amount_downloaded, size)
+
         try:
-            dest_file = io.open(dest_full_filename, 'wb')
-            src_bytes = view.tobytes()
-            dest_file.write(src_bytes)
-            dest_file.close()
+            writer.close()
         except (OSError, PermissionError) as ex:
             logging.error(
                 'Error saving file %s from camera %s. Error %s: %s',
                 os.path.join(dir_name, file_name), self.display_name, ex.errno, ex.strerror
             )
-            if dest_file is not None:
-                dest_file.close()
+            if progress_callback is not None and amount_downloaded < size:
+                progress_callback(size, size)
             raise CameraProblemEx(code=CameraErrorCode.write, py_exception=ex)
 
         if return_file_bytes:
-            return src_bytes
+            return writer.file_bytes
 
     def get_thumbnail(self, dir_name: str,
                       file_name: str,
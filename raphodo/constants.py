@@ -342,6 +342,20 @@ class CameraErrorCode(Enum):
     write = 4
 
 
+# How files are copied from a file system: reading and writing in Python, or letting the
+# kernel do the copy (reflink, copy_file_range or sendfile), falling back to Python as needed
+class CopyEngine(IntEnum):
+    python = 1
+    kernel = 2
+
+
+# Algorithm used to generate the digest of a file's contents when verifying files
+class HashAlgorithm(IntEnum):
+    md5 = 1
+    blake2b = 2
+    xxhash = 3
+
+
 class ViewRowType(Enum):
     header = 1
     content = 2
@@ -24,6 +24,7 @@ __copyright__ = "Copyright 2011-2020, Damon Lynch"
 import os
 import sys
 import errno
+import fcntl
 import io
 import shutil
 import stat
@@ -33,7 +34,7 @@ import pickle
 from operator import attrgetter
 from itertools import chain
 from collections import defaultdict
-from typing import Dict, Optional, Tuple
+from typing import Dict, Optional, Tuple, List, Callable
 import locale
 try:
     # Use the default locale as defined by the LANG variable
@@ -42,15 +43,24 @@ except locale.Error:
     pass
 
 import gphoto2 as gp
+try:
+    import xxhash
+    have_xxhash = True
+except ImportError:
+    have_xxhash = False
 
 from raphodo.camera import (
-    Camera, CameraProblemEx, gphoto2_python_logging
+    Camera, CameraProblemEx, gphoto2_python_logging, ChunkWriter, FanOutFile
 )
 from raphodo.interprocess import (
-    WorkerInPublishPullPipeline, CopyFilesArguments, CopyFilesResults
+    WorkerInPublishPullPipeline, CopyFilesArguments, CopyFilesResults, BackupFanOutDestination
+)
+from raphodo.constants import (
+    FileType, DownloadStatus, CameraErrorCode, CopyEngine, HashAlgorithm, DeviceType
+)
+from raphodo.utilities import (
+    GenerateRandomFileName, create_temp_dir, create_temp_dirs, same_device
 )
-from raphodo.constants import (FileType, DownloadStatus, CameraErrorCode)
-from raphodo.utilities import (GenerateRandomFileName, create_temp_dirs, same_device)
 from raphodo.rpdfile import RPDFile
 from raphodo.problemnotification import (
     CopyingProblems, CameraFileReadProblem, FileWriteProblem, FileMoveProblem, FileDeleteProblem,
@@ -59,6 +69,9 @@ from raphodo.problemnotification import (
 from raphodo.storage import get_uri
 from raphodo.preferences import Preferences
 from raphodo.rescan import RescanCamera
+from raphodo.ioscheduler import (
+    usb_bus_from_camera_port, source_key_for_path, destination_key_for_path
+)
 
 
 def copy_file_metadata(src: str, dst: str) -> Optional[Tuple]:
@@ -122,14 +135,135 @@ def copy_camera_file_metadata(mtime: float, dst: str) -> Optional[Tuple]:
         return inst,  # note the comma: return a Tuple
 
 
+# Linux ioctl to share the extents of one file with another, i.e. a reflink.
+# Value from linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# Error codes indicating a kernel copy mechanism cannot be used with this pair of files, in
+# which case the next mechanism should be tried
+kernel_copy_unsupported = {
+    errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF,
+    errno.ETXTBSY, getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP)
+}
+
+
+def reflink_file(src_fd: int, dest_fd: int) -> bool:
+    """
+    Attempt to clone the source file into the destination file without copying any data.
+
+    Only file systems like btrfs and XFS support this, and only when both
+    files are on the same file system.
+
+    :param src_fd: file descriptor of the source file, opened for reading
+    :param dest_fd: file descriptor of the destination file, opened for writing
+    :return: True if the clone succeeded, else False
+    """
+
+    try:
+        fcntl.ioctl(dest_fd, FICLONE, src_fd)
+    except OSError:
+        return False
+    return True
+
+
+def _copy_file_range(src_fd: int, dest_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dest_fd, count, offset, offset)
+
+
+def _sendfile(src_fd: int, dest_fd: int, offset: int, count: int) -> int:
+    # sendfile writes at the destination's current file position
+    os.lseek(dest_fd, offset, os.SEEK_SET)
+    return os.sendfile(dest_fd, src_fd, offset, count)
+
+
+def kernel_copy_functions() -> List[Tuple[str, Callable[[int, int, int, int], int]]]:
+    """
+    :return: names and functions of the kernel copy mechanisms available to this
+     Python, in order of preference
+    """
+
+    functions = []
+    if hasattr(os, 'copy_file_range'):
+        functions.append(('copy_file_range', _copy_file_range))
+    if hasattr(os, 'sendfile'):
+        functions.append(('sendfile', _sendfile))
+    return functions
+
+
+def available_hash_algorithm(algorithm: HashAlgorithm) -> HashAlgorithm:
+    """
+    Determine the hash algorithm to use, taking into account which
+    algorithms are available to this Python.
+
+    :param algorithm: the preferred algorithm
+    :return: the preferred algorithm if available, else the best alternative
+    """
+
+    if algorithm == HashAlgorithm.xxhash and not have_xxhash:
+        logging.warning("Python package xxhash is not installed: verifying files using blake2b")
+        algorithm = HashAlgorithm.blake2b
+    if algorithm == HashAlgorithm.blake2b and not hasattr(hashlib, 'blake2b'):
+        # Introduced in Python 3.6
+        algorithm = HashAlgorithm.md5
+    return algorithm
+
+
+def new_hasher(algorithm: HashAlgorithm):
+    """
+    :param algorithm: an algorithm returned by available_hash_algorithm()
+    :return: a hash object that can be incrementally updated
+    """
+
+    if algorithm == HashAlgorithm.xxhash:
+        return xxhash.xxh64()
+    if algorithm == HashAlgorithm.blake2b:
+        return hashlib.blake2b()
+    return hashlib.md5()
+
+
+def hash_file(full_file_name: str, algorithm: HashAlgorithm,
+              chunk_size: int=1024 * 1024) -> str:
+    """
+    Generate the digest of a file's contents, reading it in chunks.
+
+    :param full_file_name: file to read
+    :param algorithm: an algorithm returned by available_hash_algorithm()
+    :param chunk_size: amount of the file to read at a time
+    :return: the hex digest
+    """
+
+    hasher = new_hasher(algorithm)
+    with open(full_file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class BackupFanOut(FanOutFile):
+    """
+    A backup written while a file is being downloaded
+    """
+
+    def __init__(self, device_id: int, full_file_name: str) -> None:
+        super().__init__(full_file_name)
+        self.device_id = device_id
+        self.bytes_reported = 0
+
+
 class FileCopy:
     """
     Used by classes CopyFilesWorker and BackupFilesWorker
     """
     def __init__(self):
         self.io_buffer = 1024 * 1024
+        # How much the kernel should copy between checks for pause / stop directives
+        self.kernel_copy_chunk = 4 * 1024 * 1024
         self.batch_size_bytes = 5 * 1024 * 1024
         self.dest = self.src = None
+        self.copy_engine = CopyEngine.kernel
+        self.hash_algorithm = HashAlgorithm.md5
+        # Digest of the file most recently copied, when verifying files
+        self.digest = ''
 
         self.bytes_downloaded = 0
         self.total_downloaded = 0
@@ -143,15 +277,132 @@ class FileCopy:
     def init_copy_progress(self) -> None:
         self.bytes_downloaded = 0
 
-    def copy_from_filesystem(self, source: str, destination: str, rpd_file: RPDFile) -> bool:
-        src_chunks = []
+    def copy_using_kernel(self, total: int) -> Tuple[int, bool]:
+        """
+        Copy the source file to the destination file without the file contents
+        passing through Python.
+
+        First attempts a reflink, then copy_file_range(), then sendfile().
+        A mechanism the file systems do not support is skipped in favor of
+        the next. A mechanism is only considered unsupported if it fails
+        before any bytes were copied: an error after that is a genuine copy
+        error, and is raised.
+
+        :param total: the size of the file in bytes
+        :return: the number of bytes copied, and whether the copy completed.
+         If it did not complete, no bytes were copied and the caller must copy
+         the file itself.
+        """
+
+        src_fd = self.src.fileno()
+        dest_fd = self.dest.fileno()
+
+        self.check_for_controller_directive()
+        if reflink_file(src_fd, dest_fd):
+            self.update_progress(total, total)
+            return total, True
+
+        amount_downloaded = 0
+        for name, copy_function in kernel_copy_functions():
+            try:
+                while True:
+                    # first check if process is being stopped or paused
+                    self.check_for_controller_directive()
+
+                    copied = copy_function(
+                        src_fd, dest_fd, amount_downloaded, self.kernel_copy_chunk
+                    )
+                    if not copied:
+                        return amount_downloaded, True
+                    amount_downloaded += copied
+                    self.update_progress(amount_downloaded, total)
+            except OSError as e:
+                if e.errno not in kernel_copy_unsupported or amount_downloaded:
+                    raise
+                logging.debug(
+                    "Kernel copy using %s is unavailable (%s): falling back", name, e.strerror
+                )
+
+        return amount_downloaded, False
+
+    def copy_with_fan_out(self, destination: str, total: int,
+                          fan_out: List[FanOutFile]) -> None:
+        """
+        Copy the open source file to the destination and simultaneously to
+        the fan out files, reading each chunk of the source only once.
+
+        Raises OSError if the source cannot be read or the destination
+        cannot be written.
+
+        :param destination: full path of the destination file
+        :param total: the size of the file in bytes
+        :param fan_out: other files to write to
+        """
+
+        if self.verify_file:
+            hasher = new_hasher(self.hash_algorithm)
+        else:
+            hasher = None
+
+        writer = ChunkWriter(
+            dest_full_filename=destination, chunk_size=self.io_buffer, hasher=hasher,
+            fan_out=fan_out
+        )
+        amount_downloaded = 0
         try:
+            while writer.exception is None:
+                # first check if process is being stopped or paused
+                self.check_for_controller_directive()
+
+                buffer = writer.get_buffer()
+                bytes_read = self.src.readinto(buffer)
+                writer.write(buffer, bytes_read)
+                if not bytes_read:
+                    break
+                amount_downloaded += bytes_read
+                self.update_progress(amount_downloaded, total)
+        except OSError:
+            writer.abandon()
+            raise
+        writer.close()
+
+        if self.verify_file:
+            self.digest = hasher.hexdigest()
+
+    def copy_from_filesystem(self, source: str, destination: str, rpd_file: RPDFile,
+                             fan_out: Optional[List[FanOutFile]]=None) -> bool:
+        """
+        Copy a file from a file system. When verifying files, the digest of
+        the bytes read is generated while the file is copied and stored in
+        self.digest.
+
+        :param fan_out: other files to write the file to while copying it,
+         e.g. backups. Errors writing them are recorded in each file's
+         exception, rather than causing the copy to fail.
+        :return: True if the copy succeeded, else False
+        """
+
+        self.digest = ''
+        try:
+            if fan_out:
+                self.src = io.open(source, 'rb', self.io_buffer)
+                self.copy_with_fan_out(destination, rpd_file.size, fan_out)
+                self.src.close()
+                return True
+
             self.dest = io.open(destination, 'wb', self.io_buffer)
             self.src = io.open(source, 'rb', self.io_buffer)
             total = rpd_file.size
             amount_downloaded = 0
+            copied = False
+            if self.verify_file:
+                hasher = new_hasher(self.hash_algorithm)
+
+            # Verifying the file requires its contents to pass through Python
+            if self.copy_engine == CopyEngine.kernel and not self.verify_file:
+                amount_downloaded, copied = self.copy_using_kernel(total)
 
-            while True:
+            while not copied:
                 # first check if process is being stopped or paused
                 self.check_for_controller_directive()
 
@@ -159,7 +410,7 @@ class FileCopy:
                 if chunk:
                     self.dest.write(chunk)
                     if self.verify_file:
-                        src_chunks.append(chunk)
+                        hasher.update(chunk)
                     amount_downloaded += len(chunk)
                     self.update_progress(amount_downloaded, total)
                 else:
@@ -168,8 +419,7 @@ class FileCopy:
             self.src.close()
 
             if self.verify_file:
-                src_bytes = b''.join(src_chunks)
-                rpd_file.md5 = hashlib.md5(src_bytes).hexdigest()
+                self.digest = hasher.hexdigest()
 
             return True
         except (OSError, FileNotFoundError, PermissionError) as e:
@@ -222,8 +472,69 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
         if self.camera is not None:
             if self.camera.camera_initialized:
                 self.camera.free_camera()
+        self.release_io()
         self.send_problems()
 
+    def request_io(self, destination: str) -> None:
+        """
+        Wait for the I/O scheduler in the main process to grant permission to
+        copy from this device to the destination.
+
+        Permission is kept across files until io_quantum bytes have been
+        copied, to avoid a round trip to the main process for every small file.
+
+        :param destination: key identifying the destination file system
+        """
+
+        if self.io_destination == destination and self.io_bytes_copied < self.io_quantum:
+            return
+
+        self.content = pickle.dumps(
+            CopyFilesResults(scan_id=self.scan_id, io_request=(self.io_source, destination)),
+            pickle.HIGHEST_PROTOCOL
+        )
+        self.send_message_to_sink()
+        self.io_requested = True
+        self.wait_for_io_grant()
+        self.io_destination = destination
+        self.io_bytes_copied = 0
+
+    def wait_for_io_grant(self) -> None:
+        """
+        Wait for permission to copy, while continuing to respond to
+        pause, resume and stop commands
+        """
+
+        granted = paused = False
+        while paused or not granted:
+            worker_id, command = self.controller.recv_multipart()
+            assert command in (b'GO', b'PAUSE', b'RESUME', b'STOP')
+            if command == b'GO':
+                granted = True
+            elif command == b'PAUSE':
+                paused = True
+            elif command == b'RESUME':
+                paused = False
+            else:
+                self.cleanup_pre_stop()
+                # before finishing, signal to sink that we've terminated
+                self.sender.send_multipart([self.worker_id, b'cmd', b'STOPPED'])
+                sys.exit(0)
+
+    def release_io(self) -> None:
+        """
+        Release permission to copy, or cancel the request for it
+        """
+
+        if self.io_requested:
+            self.io_requested = False
+            self.io_destination = None
+            self.content = pickle.dumps(
+                CopyFilesResults(scan_id=self.scan_id, io_release=True),
+                pickle.HIGHEST_PROTOCOL
+            )
+            self.send_message_to_sink()
+
     def send_problems(self) -> None:
         """
         Send problems encountered copying to the main process.
@@ -260,21 +571,111 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                     chunk_downloaded=chunk_downloaded),
                pickle.HIGHEST_PROTOCOL)
             self.send_message_to_sink()
+            self.send_fan_out_progress()
 
             # if amount_downloaded == total:
             #     self.bytes_downloaded = 0
 
+    def send_fan_out_progress(self) -> None:
+        """
+        Update the main process about how many bytes have been written to
+        backup devices while copying the current file
+        """
+
+        chunk_downloaded = 0
+        for backup in self.fan_out:
+            chunk_downloaded += backup.bytes_written - backup.bytes_reported
+            backup.bytes_reported = backup.bytes_written
+        if chunk_downloaded:
+            self.content = pickle.dumps(
+                CopyFilesResults(scan_id=self.scan_id, backup_chunk_downloaded=chunk_downloaded),
+                pickle.HIGHEST_PROTOCOL
+            )
+            self.send_message_to_sink()
+
+    def init_fan_out(self, temp_dirs: List[Tuple[int, str]], temp_full_file_name: str) -> None:
+        """
+        Prepare to write backups while copying a file
+
+        :param temp_dirs: backup device id and temporary directory on that
+         device, for the file's type
+        :param temp_full_file_name: the temporary file the file is being
+         copied to
+        """
+
+        temp_file_name = os.path.basename(temp_full_file_name)
+        self.fan_out = [
+            BackupFanOut(device_id=device_id, full_file_name=os.path.join(temp_dir, temp_file_name))
+            for device_id, temp_dir in temp_dirs
+        ]
+
+    def finish_fan_out(self, rpd_file: RPDFile, copy_succeeded: bool) -> None:
+        """
+        Record the backups written while copying a file, so the backup
+        process can move them into place instead of copying the file again.
+
+        :param rpd_file: the file that was copied
+        :param copy_succeeded: whether the file was copied successfully. If
+         it was not, the backups are removed.
+        """
+
+        self.send_fan_out_progress()
+        for backup in self.fan_out:
+            if copy_succeeded and not backup.failed:
+                full_file_name = backup.full_file_name
+            else:
+                backup.remove()
+                full_file_name = ''
+            rpd_file.backup_fan_out[backup.device_id] = (full_file_name, backup.bytes_reported)
+
+    def create_backup_temp_dirs(self, destinations: List[BackupFanOutDestination]) \
+            -> Dict[FileType, List[Tuple[int, str]]]:
+        """
+        Create temporary directories on the backup devices, into which
+        backups are written while files are downloaded.
+
+        A backup device on which a directory cannot be created is skipped:
+        the backup process will back up the files in the usual way.
+
+        :param destinations: backup devices to write to
+        :return: backup device id and temporary directory, by file type
+        """
+
+        temp_dirs = defaultdict(list)  # type: Dict[FileType, List[Tuple[int, str]]]
+        for destination in destinations:
+            try:
+                os.makedirs(destination.path, exist_ok=True)
+            except OSError as e:
+                logging.error(
+                    "Failed to create backup folder %s: %s", destination.path, e.strerror
+                )
+                continue
+            temp_dir = create_temp_dir(destination.path)
+            if temp_dir is not None:
+                logging.debug(
+                    "%s backup temporary directory: %s",
+                    destination.file_type.name.capitalize(), temp_dir
+                )
+                temp_dirs[destination.file_type].append((destination.device_id, temp_dir))
+        return temp_dirs
+
     def copy_from_camera(self, rpd_file: RPDFile) -> bool:
 
+        if self.verify_file:
+            hasher = new_hasher(self.hash_algorithm)
+        else:
+            hasher = None
+
         try:
-            src_bytes = self.camera.save_file_by_chunks(
+            self.camera.save_file_by_chunks(
                 dir_name=rpd_file.path,
                 file_name=rpd_file.name,
                 size=rpd_file.size,
                 dest_full_filename=rpd_file.temp_full_file_name,
                 progress_callback=self.update_progress,
                 check_for_command=self.check_for_controller_directive,
-                return_file_bytes=self.verify_file
+                hasher=hasher,
+                fan_out=self.fan_out
             )
         except CameraProblemEx as e:
             name = rpd_file.name
@@ -289,7 +690,7 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
             return False
 
         if self.verify_file:
-            rpd_file.md5 = hashlib.md5(src_bytes).hexdigest()
+            self.digest = hasher.hexdigest()
 
         return True
 
@@ -343,14 +744,33 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
         return temp_full_name
 
     def do_work(self):
+        # I/O scheduling: see request_io()
+        self.io_requested = False
+        self.io_destination = None  # type: Optional[str]
+        self.io_bytes_copied = 0
+        self.io_quantum = 64 * 1024 * 1024
+
+        try:
+            self.copy_files()
+        finally:
+            # Should copying fail unexpectedly, do not leave other devices waiting for
+            # permission to copy
+            self.release_io()
+
+    def copy_files(self) -> None:
         self.problems = CopyingProblems()
         args = pickle.loads(self.content)  # type: CopyFilesArguments
 
+        # Backups being written while the current file is copied
+        self.fan_out = []  # type: List[BackupFanOut]
+
         if args.log_gphoto2:
             self.gphoto2_logging = gphoto2_python_logging()
 
         self.scan_id = args.scan_id
         self.verify_file = args.verify_file
+        self.copy_engine = args.copy_engine
+        self.hash_algorithm = available_hash_algorithm(args.hash_algorithm)
 
         self.camera = None
 
@@ -398,13 +818,28 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
 
         photo_temp_dir, video_temp_dir = create_temp_dirs(
             args.photo_download_folder, args.video_download_folder)
+        backup_temp_dirs = self.create_backup_temp_dirs(args.backup_fan_out)
+
+        if args.device.device_type == DeviceType.camera:
+            self.io_source = usb_bus_from_camera_port(args.device.camera_port) or \
+                             'camera:{}'.format(args.device.camera_port)
+        else:
+            self.io_source = source_key_for_path(args.device.path)
+        io_destinations = {
+            FileType.photo: destination_key_for_path(photo_temp_dir or ''),
+            FileType.video: destination_key_for_path(video_temp_dir or '')
+        }
 
         # Notify main process of temp directory names
         self.content = pickle.dumps(
             CopyFilesResults(
                 scan_id=args.scan_id,
                 photo_temp_dir=photo_temp_dir or '',
-                video_temp_dir=video_temp_dir or ''
+                video_temp_dir=video_temp_dir or '',
+                backup_temp_dirs=[
+                    temp_dir for temp_dirs in backup_temp_dirs.values()
+                    for device_id, temp_dir in temp_dirs
+                ]
             ),
             pickle.HIGHEST_PROTOCOL
         )
@@ -420,6 +855,7 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
         for idx, rpd_file in enumerate(rpd_files):
 
             self.dest = self.src = None
+            self.fan_out = []
 
             if rpd_file.file_type == FileType.photo:
                 dest_dir = photo_temp_dir
@@ -433,7 +869,9 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
             # 3. Downloading from camera where we've already cached at
             #    least some of the files in the Download Cache
 
+            self.request_io(io_destinations[rpd_file.file_type])
             self.init_copy_progress()
+            self.digest = ''
 
             if rpd_file.cache_full_file_name and os.path.isfile(rpd_file.cache_full_file_name):
                 # Scenario 3
@@ -459,10 +897,10 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                                 name=rpd_file.name, uri=rpd_file.get_uri(), exception=inst
                             )
                         )
-                    if self.verify_file:
-                        rpd_file.md5 = hashlib.md5(
-                            open(temp_full_file_name, 'rb').read()
-                        ).hexdigest()
+                    if copy_succeeded and self.verify_file:
+                        self.digest = hash_file(
+                            temp_full_file_name, self.hash_algorithm, self.io_buffer
+                        )
                     self.update_progress(rpd_file.size, rpd_file.size)
                 else:
                     # The download folder changed since the scan occurred, and is now
@@ -471,7 +909,10 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                     # stage and saved, e.g. a sample video.
                     source = rpd_file.cache_full_file_name
                     destination = temp_full_file_name
-                    copy_succeeded = self.copy_from_filesystem(source, destination, rpd_file)
+                    self.init_fan_out(backup_temp_dirs[rpd_file.file_type], destination)
+                    copy_succeeded = self.copy_from_filesystem(
+                        source, destination, rpd_file, self.fan_out
+                    )
                     try:
                         os.remove(source)
                     except (OSError, PermissionError, FileNotFoundError) as e:
@@ -510,16 +951,26 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                         #                                            uri=rpd_file.get_uri()))
                         self.update_progress(rpd_file.size, rpd_file.size)
                     else:
+                        self.init_fan_out(
+                            backup_temp_dirs[rpd_file.file_type], rpd_file.temp_full_file_name
+                        )
                         copy_succeeded = self.copy_from_camera(rpd_file)
                 else:
                     # Scenario 1
                     source = rpd_file.full_file_name
                     destination = rpd_file.temp_full_file_name
-                    copy_succeeded = self.copy_from_filesystem(source, destination, rpd_file)
+                    self.init_fan_out(backup_temp_dirs[rpd_file.file_type], destination)
+                    copy_succeeded = self.copy_from_filesystem(
+                        source, destination, rpd_file, self.fan_out
+                    )
 
             # increment this amount regardless of whether the copy actually
             # succeeded or not. It's necessary to keep the user informed.
             self.total_downloaded += rpd_file.size
+            self.io_bytes_copied += rpd_file.size
+
+            if self.fan_out:
+                self.finish_fan_out(rpd_file, copy_succeeded)
 
             mdata_exceptions = None
 
@@ -527,6 +978,10 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                 rpd_file.status = DownloadStatus.download_failed
                 logging.debug("Download failed for %s", rpd_file.full_file_name)
             else:
+                if self.verify_file:
+                    rpd_file.digest = self.digest
+                    rpd_file.digest_algorithm = self.hash_algorithm
+
                 if rpd_file.from_camera:
                     mdata_exceptions = copy_camera_file_metadata(
                         float(rpd_file.modification_time), temp_full_file_name
@@ -575,6 +1030,8 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
             )
             self.send_message_to_sink()
 
+        self.release_io()
+
         if len(self.problems):
             logging.debug('Encountered %s problems while copying from %s', len(self.problems),
                           self.display_name)
@@ -45,6 +45,8 @@ class DownloadTracker:
 
     def __init__(self):
         self.file_types_present_by_scan_id = dict()  # type: Dict[int, str]
+        # Concurrent I/O limit for each source bus and destination file system
+        self.io_limits = dict()  # type: Dict[str, int]
         self._refresh_values()
 
     def _refresh_values(self):
@@ -340,6 +342,9 @@ class DownloadTracker:
 
         self.total_bytes_backed_up_by_scan_id[scan_id] += chunk_downloaded
 
+    def set_io_limits(self, limits: Dict[str, int]) -> None:
+        self.io_limits = limits
+
     def set_download_count_for_file(self, uid: bytes, download_count: int) -> None:
         self.download_count_for_file_by_uid[uid] = download_count
 
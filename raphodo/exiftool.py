@@ -59,6 +59,11 @@ The function set_pdeathsig is used to automatically terminate the process when t
 program exits.
 Added call to exiftool_version_info()
 Added execute_binary()
+Output is read in linear time into a growable buffer, and binary output can be
+streamed into a file or buffer with execute_binary_to()
+Added request_metadata(), which reads the meta-data of many files with a
+single command
+Added restart(), used by ExifToolPool in exiftoolpool.py
 """
 
 from __future__ import unicode_literals
@@ -69,6 +74,7 @@ import os
 import json
 import warnings
 import codecs
+from concurrent.futures import Future
 
 from raphodo.programversions import exiftool_version_info
 from raphodo.utilities import set_pdeathsig
@@ -86,11 +92,25 @@ If the executable is not located in one of the paths listed in the
 # The standard value should be fine.
 sentinel = b"{ready}"
 
-# The block size when reading from exiftool.  The standard value
+# The initial block size when reading from exiftool.  The standard value
 # should be fine, though other values might give better performance in
 # some cases.
 block_size = 4096
 
+# Reads from exiftool double in size up to this many bytes, for large output
+# such as full size previews
+max_block_size = 1024 * 1024
+
+# The end of the output is checked for the sentinel in this many bytes
+_tail_size = 32
+
+# Bytes removed by bytes.strip()
+_whitespace = b" \t\n\r\x0b\x0c"
+
+# The meta-data of at most this many files requested with request_metadata() is
+# read with a single command
+max_metadata_batch_size = 100
+
 # This code has been adapted from Lib/os.py in the Python source tree
 # (sha1 265e36e277f3)
 def _fscodec():
@@ -120,6 +140,30 @@ def _fscodec():
 fsencode = _fscodec()
 del _fscodec
 
+
+class MetadataFuture(Future):
+    """The meta-data of a file requested with :py:meth:`ExifTool.request_metadata()`.
+
+    Asking for the result reads the meta-data of every file queued with it,
+    if that has not happened already.
+    """
+
+    def __init__(self, et_process, filename):
+        super().__init__()
+        self._et_process = et_process
+        self.filename = filename
+
+    def result(self, timeout=None):
+        if not self.done():
+            self._et_process.flush_metadata_requests()
+        return super().result(timeout)
+
+    def exception(self, timeout=None):
+        if not self.done():
+            self._et_process.flush_metadata_requests()
+        return super().exception(timeout)
+
+
 class ExifTool(object):
     """Run the `exiftool` command-line tool and communicate to it.
 
@@ -172,6 +216,10 @@ class ExifTool(object):
         else:
             self.common_arguments = []
         self.running = False
+        # filename: MetadataFuture, for files not yet passed to get_metadata()
+        self._requests = {}
+        # Futures whose meta-data has not yet been read
+        self._queued = []
 
     def start(self):
         """Start an ``exiftool`` process in batch mode for this instance.
@@ -206,6 +254,7 @@ class ExifTool(object):
         """
         if not self.running:
             return
+        self.discard_metadata_requests()
         self._process.stdin.write(b"-stay_open\nFalse\n")
         try:
             self._process.stdin.flush()
@@ -216,6 +265,20 @@ class ExifTool(object):
         del self._process
         self.running = False
 
+    def restart(self):
+        """Kill the ``exiftool`` process of this instance, e.g. one that
+        stopped responding or exited unexpectedly, and start a new one.
+        """
+        if self.running:
+            try:
+                self._process.kill()
+                self._process.communicate()
+            except OSError:
+                pass
+            del self._process
+            self.running = False
+        self.start()
+
     def __enter__(self):
         self.start()
         return self
@@ -245,15 +308,91 @@ class ExifTool(object):
         .. note:: This is considered a low-level method, and should
            rarely be needed by application developers.
         """
+        self._send(params)
+        return bytes(self._read_output())
+
+    def _send(self, params):
         if not self.running:
             raise ValueError("ExifTool instance not running.")
         self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
         self._process.stdin.flush()
-        output = b""
-        fd = self._process.stdout.fileno()
-        while not output[-32:].strip().endswith(sentinel):
-            output += os.read(fd, block_size)
-        return output.strip()[:-len(sentinel)]
+
+    def _read_output(self, destination=None):
+        """Read the output of a command, up to the end-of-output sentinel.
+
+        Output is read into a bytearray that doubles in size when it is
+        full, using reads of up to ``max_block_size`` bytes.  Only the
+        end of the output is checked for the sentinel after each read,
+        so reading takes time proportional to the size of the output.
+
+        Leading and trailing whitespace is removed from the output, as
+        is the sentinel.
+
+        :param destination: if not None, a bytearray to append the output to,
+         or a binary file object to write the output to, as it is read
+        :return: if destination is None, a memoryview of the output, else the
+         number of bytes written to destination
+        """
+        raw = self._process.stdout.raw
+        buffer = bytearray(block_size)
+        # Bytes read into buffer
+        size = 0
+        # Offset in buffer of the output not yet written to destination
+        start = 0
+        written = 0
+        started = False
+        read_size = block_size
+
+        while True:
+            if len(buffer) - size < read_size:
+                buffer.extend(bytes(max(len(buffer), read_size)))
+            with memoryview(buffer)[size:size + read_size] as view:
+                no_bytes = raw.readinto(view)
+            if not no_bytes:
+                raise EOFError("ExifTool closed its output")
+            size += no_bytes
+            if no_bytes == read_size:
+                read_size = min(read_size * 2, max_block_size)
+
+            if buffer[max(0, size - _tail_size):size].strip().endswith(sentinel):
+                break
+
+            if not started:
+                # Skip leading whitespace
+                while start < size and buffer[start] in _whitespace:
+                    start += 1
+                started = start < size
+
+            if destination is not None and size - start > max_block_size:
+                # Write everything except what could be part of the sentinel
+                end = size - _tail_size
+                with memoryview(buffer)[start:end] as view:
+                    written += self._write(destination, view)
+                buffer[:_tail_size] = buffer[end:size]
+                size = _tail_size
+                start = 0
+
+        end = size
+        while end > start and buffer[end - 1] in _whitespace:
+            end -= 1
+        end -= len(sentinel)
+        if not started:
+            while start < end and buffer[start] in _whitespace:
+                start += 1
+        if destination is None:
+            return memoryview(buffer)[start:max(start, end)]
+        if end > start:
+            with memoryview(buffer)[start:end] as view:
+                written += self._write(destination, view)
+        return written
+
+    @staticmethod
+    def _write(destination, view):
+        if isinstance(destination, bytearray):
+            destination += view
+        else:
+            destination.write(view)
+        return len(view)
 
     def execute_json(self, *params):
         """Execute the given batch of parameters and parse the JSON output.
@@ -288,6 +427,22 @@ class ExifTool(object):
         params = map(fsencode, params)
         return self.execute(b"-b", *params)
 
+    def execute_binary_to(self, destination, *params):
+        """Execute the given batch of parameters, streaming the binary
+        output into ``destination`` as it is read.
+
+        This method is similar to :py:meth:`execute_binary()`, but
+        avoids holding large output such as a full size preview in
+        memory more than once.
+
+        :param destination: a bytearray to append the output to, e.g. one
+         reused for many files, or a binary file object to write it to
+        :return: the number of bytes of output
+        """
+        params = tuple(map(fsencode, params))
+        self._send((b"-b", ) + params)
+        return self._read_output(destination)
+
     def get_metadata_batch(self, filenames):
         """Return all meta-data for the given files.
 
@@ -301,9 +456,84 @@ class ExifTool(object):
 
         The returned dictionary has the format described in the
         documentation of :py:meth:`execute_json()`.
+
+        If the meta-data was requested with :py:meth:`request_metadata()`,
+        it is returned from the request.
         """
+        future = self._requests.pop(filename, None)
+        if future is not None:
+            return future.result()
         return self.execute_json(filename)[0]
 
+    def request_metadata(self, filename):
+        """Queue a request for all meta-data for a single file.
+
+        The meta-data of every queued file is read with a single command
+        when the meta-data of any of them is first needed, i.e. when the
+        result of a returned future is asked for, or when
+        :py:meth:`get_metadata()` is called for a queued file. Code that
+        knows in advance which files it will work on can therefore request
+        their meta-data up front, and code that later calls
+        :py:meth:`get_metadata()` need not change.
+
+        :return: a future whose result is the dictionary
+         :py:meth:`get_metadata()` returns, or which raises the exception it
+         would raise
+        """
+        future = self._requests.get(filename)
+        if future is None:
+            future = MetadataFuture(self, filename)
+            self._requests[filename] = future
+            self._queued.append(future)
+            if len(self._queued) >= max_metadata_batch_size:
+                self.flush_metadata_requests()
+        return future
+
+    def flush_metadata_requests(self):
+        """Read the meta-data of every file queued with
+        :py:meth:`request_metadata()` using :py:meth:`get_metadata_batch()`.
+        """
+        queued, self._queued = self._queued, []
+        if not queued:
+            return
+        try:
+            metadata = self.get_metadata_batch([future.filename for future in queued])
+        except ValueError:
+            # No file could be read
+            metadata = []
+        except Exception as e:
+            for future in queued:
+                future.set_exception(e)
+            return
+
+        # ExifTool omits files it cannot read
+        by_name = {d.get("SourceFile"): d for d in metadata}
+        in_order = len(metadata) == len(queued)
+        for i, future in enumerate(queued):
+            d = by_name.get(os.fsdecode(future.filename))
+            if d is None and in_order:
+                d = metadata[i]
+            if d is None:
+                # Read the file by itself, so the future raises the same
+                # error get_metadata() would
+                try:
+                    d = self.execute_json(future.filename)[0]
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+            future.set_result(d)
+
+    def discard_metadata_requests(self):
+        """Forget all meta-data requested with :py:meth:`request_metadata()`
+        that has not yet been passed to :py:meth:`get_metadata()`.
+
+        Futures whose meta-data was not yet read are cancelled.
+        """
+        for future in self._queued:
+            future.cancel()
+        self._queued = []
+        self._requests = {}
+
     def get_tags_batch(self, tags, filenames):
         """Return only specified tags for the given files.
 
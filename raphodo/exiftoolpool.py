@@ -0,0 +1,329 @@
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Pool of ExifTool processes shared by the code running in one process.
+
+ExifTool is single threaded, so one ExifTool process reading the metadata of
+many videos or CR3 or HEIF files uses only one CPU core. The pool runs
+several, and is used in place of a single ExifTool instance.
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+from collections import namedtuple
+import json
+import logging
+import threading
+import time
+from typing import List, Optional
+import warnings
+
+from raphodo.exiftool import ExifTool, fsencode
+from raphodo.programversions import exiftool_version_info
+from raphodo.utilities import available_cpu_count
+
+# Never run more ExifTool processes than this in one pool
+max_pool_size = 4
+
+ExifToolUtilisation = namedtuple(
+    'ExifToolUtilisation', 'running commands busy utilisation restarts'
+)
+
+
+def default_pool_size() -> int:
+    """
+    :return: number of ExifTool processes to run in a pool by default
+    """
+
+    return min(available_cpu_count(physical_only=True), max_pool_size)
+
+
+class ExifToolInstance:
+    """
+    An ExifTool process in the pool, and how much it has been used
+    """
+
+    def __init__(self, index: int, process: ExifTool) -> None:
+        self.index = index
+        self.process = process
+        # Held while a command is running
+        self.lock = threading.Lock()
+        # Commands routed to this process that have not yet completed
+        self.in_flight = 0
+        self.commands = 0
+        # Seconds spent running commands
+        self.busy = 0.0
+        self.restarts = 0
+        self.command_start = 0.0
+
+
+class ExifToolPool(ExifTool):
+    """
+    ExifTool processes that can be used in place of a single ExifTool
+    instance, and shared by threads.
+
+    Each command is routed to the least loaded process. Processes are started
+    only when they are needed: code that runs one command at a time uses only
+    one process, but the metadata of files requested using request_metadata()
+    is read using several processes in parallel. A process that exits
+    unexpectedly is restarted.
+
+    Metadata requests are guarded by their own lock, so files can be
+    requested and their metadata read from any thread.
+    """
+
+    # When reading metadata in parallel, each process reads the metadata of at
+    # least this many files
+    min_files_per_process = 8
+
+    def __init__(self, size: Optional[int]=None, common_arguments=None,
+                 executable_=None) -> None:
+        """
+        :param size: maximum number of ExifTool processes to run. If not
+         specified, default_pool_size() is used.
+        :param common_arguments: each call to exiftool will contain
+         these command line arguments
+        :param executable_: the exiftool executable, if not the default
+        """
+
+        super().__init__(common_arguments=common_arguments, executable_=executable_)
+        if size is None:
+            size = default_pool_size()
+        self.instances = [
+            ExifToolInstance(
+                index, ExifTool(
+                    common_arguments=self.common_arguments, executable_=self.executable
+                )
+            ) for index in range(max(size, 1))
+        ]
+        self.lock = threading.Lock()
+        # Guards the metadata requests queued with request_metadata(). It is
+        # reentrant because queuing a request can flush the queue.
+        self.requests_lock = threading.RLock()
+        self.start_time = 0.0
+
+    def start(self) -> None:
+        """
+        Make the pool ready for use. ExifTool processes are started when
+        they are first needed.
+        """
+
+        if self.running:
+            warnings.warn("ExifTool already running; doing nothing.")
+            return
+
+        if exiftool_version_info() is None:
+            warnings.warn("ExifTool cannot be started; doing nothing.")
+            return
+
+        self.start_time = time.perf_counter()
+        self.running = True
+
+    def terminate(self) -> None:
+        if not self.running:
+            return
+        self.discard_metadata_requests()
+        self.log_utilisation()
+        for instance in self.instances:
+            instance.process.terminate()
+        self.running = False
+
+    def _acquire(self, count: int=1) -> List[ExifToolInstance]:
+        """
+        Reserve the least loaded processes for commands, starting them if
+        necessary.
+
+        :param count: number of processes to reserve
+        :return: the reserved processes
+        """
+
+        if not self.running:
+            raise ValueError("ExifTool instance not running.")
+
+        with self.lock:
+            # Prefer processes that are already running, then those that
+            # have done the least work
+            instances = sorted(
+                self.instances,
+                key=lambda i: (i.in_flight, not i.process.running, i.busy)
+            )[:count]
+            for instance in instances:
+                instance.in_flight += 1
+
+        # Always lock processes in the same order, so that threads reserving
+        # several processes cannot deadlock
+        instances.sort(key=lambda i: i.index)
+        for locked, instance in enumerate(instances):
+            instance.lock.acquire()
+            instance.command_start = time.perf_counter()
+            if not instance.process.running:
+                logging.debug("Starting ExifTool process %s", instance.index)
+                try:
+                    instance.process.start()
+                except Exception:
+                    for i in instances[:locked + 1]:
+                        self._release(i)
+                    with self.lock:
+                        for i in instances[locked + 1:]:
+                            i.in_flight -= 1
+                    raise
+        return instances
+
+    def _release(self, instance: ExifToolInstance) -> None:
+        instance.busy += time.perf_counter() - instance.command_start
+        instance.commands += 1
+        instance.lock.release()
+        with self.lock:
+            instance.in_flight -= 1
+
+    def _restart(self, instance: ExifToolInstance) -> None:
+        logging.warning(
+            "ExifTool process %s stopped responding or exited unexpectedly. Restarting it.",
+            instance.index
+        )
+        instance.restarts += 1
+        instance.process.restart()
+
+    def execute(self, *params):
+        """
+        Run the command using the least loaded process. If the process
+        exited unexpectedly, restart it and run the command again.
+        """
+
+        instance = self._acquire()[0]
+        try:
+            try:
+                return instance.process.execute(*params)
+            except (OSError, EOFError):
+                self._restart(instance)
+                return instance.process.execute(*params)
+        finally:
+            self._release(instance)
+
+    def execute_binary_to(self, destination, *params):
+        """
+        Stream the output of the command using the least loaded process.
+
+        Output may already have been written to the destination when a process
+        exits unexpectedly, so the command is not run again, but the process is
+        restarted.
+        """
+
+        instance = self._acquire()[0]
+        try:
+            return instance.process.execute_binary_to(destination, *params)
+        except (OSError, EOFError):
+            self._restart(instance)
+            raise
+        finally:
+            self._release(instance)
+
+    def get_metadata(self, filename):
+        with self.requests_lock:
+            future = self._requests.pop(filename, None)
+        if future is not None:
+            return future.result()
+        return self.execute_json(filename)[0]
+
+    def request_metadata(self, filename):
+        with self.requests_lock:
+            return super().request_metadata(filename)
+
+    def flush_metadata_requests(self):
+        """
+        Read the metadata of every queued file, using several processes in
+        parallel. Flushes requested by different threads run one at a time.
+        """
+
+        with self.requests_lock:
+            super().flush_metadata_requests()
+
+    def discard_metadata_requests(self):
+        with self.requests_lock:
+            super().discard_metadata_requests()
+
+    def get_metadata_batch(self, filenames):
+        """
+        Return all meta-data for the given files, split between as many
+        processes as is worthwhile, all of which run in parallel.
+
+        Files whose meta-data cannot be read are omitted.
+        """
+
+        filenames = list(filenames)
+        count = min(len(self.instances), len(filenames) // self.min_files_per_process)
+        if count <= 1:
+            return super().get_metadata_batch(filenames)
+
+        chunk_size = -(-len(filenames) // count)
+        chunks = [
+            filenames[i:i + chunk_size] for i in range(0, len(filenames), chunk_size)
+        ]
+        instances = self._acquire(len(chunks))
+        metadata = []
+        try:
+            sent = []
+            for instance, chunk in zip(instances, chunks):
+                try:
+                    instance.process._send((b"-j", b"-n") + tuple(map(fsencode, chunk)))
+                except OSError:
+                    self._restart(instance)
+                else:
+                    sent.append(instance)
+            for instance in sent:
+                try:
+                    output = bytes(instance.process._read_output())
+                except (OSError, EOFError):
+                    self._restart(instance)
+                    continue
+                try:
+                    metadata.extend(json.loads(output.decode("utf-8")))
+                except ValueError:
+                    # No file could be read
+                    pass
+        finally:
+            for instance in instances:
+                self._release(instance)
+        return metadata
+
+    def utilisation(self) -> List[ExifToolUtilisation]:
+        """
+        :return: for each process, whether it is running, the number of
+         commands it has run, the seconds it was busy, the proportion of time
+         it was busy since the pool was started, and the number of times it
+         was restarted
+        """
+
+        elapsed = time.perf_counter() - self.start_time
+        return [
+            ExifToolUtilisation(
+                instance.process.running, instance.commands, instance.busy,
+                instance.busy / elapsed if elapsed > 0 else 0.0, instance.restarts
+            ) for instance in self.instances
+        ]
+
+    def log_utilisation(self) -> None:
+        for index, usage in enumerate(self.utilisation()):
+            if usage.commands:
+                logging.debug(
+                    "ExifTool process %s: %s commands, %.2fs busy (%.0f%%), %s restarts",
+                    index, usage.commands, usage.busy, usage.utilisation * 100,
+                    usage.restarts
+                )
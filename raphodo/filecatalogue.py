@@ -0,0 +1,201 @@
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+In memory catalogue of the files the main window displays.
+
+An RPDFile object with all its attributes takes several kilobytes. With hundreds of
+thousands of files from several devices that adds up to gigabytes, yet displaying a
+file needs only a handful of its attributes.
+
+The catalogue therefore stores each attribute the thumbnail display reads in a
+column, indexed by an integer id assigned to the file when it is added. The file
+itself is stored pickled in the compact format defined by RPDFile.__getstate__(), and
+is only unpickled when code needs the whole file, e.g. to download it.
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+import array
+import pickle
+import sys
+from typing import Dict, List, Iterable, Iterator, Optional, Tuple
+from datetime import datetime
+
+from raphodo.constants import DownloadStatus, FileType
+from raphodo.rpdfile import RPDFile
+
+
+class FileCatalogue:
+    """
+    Files keyed by uid, with their display attributes stored by column.
+
+    Files returned by the catalogue are copies: to change a file, assign it back to
+    the catalogue, or use one of the methods that set an attribute.
+    """
+
+    def __init__(self) -> None:
+        # uid: id
+        self.ids = {}  # type: Dict[bytes, int]
+        # ids of removed files, to be reused
+        self.free_ids = []  # type: List[int]
+
+        # Columns indexed by id
+        self.uid = []  # type: List[Optional[bytes]]
+        self.state = []  # type: List[Optional[bytes]]
+        self.scan_id = array.array('q')
+        self.modification_time = array.array('d')
+        self.ctime = array.array('d')
+        self.size = array.array('q')
+        self.name = []  # type: List[str]
+        self.extension = []  # type: List[str]
+        self.extension_type = []
+        self.file_type = []  # type: List[FileType]
+        self.status = []  # type: List[DownloadStatus]
+        self.job_code = []  # type: List[Optional[str]]
+        self.previously_downloaded = []  # type: List[bool]
+        self.prev_full_name = []  # type: List[Optional[str]]
+        self.prev_datetime = []  # type: List[Optional[datetime]]
+        self.from_camera = []  # type: List[bool]
+        self.is_mtp_device = []  # type: List[bool]
+        self.camera_memory_card_identifiers = []  # type: List[Optional[List[int]]]
+        self.has_audio = []  # type: List[bool]
+        self.secondary_attribute = []  # type: List[Optional[str]]
+
+        self._columns = (
+            self.uid, self.state, self.scan_id, self.modification_time, self.ctime,
+            self.size, self.name, self.extension, self.extension_type, self.file_type,
+            self.status, self.job_code, self.previously_downloaded, self.prev_full_name,
+            self.prev_datetime, self.from_camera, self.is_mtp_device,
+            self.camera_memory_card_identifiers, self.has_audio, self.secondary_attribute
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, uid: bytes) -> bool:
+        return uid in self.ids
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.ids)
+
+    @staticmethod
+    def _row(rpd_file: RPDFile) -> tuple:
+        if rpd_file.xmp_file_full_name:
+            secondary_attribute = 'XMP'
+        elif rpd_file.log_file_full_name:
+            secondary_attribute = 'LOG'
+        else:
+            secondary_attribute = None
+
+        return (
+            rpd_file.uid, pickle.dumps(rpd_file, pickle.HIGHEST_PROTOCOL), rpd_file.scan_id,
+            rpd_file.modification_time, rpd_file.ctime, rpd_file.size, rpd_file.name,
+            # Shared by many files
+            sys.intern(rpd_file.extension), rpd_file.extension_type, rpd_file.file_type,
+            rpd_file.status, rpd_file.job_code, rpd_file.previously_downloaded,
+            rpd_file.prev_full_name, rpd_file.prev_datetime, rpd_file.from_camera,
+            rpd_file.is_mtp_device, rpd_file.camera_memory_card_identifiers,
+            rpd_file.has_audio(), secondary_attribute
+        )
+
+    def __setitem__(self, uid: bytes, rpd_file: RPDFile) -> None:
+        """
+        Add the file to the catalogue, or replace it if it is already present.
+        """
+
+        row = self._row(rpd_file)
+        i = self.ids.get(uid)
+        if i is None and self.free_ids:
+            i = self.free_ids.pop()
+            self.ids[uid] = i
+        if i is None:
+            self.ids[uid] = len(self.uid)
+            for column, value in zip(self._columns, row):
+                column.append(value)
+        else:
+            for column, value in zip(self._columns, row):
+                column[i] = value
+
+    def __getitem__(self, uid: bytes) -> RPDFile:
+        """
+        :return: a copy of the file
+        """
+
+        i = self.ids[uid]
+        rpd_file = pickle.loads(self.state[i])  # type: RPDFile
+        # Attributes that may have been changed since the file was added
+        rpd_file.status = self.status[i]
+        rpd_file.job_code = self.job_code[i]
+        rpd_file.previously_downloaded = self.previously_downloaded[i]
+        rpd_file.prev_full_name = self.prev_full_name[i]
+        rpd_file.prev_datetime = self.prev_datetime[i]
+        return rpd_file
+
+    def __delitem__(self, uid: bytes) -> None:
+        i = self.ids.pop(uid)
+        self.uid[i] = self.state[i] = None
+        self.camera_memory_card_identifiers[i] = self.prev_full_name[i] = None
+        self.prev_datetime[i] = None
+        self.free_ids.append(i)
+
+    def rpd_files(self, uids: Iterable[bytes]) -> List[RPDFile]:
+        """
+        :return: copies of the files
+        """
+
+        return [self[uid] for uid in uids]
+
+    def file_types(self, uids: Iterable[bytes]) -> Iterator[FileType]:
+        ids = self.ids
+        file_type = self.file_type
+        return (file_type[ids[uid]] for uid in uids)
+
+    def total_size(self, uids: Iterable[bytes]) -> int:
+        ids = self.ids
+        size = self.size
+        return sum(size[ids[uid]] for uid in uids)
+
+    def set_job_code(self, uids: Iterable[bytes], job_code: Optional[str]) -> None:
+        ids = self.ids
+        for uid in uids:
+            self.job_code[ids[uid]] = job_code
+
+    def set_status(self, uids: Iterable[bytes], status: DownloadStatus) -> None:
+        ids = self.ids
+        for uid in uids:
+            self.status[ids[uid]] = status
+
+    def set_previously_downloaded(self, uid: bytes,
+                                  previously_downloaded: bool,
+                                  prev_full_name: Optional[str],
+                                  prev_datetime: Optional[datetime]) -> None:
+        i = self.ids[uid]
+        self.previously_downloaded[i] = previously_downloaded
+        self.prev_full_name[i] = prev_full_name
+        self.prev_datetime[i] = prev_datetime
+
+    def proximity_data(self) -> Iterator[Tuple[bytes, float, FileType, bool]]:
+        """
+        :return: uid, creation time, file type and whether previously downloaded, for
+         every file in the catalogue
+        """
+
+        for i in self.ids.values():
+            yield self.uid[i], self.ctime[i], self.file_type[i], self.previously_downloaded[i]
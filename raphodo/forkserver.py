@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Start worker processes by forking a process that has already imported everything the
+worker needs, rather than starting a fresh Python interpreter for each worker.
+
+Importing PyQt5, GExiv2, gphoto2 and 0MQ takes a second or more. The fork server
+does that once, when its manager starts, and thereafter forks a copy of itself for
+each worker, which then runs the worker script as if it had been started from the
+command line.
+
+The fork server reads requests on its standard input, one per line: the worker's
+command line arguments, encoded as JSON. It replies on a pipe passed to it by the
+manager: first a line READY followed by the seconds taken to import the worker's
+modules, then the process id of each worker it forks. It exits when its standard
+input is closed.
+
+The fork server never creates a 0MQ context or starts a thread, so that it is always
+safe for it to fork.
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+import argparse
+import json
+import logging
+import os
+import runpy
+import signal
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import psutil
+
+from raphodo.utilities import set_pdeathsig
+
+
+class WarmWorkerPool:
+    """
+    Start worker processes using a fork server that has preloaded the worker's modules.
+
+    Used by a process manager in the main process. If the fork server cannot be started,
+    or it dies, fork() returns None and the manager should start the worker itself.
+    """
+
+    def __init__(self, script: str, name: str) -> None:
+        """
+        Start the fork server. Does not wait for it to finish importing the worker's
+        modules.
+
+        :param script: full path of the worker script, e.g. scan.py
+        :param name: name of the manager, for logging
+        """
+
+        self.name = name
+        self.ready = False
+        self.server = None  # type: Optional[psutil.Popen]
+        self.replies = None
+
+        reply_read, reply_write = os.pipe()
+        command_line = [sys.executable, os.path.abspath(__file__), '--reply', str(reply_write),
+                        script]
+        try:
+            self.server = psutil.Popen(
+                command_line, stdin=subprocess.PIPE, pass_fds=(reply_write,),
+                preexec_fn=set_pdeathsig(), universal_newlines=True
+            )
+        except OSError as e:
+            logging.error("%s failed to start its warm worker pool: %s", self.name, e)
+            os.close(reply_read)
+        else:
+            logging.debug("%s started its warm worker pool with pid %s", name, self.server.pid)
+            self.replies = os.fdopen(reply_read, 'r')
+        finally:
+            os.close(reply_write)
+
+    def _wait_until_ready(self) -> None:
+        reply = self.replies.readline().split()
+        if len(reply) != 2 or reply[0] != 'READY':
+            raise ValueError("unexpected reply from fork server: {}".format(reply))
+        logging.debug(
+            "%s warm worker pool took %s seconds to import its modules", self.name, reply[1]
+        )
+        self.ready = True
+
+    def fork(self, args: List[str]) -> Optional[psutil.Process]:
+        """
+        Start a worker from the warm pool.
+
+        :param args: the worker's command line, excluding the Python interpreter
+        :return: the worker process, or None if the pool is not available
+        """
+
+        if self.server is None:
+            return None
+        try:
+            if not self.ready:
+                self._wait_until_ready()
+            self.server.stdin.write(json.dumps(args) + '\n')
+            self.server.stdin.flush()
+            pid = int(self.replies.readline())
+            return psutil.Process(pid)
+        except (OSError, ValueError, psutil.Error) as e:
+            logging.error(
+                "%s warm worker pool failed (%s): starting workers without it", self.name, e
+            )
+            self.close()
+            return None
+
+    def close(self) -> None:
+        """
+        Stop the fork server. Any workers it started that are still running will
+        be sent a terminate signal.
+        """
+
+        if self.server is None:
+            return
+        try:
+            self.server.stdin.close()
+            self.server.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired, psutil.TimeoutExpired):
+            try:
+                self.server.kill()
+            except psutil.Error:
+                pass
+        self.replies.close()
+        self.server = None
+
+
+def run_worker(args: List[str]) -> None:
+    """
+    Run in the forked process: reset the state inherited from the fork server, then
+    run the worker script exactly as if it had been started from the command line.
+    """
+
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    # Terminate the worker should the fork server terminate
+    set_pdeathsig()()
+
+    # The fork server's standard input carries requests for other workers
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    sys.stdin = open(os.devnull)
+
+    sys.argv = args
+    runpy.run_path(args[0], run_name='__main__')
+    sys.exit(0)
+
+
+def serve(script: str, reply_fd: int) -> None:
+    start = time.perf_counter()
+    # Import everything the worker script imports, without running it
+    runpy.run_path(script, run_name='__rpd_forkserver__')
+
+    replies = os.fdopen(reply_fd, 'w', buffering=1)
+    replies.write('READY {:.3f}\n'.format(time.perf_counter() - start))
+
+    # Let the kernel reap workers when they exit
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    for line in sys.stdin:
+        args = json.loads(line)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            replies.close()
+            run_worker(args)
+        replies.write('{}\n'.format(pid))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fork worker processes on request')
+    parser.add_argument('--reply', type=int, required=True, help='file descriptor to reply on')
+    parser.add_argument('script', help='worker script to preload and run')
+    args = parser.parse_args()
+
+    serve(args.script, args.reply)
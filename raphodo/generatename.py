@@ -27,7 +27,7 @@ from datetime import datetime, timedelta
 import string
 from collections import namedtuple
 import logging
-from typing import Sequence, Optional, List, Union
+from typing import Sequence, Optional, List, Union, Set
 import locale
 try:
     # Use the default locale as defined by the LANG variable
@@ -42,6 +42,7 @@ from raphodo.problemnotification import (
     RenamingProblems, FilenameNotFullyGeneratedProblem, make_href,
     FolderNotFullyGeneratedProblemProblem, Problem
 )
+from raphodo.constants import FileType
 from raphodo.rpdfile import RPDFile, Photo, Video
 from raphodo.storage import get_uri
 from raphodo.utilities import letters
@@ -728,6 +729,50 @@ def get_video_metadata_component(video: Union[VideoSubfolder, VideoName]):
     return v
 
 
+# Metadata method called to generate each metadata name component
+_metadata_methods = {
+    APERTURE: 'aperture',
+    ISO: 'iso',
+    EXPOSURE_TIME: 'exposure_time',
+    FOCAL_LENGTH: 'focal_length',
+    CAMERA_MAKE: 'camera_make',
+    CAMERA_MODEL: 'camera_model',
+    SHORT_CAMERA_MODEL: 'camera_model',
+    SHORT_CAMERA_MODEL_HYPHEN: 'camera_model',
+    SERIAL_NUMBER: 'camera_serial',
+    SHUTTER_COUNT: 'shutter_count',
+    FILE_NUMBER: 'file_number',
+    OWNER_NAME: 'owner_name',
+    COPYRIGHT: 'copyright',
+    ARTIST: 'artist',
+    CODEC: 'codec',
+    WIDTH: 'width',
+    HEIGHT: 'height',
+    FPS: 'frames_per_second',
+    LENGTH: 'length',
+}
+
+
+def metadata_needed(pref_list: List[str], file_type: FileType) -> Set[str]:
+    """
+    Determine which metadata values generating a subfolder or file name uses.
+
+    :param pref_list: subfolder or file name preferences
+    :param file_type: photo or video
+    :return: names of the metadata methods name generation calls
+    """
+
+    L1_date_check = IMAGE_DATE if file_type == FileType.photo else VIDEO_DATE
+    needed = set()
+    for i in range(0, len(pref_list), 3):
+        L0, L1, L2 = pref_list[i:i + 3]
+        if L0 == DATE_TIME and L1 == L1_date_check:
+            needed.add('sub_seconds' if L2 == SUBSECONDS else 'date_time')
+        elif L0 == METADATA:
+            needed.add(_metadata_methods.get(L1, L1))
+    return needed
+
+
 class Sequences:
     """
     Stores sequence numbers and letters used in generating file names.
@@ -50,13 +50,18 @@ from zmq.eventloop.zmqstream import ZMQStream
 from raphodo.rpdfile import RPDFile, FileTypeCounter, FileSizeSum, Photo, Video
 from raphodo.devices import Device
 from raphodo.utilities import CacheDirs, set_pdeathsig
+from raphodo.forkserver import WarmWorkerPool
+from raphodo.transport import (
+    bind_to_random_port, endpoint, to_shared_memory, from_shared_memory
+)
 from raphodo.constants import (
     RenameAndMoveStatus, ExtractionTask, ExtractionProcessing, CameraErrorCode, FileType,
-    FileExtension, BackupStatus
+    FileExtension, BackupStatus, CopyEngine, HashAlgorithm
 )
 from raphodo.proximity import TemporalProximityGroups
 from raphodo.storage import StorageSpace
 from raphodo.iplogging import ZeroMQSocketHandler
+from raphodo.ioscheduler import IOScheduler
 from raphodo.viewutils import ThumbnailDataForProximity
 from raphodo.folderspreview import DownloadDestination, FoldersPreview
 from raphodo.problemnotification import (
@@ -161,12 +166,14 @@ class ProcessManager:
         # Monitor which workers we have running
         self.workers = []  # type: List[int]
 
+        # Fork server to start workers from, if the subclass uses one
+        self.worker_pool = None  # type: Optional[WarmWorkerPool]
+
+    def _get_script(self) -> str:
+        return os.path.join(os.path.abspath(os.path.dirname(__file__)), self._process_to_run)
+
     def _get_cmd(self) -> str:
-        return '{} {}'.format(
-            sys.executable, os.path.join(
-                os.path.abspath(os.path.dirname(__file__)), self._process_to_run
-            )
-        )
+        return '{} {}'.format(sys.executable, self._get_script())
 
     def _get_command_line(self, worker_id: int) -> str:
         """
@@ -179,19 +186,29 @@ class ProcessManager:
         command_line = self._get_command_line(worker_id)
         args = shlex.split(command_line)
 
-        # run command immediately, without waiting a reply, and instruct the Linux
-        # kernel to send a terminate signal should this process unexpectedly die
-        try:
-            proc = psutil.Popen(args, preexec_fn=set_pdeathsig())
-        except OSError as e:
-            logging.critical("Failed to start process: %s", command_line)
-            logging.critical('OSError [Errno %s]: %s', e.errno, e.strerror)
-            if e.errno == 8:
-                logging.critical(
-                    "Script shebang line might be malformed or missing: %s", self._get_cmd()
-                )
-            sys.exit(1)
-        logging.debug("Started '%s' with pid %s", command_line, proc.pid)
+        proc = None  # type: Optional[psutil.Process]
+        if self.worker_pool is not None:
+            # The first argument is the Python interpreter, which the fork server already is
+            proc = self.worker_pool.fork(args[1:])
+            if proc is None:
+                self.worker_pool = None
+            else:
+                logging.debug("Forked '%s' with pid %s", command_line, proc.pid)
+
+        if proc is None:
+            # run command immediately, without waiting a reply, and instruct the Linux
+            # kernel to send a terminate signal should this process unexpectedly die
+            try:
+                proc = psutil.Popen(args, preexec_fn=set_pdeathsig())
+            except OSError as e:
+                logging.critical("Failed to start process: %s", command_line)
+                logging.critical('OSError [Errno %s]: %s', e.errno, e.strerror)
+                if e.errno == 8:
+                    logging.critical(
+                        "Script shebang line might be malformed or missing: %s", self._get_cmd()
+                    )
+                sys.exit(1)
+            logging.debug("Started '%s' with pid %s", command_line, proc.pid)
 
         # Add to list of running workers
         self.workers.append(worker_id)
@@ -264,6 +281,9 @@ class PullPipelineManager(ProcessManager, QObject):
     workerStopped = pyqtSignal(int)
     receiverPortSignal = pyqtSignal(int)
 
+    # Milliseconds between calls to check_workers(), or None to never call it
+    check_workers_interval = None  # type: Optional[int]
+
     def __init__(self, logging_port: int,
                  thread_name: str) -> None:
         super().__init__(logging_port=logging_port, thread_name=thread_name)
@@ -278,11 +298,11 @@ class PullPipelineManager(ProcessManager, QObject):
 
         # Sink socket to receive results of the workers
         self.receiver_socket = context.socket(zmq.PULL)
-        self.receiver_port = self.receiver_socket.bind_to_random_port('tcp://*')
+        self.receiver_port = bind_to_random_port(self.receiver_socket)
 
         # Socket to communicate directly with the sink, bypassing the workers
         self.terminate_socket = context.socket(zmq.PUSH)
-        self.terminate_socket.connect("tcp://localhost:{}".format(self.receiver_port))
+        self.terminate_socket.connect(endpoint(self.receiver_port))
 
         # Socket to receive commands from main thread
         self.thread_controller = context.socket(zmq.PAIR)
@@ -303,11 +323,18 @@ class PullPipelineManager(ProcessManager, QObject):
         self.receiverPortSignal.emit(self.receiver_port)
         self.sinkStarted.emit()
 
+        last_check = time.monotonic()
         while True:
             try:
-                socks = dict(poller.poll())
+                socks = dict(poller.poll(self.check_workers_interval))
             except KeyboardInterrupt:
                 break
+            if self.check_workers_interval is not None:
+                # Check even while messages keep arriving from other workers
+                now = time.monotonic()
+                if now - last_check >= self.check_workers_interval / 1000:
+                    last_check = now
+                    self.check_workers()
             if self.receiver_socket in socks:
                 # Receive messages from the workers
                 # (or the terminate socket)
@@ -332,6 +359,7 @@ class PullPipelineManager(ProcessManager, QObject):
                     else:
                         # Worker has finished its work
                         self.workerFinished.emit(worker_id)
+                    self.worker_done(worker_id)
                     self.workers.remove(worker_id)
                     del self.processes[worker_id]
                     if not self.workers:
@@ -348,6 +376,10 @@ class PullPipelineManager(ProcessManager, QObject):
                 # Receive messages from the main Rapid Photo Downloader thread
                 self.process_thread_directive()
 
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool = None
+
     def process_thread_directive(self) -> None:
         directive, worker_id, data = self.thread_controller.recv_multipart()
 
@@ -375,6 +407,24 @@ class PullPipelineManager(ProcessManager, QObject):
         data = pickle.loads(self.content)
         self.message.emit(data)
 
+    def worker_done(self, worker_id: int) -> None:
+        """
+        Called in the sink when a worker has stopped or finished.
+
+        Implement in child class if needed.
+        """
+
+        pass
+
+    def check_workers(self) -> None:
+        """
+        Called in the sink every check_workers_interval milliseconds.
+
+        Implement in child class if needed.
+        """
+
+        pass
+
     def terminate_sink(self) -> None:
         self.terminate_socket.send_multipart([b'0', b'cmd', b'KILL'])
 
@@ -476,7 +526,20 @@ class LoadBalancerWorkerManager(ProcessManager):
 
 
 class LRUQueue:
-    """LRUQueue class using ZMQStream/IOLoop for event dispatching"""
+    """
+    LRUQueue class using ZMQStream/IOLoop for event dispatching
+
+    Tasks from the frontend are queued, and sent to the least recently used worker
+    in batches. The size of a batch is adapted to how long each task takes, so that
+    when tasks are quick, e.g. extracting thumbnails from small JPEGs, the worker does
+    not spend most of its time waiting for the next task.
+    """
+
+    # Aim for batches that take this long to process, in seconds
+    batch_duration = 0.05
+    max_batch_size = 32
+    # Weight given to the most recent batch when estimating how long a task takes
+    latency_smoothing = 0.2
 
     def __init__(self, backend_socket: zmq.Socket,
                  frontend_socket: zmq.Socket,
@@ -491,6 +554,16 @@ class LRUQueue:
         self.terminating_workers = set()  # type: Set[bytes]
         self.stopped_workers = set()  # type: Set[int]
 
+        # Tasks received from the frontend that have not yet been sent to a worker
+        self.tasks = deque()  # type: deque
+        # Stop receiving from the frontend when this many tasks are waiting
+        self.max_tasks = self.max_batch_size * process_manager.no_workers
+        self.receiving = False
+        # worker identity: (time the batch was sent, number of tasks in the batch)
+        self.batches = {}  # type: Dict[bytes, Tuple[float, int]]
+        # Estimated seconds per task, including sending it to the worker
+        self.task_latency = None  # type: Optional[float]
+
         self.backend = ZMQStream(backend_socket)
         self.frontend = ZMQStream(frontend_socket)
         self.controller = ZMQStream(controller_socket)
@@ -520,6 +593,7 @@ class LRUQueue:
 
         # add worker back to the list of workers
         self.workers.append(worker_identity)
+        self.update_task_latency(worker_identity)
 
         zw = self.process_manager.zombie_workers()
         if zw:
@@ -547,19 +621,67 @@ class LRUQueue:
                             logging.debug("Process %s is sleeping", pid)
                 self.loop.add_timeout(time.time()+0.5, self.loop.stop)
 
-        if len(self.workers) == 1:
-            # on first recv, start accepting frontend messages
-            self.frontend.on_recv(self.handle_frontend)
+        self.dispatch()
 
     def handle_frontend(self, request):
-        #  Dequeue and drop the next worker address
-        worker_identity = self.workers.popleft()
+        self.tasks.append(request)
+        self.dispatch()
+
+    def update_task_latency(self, worker_identity: bytes) -> None:
+        """
+        Update the estimate of how long a task takes, using the batch the worker has
+        just finished.
+        """
 
-        message = [worker_identity, b''] + request
-        self.backend.send_multipart(message)
-        if len(self.workers) == 0:
-            # stop receiving until workers become available again
-            self.frontend.stop_on_recv()
+        batch = self.batches.pop(worker_identity, None)
+        if batch is None:
+            return
+        start, no_tasks = batch
+        latency = (time.perf_counter() - start) / no_tasks
+        if self.task_latency is None:
+            self.task_latency = latency
+        else:
+            self.task_latency += (latency - self.task_latency) * self.latency_smoothing
+
+    def batch_size(self) -> int:
+        """
+        :return: how many tasks to send to the next worker
+        """
+
+        if self.task_latency is None:
+            # Nothing is known about how long tasks take
+            batch_size = 1
+        else:
+            batch_size = int(self.batch_duration / max(self.task_latency, 1e-6))
+            batch_size = max(1, min(batch_size, self.max_batch_size))
+        # Share the waiting tasks among the available workers
+        share = -(-len(self.tasks) // len(self.workers))
+        return min(batch_size, share)
+
+    def dispatch(self) -> None:
+        """
+        Send waiting tasks to available workers, and receive from the frontend only
+        while there is room for more tasks.
+        """
+
+        while self.workers and self.tasks:
+            no_tasks = self.batch_size()
+            # Dequeue and drop the next worker address
+            worker_identity = self.workers.popleft()
+            message = [worker_identity, b'']
+            for i in range(no_tasks):
+                message.extend(self.tasks.popleft())
+            self.batches[worker_identity] = (time.perf_counter(), no_tasks)
+            self.backend.send_multipart(message)
+
+        if len(self.tasks) >= self.max_tasks:
+            if self.receiving:
+                self.frontend.stop_on_recv()
+                self.receiving = False
+        elif not self.receiving and (self.workers or self.batches):
+            # on first recv from a worker, start accepting frontend messages
+            self.frontend.on_recv(self.handle_frontend)
+            self.receiving = True
 
 
 class LoadBalancer:
@@ -576,16 +698,16 @@ class LoadBalancer:
 
         context = zmq.Context()
         frontend = context.socket(zmq.PULL)
-        frontend_port = frontend.bind_to_random_port('tcp://*')
+        frontend_port = bind_to_random_port(frontend)
 
         backend = context.socket(zmq.ROUTER)
-        backend_port = backend.bind_to_random_port('tcp://*')
+        backend_port = bind_to_random_port(backend)
 
         reply = context.socket(zmq.REP)
-        reply.connect("tcp://localhost:{}".format(args.receive))
+        reply.connect(endpoint(args.receive))
 
         controller = context.socket(zmq.PULL)
-        controller.connect('tcp://localhost:{}'.format(self.controller_port))
+        controller.connect(endpoint(self.controller_port))
 
         sink_port = args.send
         logging_port = args.logging
@@ -640,10 +762,10 @@ class LoadBalancerManager(ProcessManager, QObject):
     def start_load_balancer(self) -> None:
 
         self.controller_socket = self.context.socket(zmq.PUSH)
-        self.controller_port = self.controller_socket.bind_to_random_port('tcp://*')
+        self.controller_port = bind_to_random_port(self.controller_socket)
 
         self.requester = self.context.socket(zmq.REQ)
-        self.requester_port = self.requester.bind_to_random_port('tcp://*')
+        self.requester_port = bind_to_random_port(self.requester)
 
         self.thread_controller = self. context.socket(zmq.PAIR)
         self.thread_controller.connect('inproc://{}'.format(self.thread_name))
@@ -694,7 +816,7 @@ class PushPullDaemonManager(PullPipelineManager):
 
         # Ventilator socket to send message to worker
         self.ventilator_socket = context.socket(zmq.PUSH)
-        self.ventilator_port = self.ventilator_socket.bind_to_random_port('tcp://*')
+        self.ventilator_port = bind_to_random_port(self.ventilator_socket)
 
     def stop(self) -> None:
         """
@@ -754,15 +876,20 @@ class PublishPullPipelineManager(PullPipelineManager):
 
         # Ventilator socket to send messages to workers on
         self.ventilator_socket = context.socket(zmq.PUB)
-        self.ventilator_port= self.ventilator_socket.bind_to_random_port('tcp://*')
+        self.ventilator_port= bind_to_random_port(self.ventilator_socket)
 
         # Socket to synchronize the start of each worker
         self.sync_service_socket = context.socket(zmq.REP)
-        self.sync_service_port = self.sync_service_socket.bind_to_random_port("tcp://*")
+        self.sync_service_port = bind_to_random_port(self.sync_service_socket)
 
         # Socket for worker control: pause, resume, stop
         self.controller_socket = context.socket(zmq.PUB)
-        self.controller_port = self.controller_socket.bind_to_random_port("tcp://*")
+        self.controller_port = bind_to_random_port(self.controller_socket)
+
+        # Workers are started on demand, e.g. whenever a device is inserted, so
+        # preload their modules in a fork server rather than having each worker
+        # start a new Python interpreter
+        self.worker_pool = WarmWorkerPool(script=self._get_script(), name=self._process_name)
 
     def stop(self) -> None:
         """
@@ -803,6 +930,7 @@ class PublishPullPipelineManager(PullPipelineManager):
 
     def start_worker(self, worker_id: bytes, data: bytes) -> None:
 
+        start = time.perf_counter()
         self.add_worker(int(worker_id))
 
         # Send START commands until scan worker indicates it is ready to
@@ -822,6 +950,11 @@ class PublishPullPipelineManager(PullPipelineManager):
                 # There is no point flooding the network
                 time.sleep(.01)
 
+        logging.debug(
+            "%s worker %s was ready to receive data %.3f seconds after being started",
+            self._process_name, int(worker_id), time.perf_counter() - start
+        )
+
         # Send data to process to tell it what to work on
         self.send_message_to_worker(data=data, worker_id=worker_id)
 
@@ -872,7 +1005,7 @@ class ProcessLoggerPublisher:
     def __init__(self, context: zmq.Context, name: str, notification_port: int) -> None:
 
         self.logger_pub = context.socket(zmq.PUB)
-        self.logger_pub_port = self.logger_pub.bind_to_random_port("tcp://*")
+        self.logger_pub_port = bind_to_random_port(self.logger_pub)
         self.handler = ZeroMQSocketHandler(self.logger_pub)
         self.handler.setLevel(logging.DEBUG)
 
@@ -881,7 +1014,7 @@ class ProcessLoggerPublisher:
         self.logger.addHandler(self.handler)
     
         self.logger_socket = context.socket(zmq.PUSH)
-        self.logger_socket.connect("tcp://localhost:{}".format(notification_port))
+        self.logger_socket.connect(endpoint(notification_port))
         self.logger_socket.send_multipart([b'CONNECT', str(self.logger_pub_port).encode()])
 
     def close(self):
@@ -967,10 +1100,10 @@ class DaemonProcess(WorkerProcess):
         # Socket to send messages along the pipe to
         self.sender = self.context.socket(zmq.PUSH)
         self.sender.set_hwm(10)
-        self.sender.connect("tcp://localhost:{}".format(args.send))
+        self.sender.connect(endpoint(args.send))
 
         self.receiver = self.context.socket(zmq.PULL)
-        self.receiver.connect("tcp://localhost:{}".format(args.receive))
+        self.receiver.connect(endpoint(args.receive))
 
         self.worker_id = None
 
@@ -1026,21 +1159,21 @@ class WorkerInPublishPullPipeline(WorkerProcess):
         # Socket to send messages along the pipe to
         self.sender = self.context.socket(zmq.PUSH)
         self.sender.set_hwm(10)
-        self.sender.connect("tcp://localhost:{}".format(args.send))
+        self.sender.connect(endpoint(args.send))
 
         # Socket to receive messages from the pipe
         self.receiver = self.context.socket(zmq.SUB)
-        self.receiver.connect("tcp://localhost:{}".format(args.receive))
+        self.receiver.connect(endpoint(args.receive))
         self.receiver.setsockopt(zmq.SUBSCRIBE, subscription_filter)
 
         # Socket to receive controller messages: stop, pause, resume
         self.controller = self.context.socket(zmq.SUB)
-        self.controller.connect("tcp://localhost:{}".format(args.controller))
+        self.controller.connect(endpoint(args.controller))
         self.controller.setsockopt(zmq.SUBSCRIBE, subscription_filter)
 
         # Socket to synchronize the start of receiving data from upstream
         self.sync_client = self.context.socket(zmq.REQ)
-        self.sync_client.connect("tcp://localhost:{}".format(args.syncclient))
+        self.sync_client.connect(endpoint(args.syncclient))
 
     def check_for_command(self, directive: bytes, content) -> None:
         if directive == b'cmd':
@@ -1109,12 +1242,12 @@ class LoadBalancerWorker:
         self.requester = self.context.socket(zmq.REQ)
         self.identity = create_identity(worker_type, args.identity)
         self.requester.identity = self.identity
-        self.requester.connect("tcp://localhost:{}".format(args.request))
+        self.requester.connect(endpoint(args.request))
 
         # Sender is located in the main process. It is where output (messages)
         # from this process are are sent to.
         self.sender = self.context.socket(zmq.PUSH)
-        self.sender.connect("tcp://localhost:{}".format(args.send))
+        self.sender.connect(endpoint(args.send))
         
         self.logger_publisher = ProcessLoggerPublisher(
             context=self.context, name=worker_type, notification_port=args.logging
@@ -1128,6 +1261,19 @@ class LoadBalancerWorker:
         # Implement in subclass
         pass
 
+    def receive_tasks(self) -> List[Tuple[bytes, bytes]]:
+        """
+        Receive the next batch of tasks from the load balancer.
+
+        Reply to the load balancer only once every task in the batch has been
+        processed.
+
+        :return: list of directive and content for each task
+        """
+
+        frames = self.requester.recv_multipart()
+        return list(zip(frames[::2], frames[1::2]))
+
     def cleanup_pre_stop(self) -> None:
         """
         Operations to run if process is stopped.
@@ -1174,7 +1320,7 @@ class ProcessLoggingManager(QObject):
 
         # Socket to receive subscription information, and the stop command
         info_socket = context.socket(zmq.PULL)
-        self.info_port = info_socket.bind_to_random_port('tcp://*')
+        self.info_port = bind_to_random_port(info_socket)
 
         poller = zmq.Poller()
         poller.register(self.receiver, zmq.POLLIN)
@@ -1210,7 +1356,7 @@ class ProcessLoggingManager(QObject):
             logging.critical('Incorrect port value in add logging subscription: %s', port)
         else:
             logging.debug("Subscribing to logging on port %s", port)
-            self.receiver.connect("tcp://localhost:{}".format(port))
+            self.receiver.connect(endpoint(port))
 
     def removeSubscription(self, port: bytes):
         try:
@@ -1219,7 +1365,7 @@ class ProcessLoggingManager(QObject):
             logging.critical('Incorrect port value in remove logging subscription: %s', port)
         else:
             logging.debug("Unsubscribing to logging on port %s", port)
-            self.receiver.disconnect("tcp://localhost:{}".format(port))
+            self.receiver.disconnect(endpoint(port))
 
 
 def stop_process_logging_manager(info_port: int) -> None:
@@ -1231,7 +1377,7 @@ def stop_process_logging_manager(info_port: int) -> None:
 
     context = zmq.Context.instance()
     command =  context.socket(zmq.PUSH)
-    command.connect("tcp://localhost:{}".format(info_port))
+    command.connect(endpoint(info_port))
     command.send_multipart([b'STOP', b''])
 
 
@@ -1293,6 +1439,12 @@ class ScanResults:
         self.entire_photo_required = entire_photo_required
 
 
+# A backup location the copyfiles process writes files to while downloading them,
+# so the backup process does not have to read them again.
+# path is the backup location, including any path suffix.
+BackupFanOutDestination = namedtuple('BackupFanOutDestination', 'device_id path file_type')
+
+
 class CopyFilesArguments:
     """
     Pass arguments to the copyfiles process
@@ -1305,7 +1457,10 @@ class CopyFilesArguments:
                   files: List[RPDFile],
                   verify_file: bool,
                   generate_thumbnails: bool,
-                  log_gphoto2: bool) -> None:
+                  log_gphoto2: bool,
+                  copy_engine: CopyEngine,
+                  hash_algorithm: HashAlgorithm,
+                  backup_fan_out: Optional[List[BackupFanOutDestination]]=None) -> None:
         self.scan_id = scan_id
         self.device = device
         self.photo_download_folder = photo_download_folder
@@ -1314,6 +1469,9 @@ class CopyFilesArguments:
         self.generate_thumbnails = generate_thumbnails
         self.verify_file = verify_file
         self.log_gphoto2 = log_gphoto2
+        self.copy_engine = copy_engine
+        self.hash_algorithm = hash_algorithm
+        self.backup_fan_out = backup_fan_out or []
 
 
 class CopyFilesResults:
@@ -1331,7 +1489,11 @@ class CopyFilesResults:
                  download_count: Optional[int]=None,
                  mdata_exceptions: Optional[Tuple]=None,
                  problems: Optional[CopyingProblems]=None,
-                 camera_removed: Optional[bool]=None) -> None:
+                 camera_removed: Optional[bool]=None,
+                 io_request: Optional[Tuple[str, str]]=None,
+                 io_release: Optional[bool]=None,
+                 backup_temp_dirs: Optional[List[str]]=None,
+                 backup_chunk_downloaded: Optional[int]=None) -> None:
         """
 
         :param scan_id: scan id of the device the files are being
@@ -1351,6 +1513,14 @@ class CopyFilesResults:
         :param mdata_exceptions: details of errors setting file metadata
         :param problems: details of any problems encountered copying files,
          not including metedata write problems.
+        :param camera_removed: the camera was removed during the copy
+        :param io_request: source bus and destination file system the
+         worker requests permission to copy between
+        :param io_release: the worker no longer needs permission to copy
+        :param backup_temp_dirs: temp directory paths on backup devices,
+         used to write backups into while files are downloaded
+        :param backup_chunk_downloaded: how many bytes were written to
+         backup devices since the last message
         """
 
         self.scan_id = scan_id
@@ -1367,6 +1537,10 @@ class CopyFilesResults:
         self.mdata_exceptions = mdata_exceptions
         self.problems = problems
         self.camera_removed = camera_removed
+        self.io_request = io_request
+        self.io_release = io_release
+        self.backup_temp_dirs = backup_temp_dirs
+        self.backup_chunk_downloaded = backup_chunk_downloaded
 
 
 class ThumbnailDaemonData:
@@ -1464,6 +1638,7 @@ class BackupFileData:
                  verify_file: Optional[bool]=None,
                  download_count: Optional[int]=None,
                  save_fdo_thumbnail: Optional[int]=None,
+                 copy_engine: Optional[CopyEngine]=None,
                  message: Optional[BackupStatus]=None) -> None:
         self.rpd_file = rpd_file
         self.move_succeeded = move_succeeded
@@ -1473,6 +1648,7 @@ class BackupFileData:
         self.verify_file = verify_file
         self.download_count = download_count
         self.save_fdo_thumbnail = save_fdo_thumbnail
+        self.copy_engine = copy_engine
         self.message = message
 
 
@@ -1559,19 +1735,99 @@ class GenerateThumbnailsArguments:
         self.entire_photo_required = entire_photo_required
 
 
+# Uncompressed 32 bit pixels of a QImage, with the image's dimensions, stride and format
+RawImage = namedtuple('RawImage', 'width, height, bytes_per_line, format, data')
+
+_raw_image_formats = (
+    QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied
+)
+
+
+def qimage_to_raw(image: QImage) -> RawImage:
+    """
+    Copy the pixels of an image so they can be sent to another process without
+    encoding them as PNG.
+
+    :param image: the image to copy
+    :return: the pixels, converted to ARGB32 premultiplied if the image is not
+     already in a 32 bit RGB format
+    """
+
+    if image.format() not in _raw_image_formats:
+        image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    size = image.bytesPerLine() * image.height()
+    return RawImage(
+        width=image.width(), height=image.height(), bytes_per_line=image.bytesPerLine(),
+        format=int(image.format()), data=image.constBits().asstring(size)
+    )
+
+
+def qimage_from_raw(raw: RawImage) -> QImage:
+    """
+    :param raw: pixels returned by qimage_to_raw()
+    :return: an image that uses the pixels without copying them. raw must not be
+     garbage collected until the image is no longer used.
+    """
+
+    return QImage(
+        raw.data, raw.width, raw.height, raw.bytes_per_line, QImage.Format(raw.format)
+    )
+
+
 class GenerateThumbnailsResults:
     def __init__(self, rpd_file: Optional[RPDFile]=None,
                  thumbnail_bytes: Optional[bytes]=None,
                  scan_id: Optional[int]=None,
                  cache_dirs: Optional[CacheDirs]=None,
-                 camera_removed: Optional[bool]=None,) -> None:
+                 camera_removed: Optional[bool]=None,
+                 thumbnail_image: Optional[RawImage]=None) -> None:
         self.rpd_file = rpd_file
-        # If thumbnail_bytes is None, there is no thumbnail
+        # If thumbnail_bytes and thumbnail_image are both None, there is no thumbnail.
+        # thumbnail_bytes is an encoded image, e.g. a JPEG from the thumbnail cache.
         self.thumbnail_bytes = thumbnail_bytes
+        # Pixels of a thumbnail the thumbnail extractor generated
+        self.thumbnail_image = thumbnail_image
         self.scan_id = scan_id
         self.cache_dirs = cache_dirs
         self.camera_removed = camera_removed
 
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state['thumbnail_bytes'] = to_shared_memory(self.thumbnail_bytes)
+        if self.thumbnail_image is not None:
+            state['thumbnail_image'] = self.thumbnail_image._replace(
+                data=to_shared_memory(self.thumbnail_image.data)
+            )
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        state['thumbnail_bytes'] = from_shared_memory(state['thumbnail_bytes'])
+        thumbnail_image = state.get('thumbnail_image')
+        if thumbnail_image is not None:
+            state['thumbnail_image'] = thumbnail_image._replace(
+                data=from_shared_memory(thumbnail_image.data)
+            )
+        else:
+            state['thumbnail_image'] = None
+        self.__dict__.update(state)
+
+    def thumbnail(self) -> QPixmap:
+        """
+        :return: the thumbnail, or a null pixmap if there is no thumbnail or it
+         could not be loaded
+        """
+
+        if self.thumbnail_image is not None:
+            thumbnail = qimage_from_raw(self.thumbnail_image)
+        elif self.thumbnail_bytes is not None:
+            thumbnail = QImage.fromData(self.thumbnail_bytes)
+        else:
+            return QPixmap()
+        if thumbnail.isNull():
+            return QPixmap()
+        # Copies the pixels
+        return QPixmap.fromImage(thumbnail)
+
 
 class ThumbnailExtractorArgument:
     def __init__(self, rpd_file: RPDFile,
@@ -1599,6 +1855,18 @@ class ThumbnailExtractorArgument:
         self.send_thumb_to_main = send_thumb_to_main
         self.force_exiftool = force_exiftool
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # Full size previews extracted from raw files can be several megabytes
+        state = self.__dict__.copy()
+        state['exif_buffer'] = to_shared_memory(self.exif_buffer)
+        state['thumbnail_bytes'] = to_shared_memory(self.thumbnail_bytes)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        state['exif_buffer'] = from_shared_memory(state['exif_buffer'])
+        state['thumbnail_bytes'] = from_shared_memory(state['thumbnail_bytes'])
+        self.__dict__.update(state)
+
 
 class RenameMoveFileManager(PushPullDaemonManager):
     """
@@ -1648,15 +1916,7 @@ class ThumbnailDaemonManager(PushPullDaemonManager):
 
     def process_sink_data(self) -> None:
         data = pickle.loads(self.content) # type: GenerateThumbnailsResults
-        if data.thumbnail_bytes is None:
-            thumbnail = QPixmap()
-        else:
-            thumbnail = QImage.fromData(data.thumbnail_bytes)
-            if thumbnail.isNull():
-                thumbnail = QPixmap()
-            else:
-                thumbnail = QPixmap.fromImage(thumbnail)
-        self.message.emit(data.rpd_file, thumbnail)
+        self.message.emit(data.rpd_file, data.thumbnail())
 
 
 class OffloadManager(PushPullDaemonManager):
@@ -1779,27 +2039,85 @@ class CopyFilesManager(PublishPullPipelineManager):
     """
 
     message = pyqtSignal(bool, RPDFile, int, 'PyQt_PyObject')
-    tempDirs = pyqtSignal(int, str,str)
+    tempDirs = pyqtSignal(int, str, str, list)
     bytesDownloaded = pyqtSignal(int, 'PyQt_PyObject', 'PyQt_PyObject')
+    bytesBackedUp = pyqtSignal('PyQt_PyObject', 'PyQt_PyObject')
     copyProblems = pyqtSignal(int, 'PyQt_PyObject')
     cameraRemoved = pyqtSignal(int)
+    ioLimits = pyqtSignal('PyQt_PyObject')
 
-    def __init__(self, logging_port: int) -> None:
+    # Regularly check for workers that died holding permission to copy
+    check_workers_interval = 2000
+
+    def __init__(self, logging_port: int, io_scheduler: IOScheduler) -> None:
         super().__init__(logging_port=logging_port, thread_name=ThreadNames.copy)
         self._process_name = 'Copy Files Manager'
         self._process_to_run = 'copyfiles.py'
+        self.io_scheduler = io_scheduler
+
+    def grant_io(self, worker_ids: List[int]) -> None:
+        """
+        Tell workers they can start copying
+        """
+
+        for worker_id in worker_ids:
+            self.controller_socket.send_multipart([make_filter_from_worker_id(worker_id), b'GO'])
+
+    def release_io(self, worker_id: int) -> None:
+        """
+        Release the permission to copy held or requested by a worker that will not
+        release it itself, and grant it to workers that are waiting
+        """
+
+        if worker_id in self.io_scheduler.granted or worker_id in self.io_scheduler.waiting:
+            logging.debug("Releasing permission to copy held by worker %s", worker_id)
+            self.grant_io(self.io_scheduler.release(worker_id))
+
+    def worker_done(self, worker_id: int) -> None:
+        self.release_io(worker_id)
+
+    def check_workers(self) -> None:
+        io_workers = list(self.io_scheduler.granted) + list(self.io_scheduler.waiting)
+        for worker_id in io_workers:
+            process = self.processes.get(worker_id)
+            try:
+                alive = process is not None and process.is_running() and \
+                        process.status() != psutil.STATUS_ZOMBIE
+            except psutil.NoSuchProcess:
+                alive = False
+            if not alive:
+                logging.error("Copy files worker %s is no longer running", worker_id)
+                self.release_io(worker_id)
 
     def process_sink_data(self) -> None:
         data = pickle.loads(self.content) # type: CopyFilesResults
-        if data.total_downloaded is not None:
+        if data.io_request is not None:
+            no_budgets = len(self.io_scheduler.limits())
+            source, destination = data.io_request
+            self.grant_io(self.io_scheduler.request(data.scan_id, source, destination))
+            limits = self.io_scheduler.limits()
+            if len(limits) != no_budgets:
+                self.ioLimits.emit(limits)
+
+        elif data.io_release is not None:
+            self.grant_io(self.io_scheduler.release(data.scan_id))
+
+        elif data.total_downloaded is not None:
             assert data.scan_id is not None
             if data.chunk_downloaded < 0:
                 logging.critical("Chunk downloaded is less than zero: %s", data.chunk_downloaded)
             if data.total_downloaded < 0:
                 logging.critical("Chunk downloaded is less than zero: %s", data.total_downloaded)
 
+            self.grant_io(self.io_scheduler.record_bytes(data.scan_id, data.chunk_downloaded))
+            if self.io_scheduler.limits_changed:
+                self.ioLimits.emit(self.io_scheduler.limits())
+
             self.bytesDownloaded.emit(data.scan_id, data.total_downloaded, data.chunk_downloaded)
 
+        elif data.backup_chunk_downloaded is not None:
+            self.bytesBackedUp.emit(data.scan_id, data.backup_chunk_downloaded)
+
         elif data.copy_succeeded is not None:
             assert data.rpd_file is not None
             assert data.download_count is not None
@@ -1816,4 +2134,6 @@ class CopyFilesManager(PublishPullPipelineManager):
             assert (data.photo_temp_dir is not None and
                     data.video_temp_dir is not None)
             assert data.scan_id is not None
-            self.tempDirs.emit(data.scan_id, data.photo_temp_dir, data.video_temp_dir)
\ No newline at end of file
+            self.tempDirs.emit(
+                data.scan_id, data.photo_temp_dir, data.video_temp_dir, data.backup_temp_dirs or []
+            )
\ No newline at end of file
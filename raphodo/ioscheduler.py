@@ -0,0 +1,317 @@
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Coordinate disk and bus access between the processes that copy files from
+devices, so that downloading from many devices at once does not cause them to
+fight over a shared USB bus or a shared destination disk.
+
+Each copy worker asks the scheduler for permission before copying. The
+scheduler grants permission only if the worker's source bus and destination
+file system both have capacity, as determined by their I/O budgets. The
+budgets adapt their limits according to the throughput measured while
+workers are copying.
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, List, Set, Tuple, Callable
+
+
+def usb_bus_from_camera_port(port: str) -> Optional[str]:
+    r"""
+    Determine the USB bus from a libgphoto2 camera port
+
+    >>> usb_bus_from_camera_port('usb:001,005')
+    'usb1'
+    >>> usb_bus_from_camera_port('usb:')
+    >>> usb_bus_from_camera_port('ptpip:192.168.1.1')
+    """
+
+    m = re.match(r'usb:(\d+),\d+', port)
+    if m is not None:
+        return 'usb{}'.format(int(m.group(1)))
+    return None
+
+
+def source_key_for_path(path: str) -> str:
+    """
+    Determine the bus a path is on, e.g. a memory card reader on USB bus 2.
+
+    If the bus cannot be determined, the block device is used instead.
+
+    :param path: path on the device
+    :return: key identifying the bus or device
+    """
+
+    try:
+        st_dev = os.stat(path).st_dev
+    except OSError:
+        return 'path:{}'.format(path)
+    major, minor = os.major(st_dev), os.minor(st_dev)
+    sys_path = os.path.realpath('/sys/dev/block/{}:{}'.format(major, minor))
+    m = re.search(r'/(usb\d+)/', sys_path)
+    if m is not None:
+        return m.group(1)
+    return 'dev:{}:{}'.format(major, minor)
+
+
+def destination_key_for_path(path: str) -> str:
+    """
+    :param path: path on the destination file system
+    :return: key identifying the file system
+    """
+
+    try:
+        return 'fs:{}'.format(os.stat(path).st_dev)
+    except OSError:
+        return 'path:{}'.format(path)
+
+
+class IOBudget:
+    """
+    Limits how many workers can concurrently use a source bus or destination
+    file system.
+
+    When adaptive, the limit is tuned by hill climbing: after each measurement
+    window in which more than one worker wanted access, the limit is moved
+    one step. The step continues in the same direction while throughput
+    improves, and reverses when it falls. When throughput is unchanged, a
+    lower limit is preferred, because it means less contention.
+    """
+
+    def __init__(self, key: str,
+                 maximum: int,
+                 adaptive: bool,
+                 window: float=5.0,
+                 tolerance: float=0.05) -> None:
+        """
+        :param key: identifies the source bus or destination file system
+        :param maximum: the most workers that can ever be granted access.
+         The limit starts at this value.
+        :param adaptive: if True, adapt the limit to measured throughput
+        :param window: minimum seconds over which throughput is measured
+        :param tolerance: fractional change in throughput regarded as no change
+        """
+
+        self.key = key
+        self.maximum = max(maximum, 1)
+        self.limit = self.maximum
+        self.adaptive = adaptive
+        self.window = window
+        self.tolerance = tolerance
+
+        self.active = set()  # type: Set[int]
+        self.contended = False
+        self.bytes = 0
+        self.window_start = None  # type: Optional[float]
+        self.previous_throughput = None  # type: Optional[float]
+        self.direction = -1
+
+    def has_capacity(self) -> bool:
+        return len(self.active) < self.limit
+
+    def record_bytes(self, no_bytes: int, now: float) -> bool:
+        """
+        Record bytes transferred by a worker using this budget
+
+        :return: True if the limit was changed, else False
+        """
+
+        if self.window_start is None:
+            self.window_start = now
+            self.bytes = 0
+        self.bytes += no_bytes
+        elapsed = now - self.window_start
+        if elapsed < self.window:
+            return False
+
+        throughput = self.bytes / elapsed
+        contended = self.contended
+        self.window_start = now
+        self.bytes = 0
+        self.contended = len(self.active) > 1
+        if not (self.adaptive and contended):
+            return False
+        return self.adjust(throughput)
+
+    def adjust(self, throughput: float) -> bool:
+        """
+        Move the limit one step, according to the change in throughput.
+
+        :param throughput: bytes per second measured in the last window
+        :return: True if the limit was changed, else False
+        """
+
+        previous = self.previous_throughput
+        self.previous_throughput = throughput
+        if previous is not None:
+            if throughput < previous * (1 - self.tolerance):
+                self.direction = -self.direction
+            elif throughput <= previous * (1 + self.tolerance):
+                self.direction = -1
+
+        limit = min(max(self.limit + self.direction, 1), self.maximum)
+        if limit == self.limit:
+            return False
+        logging.debug(
+            "Adjusting I/O limit for %s from %s to %s (%.1f MB/s)",
+            self.key, self.limit, limit, throughput / 1048576
+        )
+        self.limit = limit
+        return True
+
+
+class IOScheduler:
+    """
+    Grant copy workers permission to read from their source and write to their
+    destination, enforcing a limit of concurrent reads per source bus and
+    concurrent writes per destination file system.
+
+    Requests are granted in the order they were made, except that a request
+    that cannot be granted does not block later requests for other sources
+    and destinations.
+    """
+
+    def __init__(self, max_reads_per_source: int,
+                 max_writes_per_destination: int,
+                 adaptive: bool=True,
+                 clock: Callable[[], float]=time.monotonic) -> None:
+        """
+        :param max_reads_per_source: maximum concurrent reads from a source bus
+        :param max_writes_per_destination: maximum concurrent writes to a
+         destination file system
+        :param adaptive: if True, adapt limits within these maximums according
+         to measured throughput
+        :param clock: returns the current time in seconds
+        """
+
+        self.max_reads_per_source = max_reads_per_source
+        self.max_writes_per_destination = max_writes_per_destination
+        self.adaptive = adaptive
+        self.clock = clock
+
+        self.sources = dict()  # type: Dict[str, IOBudget]
+        self.destinations = dict()  # type: Dict[str, IOBudget]
+        # Worker id: source and destination keys
+        self.waiting = OrderedDict()  # type: OrderedDict[int, Tuple[str, str]]
+        self.granted = dict()  # type: Dict[int, Tuple[str, str]]
+        self.limits_changed = False
+
+    def _budgets(self, source: str, destination: str) -> Tuple[IOBudget, IOBudget]:
+        if source not in self.sources:
+            self.sources[source] = IOBudget(
+                key=source, maximum=self.max_reads_per_source, adaptive=self.adaptive
+            )
+        if destination not in self.destinations:
+            self.destinations[destination] = IOBudget(
+                key=destination, maximum=self.max_writes_per_destination, adaptive=self.adaptive
+            )
+        return self.sources[source], self.destinations[destination]
+
+    def request(self, worker_id: int, source: str, destination: str) -> List[int]:
+        """
+        Request permission for a worker to copy. A worker that already holds
+        permission gives it up.
+
+        :param worker_id: the worker making the request
+        :param source: key identifying the source bus
+        :param destination: key identifying the destination file system
+        :return: workers that have been granted permission, which might not
+         include the requesting worker
+        """
+
+        self._release(worker_id)
+        source_budget, dest_budget = self._budgets(source, destination)
+        if self.granted or self.waiting:
+            source_budget.contended = dest_budget.contended = True
+        self.waiting[worker_id] = (source, destination)
+        return self._grant()
+
+    def release(self, worker_id: int) -> List[int]:
+        """
+        Release the permission held by a worker, or cancel its request
+
+        :param worker_id: the worker that has finished copying
+        :return: workers that have been granted permission
+        """
+
+        self._release(worker_id)
+        return self._grant()
+
+    def _release(self, worker_id: int) -> None:
+        self.waiting.pop(worker_id, None)
+        keys = self.granted.pop(worker_id, None)
+        if keys is not None:
+            source, destination = keys
+            self.sources[source].active.discard(worker_id)
+            self.destinations[destination].active.discard(worker_id)
+
+    def _grant(self) -> List[int]:
+        granted = []
+        for worker_id, (source, destination) in list(self.waiting.items()):
+            source_budget, dest_budget = self._budgets(source, destination)
+            if source_budget.has_capacity() and dest_budget.has_capacity():
+                del self.waiting[worker_id]
+                self.granted[worker_id] = (source, destination)
+                source_budget.active.add(worker_id)
+                dest_budget.active.add(worker_id)
+                granted.append(worker_id)
+            else:
+                source_budget.contended = dest_budget.contended = True
+        return granted
+
+    def record_bytes(self, worker_id: int, no_bytes: int) -> List[int]:
+        """
+        Record bytes copied by a worker, adapting limits if needed.
+
+        Check limits_changed afterwards to determine if any limit changed.
+
+        :param worker_id: the worker that copied the bytes
+        :param no_bytes: number of bytes copied since the last report
+        :return: workers that have been granted permission as a result of
+         limits being raised
+        """
+
+        self.limits_changed = False
+        keys = self.granted.get(worker_id)
+        if keys is None:
+            return []
+        source, destination = keys
+        now = self.clock()
+        for budget in (self.sources[source], self.destinations[destination]):
+            if budget.record_bytes(no_bytes, now):
+                self.limits_changed = True
+        if self.limits_changed:
+            return self._grant()
+        return []
+
+    def limits(self) -> Dict[str, int]:
+        """
+        :return: current limit for each source bus and destination file system
+        """
+
+        limits = {key: budget.limit for key, budget in self.sources.items()}
+        limits.update({key: budget.limit for key, budget in self.destinations.items()})
+        return limits
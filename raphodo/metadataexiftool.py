@@ -29,7 +29,7 @@ __copyright__ = "Copyright 2007-2020, Damon Lynch"
 import datetime
 import re
 import logging
-from typing import Optional, Union, Any, Tuple, List
+from typing import Optional, Union, Any, Tuple, List, Dict, Iterable
 from collections import OrderedDict
 
 import raphodo.exiftool as exiftool
@@ -654,6 +654,109 @@ class MetadataExiftool():
 
         return [v for v in self.index_preview.values() if v in self.metadata]
 
+    def summary(self, complete: bool=True) -> Optional['MetadataSummary']:
+        """
+        Capture the metadata values used to generate file and subfolder names that
+        have already been read, without ExifTool reading the file again.
+
+        Metadata read from an excerpt of the file, or from a secondary file like a
+        THM file, may lack values the full file has. Its file modification date is
+        also that of the excerpt or secondary file. Missing values are therefore not
+        captured, and the file modification date is never used as the date time.
+
+        :param complete: True if the metadata was read from the full file
+        :return: the values, or None if the metadata has not been read
+        """
+
+        if not self.metadata:
+            return None
+
+        values = {
+            field: getattr(self, field)(missing=None) for field in (
+                'sub_seconds', 'camera_make', 'camera_model', 'camera_serial',
+                'shutter_count', 'width', 'height'
+            )
+        }
+        values['date_time'] = self.date_time(missing=None, ignore_file_modify_date=not complete)
+        if self.metadata_string_format:
+            values['file_number'] = self.file_number(missing=None)
+        if not complete:
+            values = {field: value for field, value in values.items() if value is not None}
+        return MetadataSummary(values)
+
+
+class MetadataSummary:
+    """
+    Metadata values used to generate file and subfolder names, captured when the
+    metadata was read to generate the file's thumbnail.
+
+    The summary is kept with the file, and provides the same methods as the
+    metadata classes for the values it captured. The rename process uses it in
+    place of reading the metadata from the file again, when it has every value the
+    file and subfolder name preferences use.
+    """
+
+    __slots__ = ('values', )
+
+    def __init__(self, values: Dict[str, Any]) -> None:
+        """
+        :param values: metadata method name and the value it returned, or None if
+         the value is missing from the file's metadata
+        """
+
+        self.values = values
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return self.values
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.values = state
+
+    def provides(self, fields: Iterable[str]) -> bool:
+        """
+        :param fields: names of metadata methods
+        :return: True if a value was captured for every method
+        """
+
+        return all(field in self.values for field in fields)
+
+    def _value(self, field: str, missing: Any) -> Any:
+        v = self.values[field]
+        if v is None:
+            return missing
+        return v
+
+    def date_time(self, missing: Optional[str]='',
+                  ignore_file_modify_date: bool=False) -> Union[datetime.datetime, Any]:
+        return self._value('date_time', missing)
+
+    def sub_seconds(self, missing='00') -> Union[str, Any]:
+        return self._value('sub_seconds', missing)
+
+    def camera_make(self, missing='') -> Union[str, Any]:
+        return self._value('camera_make', missing)
+
+    def camera_model(self, missing='') -> Union[str, Any]:
+        return self._value('camera_model', missing)
+
+    def short_camera_model(self, includeCharacters='', missing=''):
+        return MetadataExiftool.short_camera_model(self, includeCharacters, missing)
+
+    def camera_serial(self, missing='') -> Union[str, Any]:
+        return self._value('camera_serial', missing)
+
+    def shutter_count(self, missing='') -> Union[str, Any]:
+        return self._value('shutter_count', missing)
+
+    def file_number(self, missing='') -> Union[str, Any]:
+        return self._value('file_number', missing)
+
+    def width(self, missing='') -> Union[str, Any]:
+        return self._value('width', missing)
+
+    def height(self, missing='') -> Union[str, Any]:
+        return self._value('height', missing)
+
 
 if __name__ == '__main__':
     import sys
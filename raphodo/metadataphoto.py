@@ -380,6 +380,35 @@ class MetaData(metadataexiftool.MetadataExiftool, GExiv2.Metadata):
         except (KeyError, AttributeError):
             return missing
 
+    def summary(self, complete: bool=True) -> metadataexiftool.MetadataSummary:
+        """
+        Capture the metadata values used to generate file and subfolder names that
+        Exiv2 has already read, without ExifTool reading the file.
+
+        Metadata read from an excerpt of the file may lack values the full file
+        has, so a value missing from the excerpt is not captured.
+
+        :param complete: True if the metadata was read from the full file
+        :return: the values
+        """
+
+        values = {
+            field: getattr(self, field)(missing=None) for field in (
+                'date_time', 'sub_seconds', 'camera_make', 'camera_model', 'camera_serial'
+            )
+        }
+
+        # Sony shutter counts and Canon file numbers are read using ExifTool
+        shutter_count = self._fetch_vendor(VENDOR_SHUTTER_COUNT, None)
+        if shutter_count is not None or self.camera_make().lower() != 'sony':
+            values['shutter_count'] = shutter_count
+        if 'Exif.CanonFi.FileNumber' not in self:
+            values['file_number'] = None
+
+        if not complete or self.full_file_name is None:
+            values = {field: value for field, value in values.items() if value is not None}
+        return metadataexiftool.MetadataSummary(values)
+
     def get_small_thumbnail(self) -> bytes:
         """
         Get the small thumbnail image (if it exists)
@@ -34,7 +34,7 @@ except locale.Error:
 
 from PyQt5.QtGui import QGuiApplication
 from raphodo.interprocess import (DaemonProcess, OffloadData, OffloadResults, DownloadDestination)
-from raphodo.proximity import TemporalProximityGroups
+from raphodo.proximity import TemporalProximityGroups, TimestampIndex
 from raphodo.viewutils import ThumbnailDataForProximity
 from raphodo.folderspreview import FoldersPreview
 
@@ -42,6 +42,9 @@ from raphodo.folderspreview import FoldersPreview
 class OffloadWorker(DaemonProcess):
     def __init__(self) -> None:
         super().__init__('Offload')
+        # Retained between generations of the Timeline, so that only files added or
+        # removed since the last generation need to be merged into it
+        self.timestamps = TimestampIndex()
 
     def run(self) -> None:
         try:
@@ -53,7 +56,8 @@ class OffloadWorker(DaemonProcess):
                 data = pickle.loads(content) # type: OffloadData
                 if data.thumbnail_rows:
                     groups = TemporalProximityGroups(
-                        thumbnail_rows=data.thumbnail_rows, temporal_span=data.proximity_seconds
+                        thumbnail_rows=data.thumbnail_rows, temporal_span=data.proximity_seconds,
+                        timestamps=self.timestamps
                     )
                     self.content = pickle.dumps(
                         OffloadResults(proximity_groups=groups),
@@ -0,0 +1,172 @@
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Memory bounded cache of the thumbnails displayed in the Thumbnail View.
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+from collections import OrderedDict
+import logging
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from PyQt5.QtGui import QPixmap
+
+
+def pixmap_size(pixmap: QPixmap) -> int:
+    """
+    :return: approximate memory used by the pixmap, in bytes
+    """
+
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+class ThumbnailPixmapCache:
+    """
+    Thumbnails keyed by uid, with the least recently used thumbnails evicted from
+    memory when the thumbnails in the cache use more than the maximum size.
+
+    Only a thumbnail that can be found in the on disk thumbnail cache is evicted: only
+    its location is kept, and it is reloaded from disk the next time it is needed.
+    Other thumbnails, and placeholders such as the generic photo and video icons, are
+    never evicted.
+    """
+
+    def __init__(self, max_size_mb: int,
+                 locate: Callable[[bytes], Optional[Any]],
+                 load: Callable[[Any], Optional[QPixmap]],
+                 placeholder: Callable[[bytes], QPixmap]) -> None:
+        """
+        :param max_size_mb: maximum memory used by evictable thumbnails, in megabytes
+        :param locate: called with a thumbnail's uid when the thumbnail is about to be
+         evicted. Returns the thumbnail's location in the on disk cache, or None if it
+         is not there.
+        :param load: called with a thumbnail's location to reload it. Returns the
+         thumbnail, or None if it could not be loaded.
+        :param placeholder: called with a thumbnail's uid when it could not be
+         reloaded. Returns the placeholder to use in its place.
+        """
+
+        self.max_size = max_size_mb * 1024 * 1024
+        self.locate = locate
+        self.load = load
+        self.placeholder = placeholder
+
+        # uid: QPixmap, least recently used first
+        self.pixmaps = OrderedDict()  # type: OrderedDict[bytes, QPixmap]
+        # Memory used by self.pixmaps
+        self.size = 0
+        # uid: QPixmap
+        self.pinned = {}  # type: Dict[bytes, QPixmap]
+        # uid: location in the on disk cache
+        self.evicted = {}  # type: Dict[bytes, Any]
+
+        self.no_evicted = self.no_reloaded = 0
+
+    def __len__(self) -> int:
+        return len(self.pixmaps) + len(self.pinned) + len(self.evicted)
+
+    def __contains__(self, uid: bytes) -> bool:
+        return uid in self.pixmaps or uid in self.pinned or uid in self.evicted
+
+    def __getitem__(self, uid: bytes) -> QPixmap:
+        pixmap = self.pixmaps.get(uid)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(uid)
+            return pixmap
+        pixmap = self.pinned.get(uid)
+        if pixmap is not None:
+            return pixmap
+        location = self.evicted.pop(uid)
+        pixmap = self.load(location)
+        self.no_reloaded += 1
+        if pixmap is None:
+            pixmap = self.placeholder(uid)
+            self.pinned[uid] = pixmap
+        else:
+            self[uid] = pixmap
+        return pixmap
+
+    def __setitem__(self, uid: bytes, pixmap: QPixmap) -> None:
+        """
+        Add a thumbnail that may be evicted, replacing any placeholder or previous
+        thumbnail.
+        """
+
+        self._discard(uid)
+        self.pixmaps[uid] = pixmap
+        self.size += pixmap_size(pixmap)
+        self._evict()
+
+    def __delitem__(self, uid: bytes) -> None:
+        if uid not in self:
+            raise KeyError(uid)
+        self._discard(uid)
+
+    def _discard(self, uid: bytes) -> None:
+        pixmap = self.pixmaps.pop(uid, None)
+        if pixmap is not None:
+            self.size -= pixmap_size(pixmap)
+        else:
+            self.pinned.pop(uid, None)
+            self.evicted.pop(uid, None)
+
+    def set_placeholder(self, uid: bytes, pixmap: QPixmap) -> None:
+        """
+        Add a thumbnail that is never evicted, typically one shared by many files.
+        """
+
+        self._discard(uid)
+        self.pinned[uid] = pixmap
+
+    def _evict(self) -> None:
+        # Never evict the most recently used thumbnail
+        while self.size > self.max_size and len(self.pixmaps) > 1:
+            uid, pixmap = self.pixmaps.popitem(last=False)
+            self.size -= pixmap_size(pixmap)
+            location = self.locate(uid)
+            if location is None:
+                self.pinned[uid] = pixmap
+            else:
+                self.evicted[uid] = location
+                self.no_evicted += 1
+
+    def prefetch(self, uids: Iterable[bytes]) -> int:
+        """
+        Reload evicted thumbnails that are about to be displayed, and mark the others
+        as recently used so they are not evicted.
+
+        :param uids: thumbnails to prefetch, most important last
+        :return: number of thumbnails reloaded from disk
+        """
+
+        reloaded = self.no_reloaded
+        for uid in uids:
+            if uid in self:
+                self[uid]
+        return self.no_reloaded - reloaded
+
+    def log_state(self) -> None:
+        logging.debug(
+            "Thumbnail pixmap cache: %s thumbnails in memory using %.1f MB; %s pinned; "
+            "%s evicted; %s evictions and %s reloads in total",
+            len(self.pixmaps), self.size / 1024 / 1024, len(self.pinned), len(self.evicted),
+            self.no_evicted, self.no_reloaded
+        )
@@ -343,6 +343,8 @@ class Preferences:
         video_backup_identifier=xdg_videos_identifier(),
         backup_photo_location=os.path.expanduser('~'),
         backup_video_location=os.path.expanduser('~'),
+        # write backups while downloading, instead of reading downloaded files again:
+        backup_during_download=True,
     )
     automation_defaults = dict(
         auto_download_at_startup=False,
@@ -351,14 +353,27 @@ class Preferences:
         auto_exit=False,
         auto_exit_force=False,
         move=False,
-        verify_file=False
+        verify_file=False,
+        # see constants.HashAlgorithm:
+        verify_file_hash=int(constants.HashAlgorithm.blake2b),
     )
     performance_defaults = dict(
         generate_thumbnails=True,
         use_thumbnail_cache=True,
         save_fdo_thumbnails=True,
         max_cpu_cores=max(available_cpu_count(physical_only=True), 2),
-        keep_thumbnails_days=30
+        keep_thumbnails_days=30,
+        # memory used by thumbnails displayed in the main window before the least
+        # recently used are reloaded from the thumbnail cache when needed:
+        thumbnail_memory_cache_mb=256,
+        # save thumbnails in the thumbnail cache packed into segment files:
+        pack_thumbnail_cache=True,
+        # see constants.CopyEngine:
+        copy_engine=int(constants.CopyEngine.kernel),
+        # limits when downloading from more than one device simultaneously:
+        max_reads_per_source_bus=2,
+        max_writes_per_destination=2,
+        adapt_io_limits=True,
     )
     error_defaults = dict(
         conflict_resolution=int(constants.ConflictResolution.skip),
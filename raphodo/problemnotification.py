@@ -180,6 +180,12 @@ class FileCopyProblem(SeriousProblem):
         return escape(_('Unable to copy file %s')) % self.href
 
 
+class FileVerificationProblem(SeriousProblem):
+    @property
+    def body(self) -> str:
+        return escape(_('Verification failed for file %s')) % self.href
+
+
 class FileZeroLengthProblem(SeriousProblem):
     @property
     def body(self) -> str:
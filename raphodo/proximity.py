@@ -20,17 +20,23 @@ __author__ = 'Damon Lynch'
 __copyright__ = "Copyright 2015-2020, Damon Lynch"
 
 from collections import (namedtuple, defaultdict, deque, Counter)
-from operator import attrgetter
+from operator import attrgetter, ne
 import locale
-from datetime import datetime
+from datetime import datetime, date, tzinfo
+from bisect import bisect_left, bisect_right
 import logging
-from itertools import groupby
+from itertools import groupby, compress
 import pickle
 from pprint import pprint
 from typing import Dict, List, Tuple, Set, Optional, DefaultDict
 
 import arrow.arrow
 from arrow.arrow import Arrow
+try:
+    import numpy
+    have_numpy = True
+except ImportError:
+    have_numpy = False
 
 from PyQt5.QtCore import (
     QAbstractTableModel, QModelIndex, Qt, QSize, QSizeF, QRect, QItemSelection, QItemSelectionModel,
@@ -64,7 +70,307 @@ ProximityRow = namedtuple(
                     'tooltip_date_col1, tooltip_date_col2'
 )
 
-UidTime = namedtuple('UidTime', 'ctime, arrowtime, uid, previously_downloaded')
+
+
+# Days from 1 January of year 1 to the Unix epoch
+_epoch_ordinal = date(1970, 1, 1).toordinal()
+
+# Changes in the local time zone's offset from UTC, e.g. daylight savings, occur on a
+# multiple of 15 minutes, so the offset need only be determined once for each 15 minutes
+_offset_interval = 900
+
+
+def _local_utc_offset(interval: int, local_tz: tzinfo) -> float:
+    """
+    :param interval: the number of 15 minute intervals since the epoch
+    :param local_tz: the local time zone
+    :return: the local time zone's offset in seconds from UTC during the interval
+    """
+
+    return datetime.fromtimestamp(
+        interval * _offset_interval, local_tz
+    ).utcoffset().total_seconds()
+
+
+def _day_numbers(ctimes: List[float], local_tz: tzinfo, offsets: Dict[int, float]) -> List[int]:
+    """
+    Determine the calendar day in the local time zone of timestamps
+
+    :param ctimes: timestamps
+    :param local_tz: the local time zone, as used by arrow
+    :param offsets: cache of the local time zone's offset from UTC, by 15 minute interval.
+     Is updated.
+    :return: the day of each timestamp as a proleptic Gregorian ordinal
+    """
+
+    day_numbers = []  # type: List[int]
+    for ctime in ctimes:
+        interval = int(ctime // _offset_interval)
+        offset = offsets.get(interval)
+        if offset is None:
+            offset = offsets[interval] = _local_utc_offset(interval, local_tz)
+        day_numbers.append(int((ctime + offset) // 86400) + _epoch_ordinal)
+    return day_numbers
+
+
+def _day_numbers_numpy(ctimes: List[float],
+                       local_tz: tzinfo,
+                       offsets: Dict[int, float]) -> List[int]:
+    """
+    Vectorized version of _day_numbers()
+    """
+
+    ctimes = numpy.array(ctimes, dtype=numpy.float64)
+    intervals, interval_indexes = numpy.unique(
+        numpy.floor_divide(ctimes, _offset_interval).astype(numpy.int64), return_inverse=True
+    )
+    interval_offsets = []
+    for interval in intervals.tolist():
+        offset = offsets.get(interval)
+        if offset is None:
+            offset = offsets[interval] = _local_utc_offset(interval, local_tz)
+        interval_offsets.append(offset)
+    interval_offsets = numpy.array(interval_offsets, dtype=numpy.float64)
+    day_numbers = numpy.floor_divide(
+        ctimes + interval_offsets[interval_indexes.ravel()], 86400
+    ).astype(numpy.int64) + _epoch_ordinal
+    return day_numbers.tolist()
+
+
+class TimestampIndex:
+    """
+    Files in the Timeline sorted by their timestamp, kept from one generation of the
+    Timeline to the next.
+
+    Files added or removed since the last generation are merged into or removed from
+    the index, rather than sorting every file again. The calendar day of each file and
+    the gap between it and the file before it are kept alongside its timestamp, which
+    means a change in the temporal span is applied by thresholding the gaps.
+    """
+
+    def __init__(self) -> None:
+        self.clear()
+
+    def clear(self) -> None:
+        # Parallel lists, sorted by timestamp
+        self.ctimes = []  # type: List[float]
+        self.uids = []  # type: List[bytes]
+        self.file_types = []  # type: List[FileType]
+        self.previously_downloaded = []  # type: List[bool]
+        # Calendar day of each file as a proleptic Gregorian ordinal
+        self.day_numbers = []  # type: List[int]
+        # Seconds between each file and the file before it. Zero for the first file.
+        self.gaps = []  # type: List[float]
+
+        # uid: ThumbnailDataForProximity
+        self.rows = dict()  # type: Dict[bytes, ThumbnailDataForProximity]
+
+        self.local_tz = None  # type: Optional[tzinfo]
+        # 15 minute interval: the local time zone's offset in seconds from UTC
+        self.offsets = dict()  # type: Dict[int, float]
+
+        self._day_runs = None  # type: Optional[Tuple[List[int], List[int]]]
+        self._group_starts = None  # type: Optional[Tuple[int, List[int]]]
+
+    def __len__(self) -> int:
+        return len(self.ctimes)
+
+    def update(self, thumbnail_rows: List[ThumbnailDataForProximity], local_tz: tzinfo) -> None:
+        """
+        Bring the index up to date with the files now in the Timeline
+
+        :param thumbnail_rows: every file that is to appear in the Timeline
+        :param local_tz: the local time zone, as used by arrow
+        """
+
+        if local_tz != self.local_tz:
+            self.clear()
+            self.local_tz = local_tz
+
+        # Compare with the files already indexed without looping in Python, because
+        # every file is compared each time the Timeline is generated
+        rows = dict(zip(map(attrgetter('uid'), thumbnail_rows), thumbnail_rows))
+        if rows == self.rows:
+            return
+        removed = list(
+            compress(self.rows.values(), map(ne, map(rows.get, self.rows), self.rows.values()))
+        )
+        added = list(
+            compress(
+                thumbnail_rows,
+                map(ne, map(self.rows.get, map(attrgetter('uid'), thumbnail_rows)), thumbnail_rows)
+            )
+        )
+
+        self._day_runs = self._group_starts = None
+
+        if len(removed) + len(added) > len(rows) // 4:
+            # Cheaper to sort everything again
+            self._build(thumbnail_rows)
+        else:
+            removed_indexes = []  # type: List[int]
+            for row in removed:
+                index = self._index(row)
+                new_row = rows.get(row.uid)
+                if new_row is not None and new_row.ctime == row.ctime:
+                    # Only the file type or download status changed: update it in place
+                    self.file_types[index] = new_row.file_type
+                    self.previously_downloaded[index] = new_row.previously_downloaded
+                else:
+                    removed_indexes.append(index)
+            if removed_indexes:
+                self._remove(sorted(removed_indexes))
+            added = [
+                row for row in added if row.uid not in self.rows or
+                                        self.rows[row.uid].ctime != row.ctime
+            ]
+            if added:
+                self._insert(sorted(added, key=attrgetter('ctime')))
+
+        self.rows = rows
+
+    def _build(self, thumbnail_rows: List[ThumbnailDataForProximity]) -> None:
+        thumbnail_rows = sorted(thumbnail_rows, key=attrgetter('ctime'))
+        self.ctimes = [row.ctime for row in thumbnail_rows]
+        self.uids = [row.uid for row in thumbnail_rows]
+        self.file_types = [row.file_type for row in thumbnail_rows]
+        self.previously_downloaded = [row.previously_downloaded for row in thumbnail_rows]
+        if not self.ctimes:
+            self.day_numbers = []
+            self.gaps = []
+        elif have_numpy:
+            self.day_numbers = _day_numbers_numpy(self.ctimes, self.local_tz, self.offsets)
+            self.gaps = [0.0] + numpy.diff(numpy.array(self.ctimes, dtype=numpy.float64)).tolist()
+        else:
+            self.day_numbers = _day_numbers(self.ctimes, self.local_tz, self.offsets)
+            self.gaps = [0.0] + [
+                ctime - prev_ctime for prev_ctime, ctime in zip(self.ctimes, self.ctimes[1:])
+            ]
+
+    def _index(self, row: ThumbnailDataForProximity) -> int:
+        index = bisect_left(self.ctimes, row.ctime)
+        while self.uids[index] != row.uid:
+            index += 1
+        return index
+
+    def _columns(self) -> Tuple[List, ...]:
+        return (
+            self.ctimes, self.uids, self.file_types, self.previously_downloaded,
+            self.day_numbers, self.gaps
+        )
+
+    def _set_columns(self, columns: Tuple[List, ...]) -> None:
+        (self.ctimes, self.uids, self.file_types, self.previously_downloaded,
+         self.day_numbers, self.gaps) = columns
+
+    def _update_gaps(self, indexes: Set[int]) -> None:
+        for index in indexes:
+            if index < len(self.ctimes):
+                self.gaps[index] = self.ctimes[index] - self.ctimes[index - 1] if index else 0.0
+
+    def _insert(self, rows: List[ThumbnailDataForProximity]) -> None:
+        """
+        Merge files into the index in a single pass, locating where each goes
+        using a binary search.
+
+        :param rows: files to insert, sorted by timestamp
+        """
+
+        ctimes = [row.ctime for row in rows]
+        positions = [bisect_right(self.ctimes, ctime) for ctime in ctimes]
+        new_values = (
+            ctimes, [row.uid for row in rows], [row.file_type for row in rows],
+            [row.previously_downloaded for row in rows],
+            _day_numbers(ctimes, self.local_tz, self.offsets), [0.0] * len(rows)
+        )
+        columns = []
+        for values, inserted in zip(self._columns(), new_values):
+            merged = []
+            start = 0
+            for position, value in zip(positions, inserted):
+                merged.extend(values[start:position])
+                merged.append(value)
+                start = position
+            merged.extend(values[start:])
+            columns.append(merged)
+        self._set_columns(tuple(columns))
+
+        # The gap before each inserted file, and before the file that follows it
+        indexes = set()  # type: Set[int]
+        for count, position in enumerate(positions):
+            indexes.add(position + count)
+            indexes.add(position + count + 1)
+        self._update_gaps(indexes)
+
+    def _remove(self, indexes: List[int]) -> None:
+        """
+        Remove files from the index in a single pass
+
+        :param indexes: the index of each file to remove, sorted
+        """
+
+        columns = []
+        for values in self._columns():
+            kept = []
+            start = 0
+            for index in indexes:
+                kept.extend(values[start:index])
+                start = index + 1
+            kept.extend(values[start:])
+            columns.append(kept)
+        self._set_columns(tuple(columns))
+
+        # The gap before each file that followed a removed file
+        self._update_gaps({index - count for count, index in enumerate(indexes)})
+
+    def day_runs(self) -> Tuple[List[int], List[int]]:
+        """
+        :return: the index of the first timestamp in each run of timestamps on the
+         same calendar day, and the day of each run as a proleptic Gregorian ordinal
+        """
+
+        if self._day_runs is None:
+            if have_numpy and self.day_numbers:
+                day_numbers = numpy.array(self.day_numbers, dtype=numpy.int64)
+                day_run_starts = numpy.concatenate(
+                    ([0], numpy.flatnonzero(numpy.diff(day_numbers)) + 1)
+                )
+                self._day_runs = (
+                    day_run_starts.tolist(), day_numbers[day_run_starts].tolist()
+                )
+            else:
+                day_run_starts = []  # type: List[int]
+                day_numbers = []  # type: List[int]
+                prev_day_number = None
+                for index, day_number in enumerate(self.day_numbers):
+                    if day_number != prev_day_number:
+                        day_run_starts.append(index)
+                        day_numbers.append(day_number)
+                        prev_day_number = day_number
+                self._day_runs = (day_run_starts, day_numbers)
+        return self._day_runs
+
+    def group_starts(self, temporal_span: int) -> List[int]:
+        """
+        :param temporal_span: the time span that separates proximity groups
+        :return: the index of the first timestamp in each proximity group, i.e. those
+         timestamps more than the temporal span after the previous timestamp
+        """
+
+        if self._group_starts is None or self._group_starts[0] != temporal_span:
+            if have_numpy and self.gaps:
+                group_starts = [0] + (
+                    numpy.flatnonzero(
+                        numpy.array(self.gaps[1:], dtype=numpy.float64) > temporal_span
+                    ) + 1
+                ).tolist()
+            else:
+                group_starts = [0] + [
+                    index for index, gap in enumerate(self.gaps)
+                    if index and gap > temporal_span
+                ]
+            self._group_starts = (temporal_span, group_starts)
+        return self._group_starts[1]
 
 
 def humanize_time_span(start: Arrow, end: Arrow,
@@ -181,7 +487,12 @@ def humanize_time_span(start: Arrow, end: Arrow,
 
     strip = strip_leading_zero_from_time
 
-    if start.floor('minute') == end.floor('minute'):
+    # Compare the datetime values rather than using Arrow.floor(), which is slow
+    start_datetime = start.datetime
+    end_datetime = end.datetime
+
+    if start_datetime.replace(second=0, microsecond=0) == \
+            end_datetime.replace(second=0, microsecond=0):
         short_format = strip_zero(locale_time(start.datetime), strip)
         if not long_format:
             return short_format
@@ -195,7 +506,7 @@ def humanize_time_span(start: Arrow, end: Arrow,
                 time=short_format
             )
 
-    if start.floor('day') == end.floor('day'):
+    if start_datetime.date() == end_datetime.date():
         # both dates are on the same day
         start_time = strip_zero(locale_time(start.datetime), strip)
         end_time = strip_zero(locale_time(end.datetime), strip)
@@ -244,7 +555,7 @@ def humanize_time_span(start: Arrow, end: Arrow,
         numeric_day=end.format('D')
     )
 
-    if start.floor('year') != end.floor('year') or long_format:
+    if start_datetime.year != end_datetime.year or long_format:
         # Translators: for example Nov 3 2015
         # Translators: %(variable)s represents Python code, not a plural of the term
         # variable. You must keep the %(variable)s untranslated, or the program will
@@ -690,7 +1001,16 @@ class TemporalProximityGroups:
 
     # @profile
     def __init__(self, thumbnail_rows: List[ThumbnailDataForProximity],
-                 temporal_span: int = 3600):
+                 temporal_span: int = 3600,
+                 timestamps: Optional[TimestampIndex] = None):
+        """
+        :param thumbnail_rows: the files to display in the Timeline
+        :param temporal_span: the time span that separates proximity groups
+        :param timestamps: index of the files used the last time the Timeline
+         was generated, which is brought up to date with thumbnail_rows. If None, a new
+         index is created. The index is not retained, so it is not pickled.
+        """
+
         self.rows = []  # type: List[ProximityRow]
 
         self.invalid_rows = tuple()  # type: Tuple[int]
@@ -699,7 +1019,8 @@ class TemporalProximityGroups:
         self.uids = MetaUid()
 
         self.file_types_in_cell = dict()  # type: Dict[Tuple[int, int], str]
-        times_by_proximity = defaultdict(list)  # type: DefaultDict[int, Arrow]
+        # group_no: (start time, end time)
+        times_by_proximity = dict()  # type: Dict[int, Tuple[Arrow, Arrow]]
 
         # The rows the user sees in column 2 can span more than one row of the Timeline.
         # Each day always spans at least one row in the Timeline, possibly more.
@@ -709,13 +1030,10 @@ class TemporalProximityGroups:
         # group_no: (
         uids_by_day_in_proximity_group = dict()  # type: Dict[int, Tuple[Tuple[int, int, int], List[bytes]]]
 
-        # uid: (year, month, day)
-        year_month_day = dict()  # type: Dict[bytes, Tuple[int, int, int]]
-
         # group_no: List[uid]
-        uids_by_proximity = defaultdict(list)  # type: Dict[int, List[bytes, ...]]
+        uids_by_proximity = dict()  # type: Dict[int, List[bytes, ...]]
         # Determine if proximity group contains any files have not been previously downloaded
-        new_files_by_proximity = defaultdict(set)  # type: Dict[int, Set[bool]]
+        new_files_by_proximity = dict()  # type: Dict[int, bool]
 
         # Text that will appear in column 2 -- they proximity groups
         text_by_proximity = deque()
@@ -755,59 +1073,53 @@ class TemporalProximityGroups:
 
         self.display_values = ProximityDisplayValues()
 
-        thumbnail_rows.sort(key=attrgetter('ctime'))
-
-        # Generate an arrow date time for every timestamp we have
-        uid_times = [
-            UidTime(
-                tr.ctime, arrow.get(tr.ctime).to('local'), tr.uid, tr.previously_downloaded
-            )
-            for tr in thumbnail_rows
-        ]
-
-        self.thumbnail_types = tuple(row.file_type for row in thumbnail_rows)
-
         now = arrow.now().to('local')
         current_year = now.year
         current_month = now.month
 
+        # Rather than generate an arrow date time for every timestamp, determine the
+        # calendar day of every timestamp, and where each proximity group starts.
+        # Arrow date times are generated only for the start and end of each group.
+        if timestamps is None:
+            timestamps = TimestampIndex()
+        timestamps.update(thumbnail_rows, now.tzinfo)
+
+        ctimes = timestamps.ctimes
+        sorted_uids = uids = timestamps.uids
+        previously_downloaded = timestamps.previously_downloaded
+        no_rows = len(ctimes)
+
+        self.thumbnail_types = tuple(timestamps.file_types)
+
+        day_run_starts, day_numbers = timestamps.day_runs()
+        group_starts = timestamps.group_starts(temporal_span)
+        # (year, month, day) of each run of timestamps on the same calendar day
+        day_run_ymds = [
+            date.fromordinal(day_number).timetuple()[:3] for day_number in day_numbers
+        ]
+        day_run_ends = day_run_starts[1:] + [no_rows]
+        group_ends = group_starts[1:] + [no_rows]
+
         # Phase 1: Associate unique ids with their year, month and day
-        for x in uid_times:
-            t = x.arrowtime  # type: Arrow
-            year = t.year
-            month = t.month
-            day = t.day
-
-            # Could use arrow.floor here, but it's extremely slow
-            self.day_groups[(year, month, day)].append(x.uid)
-            self.month_groups[(year, month)].append(x.uid)
-            self.year_groups[year].append(x.uid)
+        for start, end, (year, month, day) in zip(day_run_starts, day_run_ends, day_run_ymds):
+            day_uids = uids[start:end]
+            self.day_groups[(year, month, day)].extend(day_uids)
+            self.month_groups[(year, month)].extend(day_uids)
+            self.year_groups[year].extend(day_uids)
             if year != current_year:
                 # the Timeline contains an entry from the previous year to now
                 self._previous_year = True
             if month != current_month or self._previous_year:
                 # the Timeline contains an entry from the previous month to now
                 self._previous_month = True
-            # Remember this extracted value
-            year_month_day[x.uid] = year, month, day
 
         # Phase 2: Identify the proximity groups
-        group_no = 0
-        prev = uid_times[0]
-
-        times_by_proximity[group_no].append(prev.arrowtime)
-        uids_by_proximity[group_no].append(prev.uid)
-        new_files_by_proximity[group_no].add(not prev.previously_downloaded)
-
-        if len(uid_times) > 1:
-            for current in uid_times[1:]:
-                ctime = current.ctime
-                if ctime - prev.ctime > temporal_span:
-                    group_no += 1
-                times_by_proximity[group_no].append(current.arrowtime)
-                uids_by_proximity[group_no].append(current.uid)
-                new_files_by_proximity[group_no].add(not current.previously_downloaded)
-                prev = current
+        for group_no, (start, end) in enumerate(zip(group_starts, group_ends)):
+            times_by_proximity[group_no] = (
+                arrow.get(ctimes[start]).to('local'), arrow.get(ctimes[end - 1]).to('local')
+            )
+            uids_by_proximity[group_no] = uids[start:end]
+            new_files_by_proximity[group_no] = not all(previously_downloaded[start:end])
 
         # Phase 3: Generate the proximity group's text that will appear in
         # the right-most column and its tooltips.
@@ -817,33 +1129,35 @@ class TemporalProximityGroups:
         # in the proximity group is more than 1, then also keep a copy of the group
         # where it is broken into separate calendar days
 
-        # The iteration order doesn't really matter here, so can get away with the
-        # potentially unsorted output of dict.items()
-        for group_no, group in times_by_proximity.items():
-            start = group[0]  # type: Arrow
-            end = group[-1]  # type: Arrow
+        # (year, month, day) of the first file in each proximity group
+        y_m_d_by_proximity = dict()  # type: Dict[int, Tuple[int, int, int]]
+
+        for group_no, (start, end) in enumerate(zip(group_starts, group_ends)):
+            start_time, end_time = times_by_proximity[group_no]
 
             # Generate the text
-            short_form = humanize_time_span(start, end, insert_cr_on_long_line=True)
-            long_form = humanize_time_span(start, end, long_format=True)
+            short_form = humanize_time_span(start_time, end_time, insert_cr_on_long_line=True)
+            long_form = humanize_time_span(start_time, end_time, long_format=True)
             text_by_proximity.append((short_form, long_form))
 
+            # The runs of timestamps on the same calendar day that are in this group
+            first_run = bisect_right(day_run_starts, start) - 1
+            last_run = bisect_left(day_run_starts, end) - 1
+            y_m_d_by_proximity[group_no] = day_run_ymds[first_run]
+
             # Calculate the number of calendar days spanned by this proximity group
             # e.g. 2015-12-1 12:00 - 2015-12-2 15:00 = 2 days
-            if len(group) > 1:
-                span = len(list(Arrow.span_range('day', start, end)))
-                day_spans_by_proximity[group_no] = span
-                if span > 1:
-                    # break the proximity group members into calendar days
-                    uids_by_day_in_proximity_group[group_no] = tuple(
-                        (y_m_d, list(day))
-                        for y_m_d, day in groupby(
-                            uids_by_proximity[group_no], year_month_day.get
-                        )
+            span = day_numbers[last_run] - day_numbers[first_run] + 1
+            day_spans_by_proximity[group_no] = span
+            if span > 1:
+                # break the proximity group members into calendar days
+                uids_by_day_in_proximity_group[group_no] = tuple(
+                    (
+                        day_run_ymds[run],
+                        uids[max(day_run_starts[run], start):min(day_run_ends[run], end)]
                     )
-            else:
-                # start == end
-                day_spans_by_proximity[group_no] = 1
+                    for run in range(first_run, last_run + 1)
+                )
 
         # Phase 4: Generate the rows to be displayed in the Timeline
 
@@ -864,13 +1178,11 @@ class TemporalProximityGroups:
 
             timeline_row += 1
 
-            proximity_group_times = times_by_proximity[group_no]
-            atime = proximity_group_times[0]  # type: Arrow
-            uid = uids_by_proximity[group_no][0]  # type: bytes
-            y_m_d = year_month_day[uid]
+            atime = times_by_proximity[group_no][0]  # type: Arrow
+            y_m_d = y_m_d_by_proximity[group_no]
 
             col2_text, tooltip_col2_text = text_by_proximity.popleft()
-            new_file = any(new_files_by_proximity[group_no])
+            new_file = new_files_by_proximity[group_no]
 
             self.rows.append(
                 self.make_row(
@@ -890,7 +1202,7 @@ class TemporalProximityGroups:
             # self.dump_row(group_no)
 
             if span == 1:
-                thumbnail_index += len(proximity_group_times)
+                thumbnail_index += len(uids)
                 continue
 
             thumbnail_index += len(uids_by_day_in_proximity_group[group_no][0])
@@ -962,10 +1274,10 @@ class TemporalProximityGroups:
             for uid in uids:
                 uid_rows_c2[uid] = proximity_view_cell_id
 
-        assert len(uid_rows_c2) == len(uid_rows_c1) == len(thumbnail_rows)
+        assert len(uid_rows_c2) == len(uid_rows_c1) == len(sorted_uids)
 
         self.col1_col2_uid = [
-            (uid_rows_c1[row.uid], uid_rows_c2[row.uid], row.uid) for row in thumbnail_rows
+            (uid_rows_c1[uid], uid_rows_c2[uid], uid) for uid in sorted_uids
         ]
 
         # Assign depth before wiping values used to determine it
@@ -1240,7 +1552,8 @@ class TemporalProximityModel(QAbstractTableModel):
                 for col in (0, 1, 2):
                     if row in self.groups.uids._uids[col]:
                         uids = self.groups.uids._uids[col][row]
-                        files = ', '.join((thumbnailModel.rpd_files[uid].name for uid in uids))
+                        catalogue = thumbnailModel.catalogue
+                        files = ', '.join(catalogue.name[catalogue.ids[uid]] for uid in uids)
                         logging.debug('Col {}: {}'.format(col, files))
 
     def updatePreviouslyDownloaded(self, uids: List[bytes]) -> None:
@@ -110,9 +110,12 @@ from raphodo.storage import (
 from raphodo.interprocess import (
     ScanArguments, CopyFilesArguments, RenameAndMoveFileData, BackupArguments,
     BackupFileData, OffloadData, ProcessLoggingManager, ThumbnailDaemonData, ThreadNames,
+    BackupFanOutDestination,
     OffloadManager, CopyFilesManager, ThumbnailDaemonManager,
     ScanManager, BackupManager, stop_process_logging_manager, RenameMoveFileManager,
     create_inproc_msg)
+from raphodo.transport import create_ipc_directory
+from raphodo.ioscheduler import IOScheduler
 from raphodo.devices import (
     Device, DeviceCollection, BackupDevice, BackupDeviceCollection, FSMetadataErrors
 )
@@ -124,7 +127,7 @@ from raphodo.constants import (
     DisplayingFilesOfType, DownloadingFileTypes, RememberThisMessage, RightSideButton,
     CheckNewVersionDialogState, CheckNewVersionDialogResult, RememberThisButtons,
     BackupStatus, CompletedDownloads, disable_version_check, FileManagerType, ScalingAction,
-    ScalingDetected
+    ScalingDetected, CopyEngine, HashAlgorithm
 )
 from raphodo.thumbnaildisplay import (
     ThumbnailView, ThumbnailListModel, ThumbnailDelegate, DownloadStats, MarkedSummary
@@ -1100,16 +1103,25 @@ class RapidWindow(QMainWindow):
 
         # Setup the copyfiles process
         self.copyfilesThread = QThread()
-        self.copyfilesmq = CopyFilesManager(logging_port=self.logging_port)
+        io_scheduler = IOScheduler(
+            max_reads_per_source=self.prefs.max_reads_per_source_bus,
+            max_writes_per_destination=self.prefs.max_writes_per_destination,
+            adaptive=self.prefs.adapt_io_limits
+        )
+        self.copyfilesmq = CopyFilesManager(
+            logging_port=self.logging_port, io_scheduler=io_scheduler
+        )
 
         self.copyfilesThread.started.connect(self.copyfilesmq.run_sink)
         self.copyfilesmq.sinkStarted.connect(self.initStage8)
         self.copyfilesmq.message.connect(self.copyfilesDownloaded)
         self.copyfilesmq.bytesDownloaded.connect(self.copyfilesBytesDownloaded)
+        self.copyfilesmq.bytesBackedUp.connect(self.backupFileBytesBackedUp)
         self.copyfilesmq.tempDirs.connect(self.tempDirsReceivedFromCopyFiles)
         self.copyfilesmq.copyProblems.connect(self.copyfilesProblems)
         self.copyfilesmq.workerFinished.connect(self.copyfilesFinished)
         self.copyfilesmq.cameraRemoved.connect(self.cameraRemovedWhileCopyingFiles)
+        self.copyfilesmq.ioLimits.connect(self.copyfilesIOLimits)
 
         self.copyfilesmq.moveToThread(self.copyfilesThread)
 
@@ -3302,6 +3314,28 @@ Do you want to proceed with the download?
 
         verify_file = self.prefs.verify_file
 
+        # Backups the copy files process should write while downloading
+        backup_fan_out = []  # type: List[BackupFanOutDestination]
+        if self.prefs.backup_files and self.prefs.backup_during_download:
+            for path in self.backup_devices:
+                backup_type = self.backup_devices[path].backup_type
+                for file_type, no_files in (
+                        (FileType.photo, download_stats.no_photos),
+                        (FileType.video, download_stats.no_videos)):
+                    if no_files and self.backupDeviceTakesFileType(backup_type, file_type):
+                        path_suffix = self.backupPathSuffix(file_type)
+                        if path_suffix is not None:
+                            dest_base_dir = os.path.join(path, path_suffix)
+                        else:
+                            dest_base_dir = path
+                        backup_fan_out.append(
+                            BackupFanOutDestination(
+                                device_id=self.backup_devices.device_id(path),
+                                path=dest_base_dir,
+                                file_type=file_type
+                            )
+                        )
+
         # Initiate copy files process
 
         device = self.devices[scan_id]
@@ -3313,18 +3347,22 @@ Do you want to proceed with the download?
             files=files,
             verify_file=verify_file,
             generate_thumbnails=generate_thumbnails,
-            log_gphoto2=self.log_gphoto2
+            log_gphoto2=self.log_gphoto2,
+            copy_engine=CopyEngine(self.prefs.copy_engine),
+            hash_algorithm=HashAlgorithm(self.prefs.verify_file_hash),
+            backup_fan_out=backup_fan_out
         )
 
         self.sendStartWorkerToThread(self.copy_controller, worker_id=scan_id, data=copyfiles_args)
 
-    @pyqtSlot(int, str, str)
+    @pyqtSlot(int, str, str, list)
     def tempDirsReceivedFromCopyFiles(self, scan_id: int,
                                       photo_temp_dir: str,
-                                      video_temp_dir: str) -> None:
-        self.fileSystemFilter.setTempDirs([photo_temp_dir, video_temp_dir])
+                                      video_temp_dir: str,
+                                      backup_temp_dirs: List[str]) -> None:
+        self.fileSystemFilter.setTempDirs([photo_temp_dir, video_temp_dir] + backup_temp_dirs)
         self.temp_dirs_by_scan_id[scan_id] = list(
-            filter(None,[photo_temp_dir, video_temp_dir])
+            filter(None,[photo_temp_dir, video_temp_dir] + backup_temp_dirs)
         )
 
     def cleanAllTempDirs(self):
@@ -3422,6 +3460,19 @@ Do you want to proceed with the download?
         self.time_remaining.update(scan_id, bytes_downloaded=chunk_downloaded)
         self.updateFileDownloadDeviceProgress()
 
+    @pyqtSlot('PyQt_PyObject')
+    def copyfilesIOLimits(self, limits: Dict[str, int]) -> None:
+        """
+        Record the limits the I/O scheduler is applying to concurrent reads
+        from each source bus and writes to each destination file system
+        """
+
+        logging.debug(
+            "I/O limits while copying files: %s",
+            ', '.join('{} {}'.format(key, limit) for key, limit in sorted(limits.items()))
+        )
+        self.download_tracker.set_io_limits(limits)
+
     @pyqtSlot(int, 'PyQt_PyObject')
     def copyfilesProblems(self, scan_id: int, problems: CopyingProblems) -> None:
         for problem in self.copy_metadata_errors.problems(worker_id=scan_id):
@@ -3606,14 +3657,35 @@ Do you want to proceed with the download?
                         self.backup_controller, worker_id=device_id, data=data
                     )
 
-    def backupFile(self, rpd_file: RPDFile, move_succeeded: bool, download_count: int) -> None:
+    def backupPathSuffix(self, file_type: FileType) -> Optional[str]:
+        """
+        :return: the folder on automatically detected backup devices that
+         files of this type are backed up to, or None if backup devices are
+         not automatically detected
+        """
+
         if self.prefs.backup_device_autodetection:
-            if rpd_file.file_type == FileType.photo:
-                path_suffix = self.prefs.photo_backup_identifier
+            if file_type == FileType.photo:
+                return self.prefs.photo_backup_identifier
             else:
-                path_suffix = self.prefs.video_backup_identifier
-        else:
-            path_suffix = None
+                return self.prefs.video_backup_identifier
+        return None
+
+    @staticmethod
+    def backupDeviceTakesFileType(backup_type: BackupLocationType, file_type: FileType) -> bool:
+        return (
+            (backup_type == BackupLocationType.photos_and_videos) or
+            (
+                file_type == FileType.photo and backup_type ==
+                BackupLocationType.photos
+            ) or (
+                file_type == FileType.video and backup_type ==
+                BackupLocationType.videos
+            )
+        )
+
+    def backupFile(self, rpd_file: RPDFile, move_succeeded: bool, download_count: int) -> None:
+        path_suffix = self.backupPathSuffix(rpd_file.file_type)
 
         if rpd_file.file_type == FileType.photo:
             logging.debug("Backing up photo %s", rpd_file.download_name)
@@ -3622,16 +3694,7 @@ Do you want to proceed with the download?
 
         for path in self.backup_devices:
             backup_type = self.backup_devices[path].backup_type
-            do_backup = (
-                (backup_type == BackupLocationType.photos_and_videos) or
-                (
-                    rpd_file.file_type == FileType.photo and backup_type ==
-                    BackupLocationType.photos
-                ) or (
-                    rpd_file.file_type == FileType.video and backup_type ==
-                    BackupLocationType.videos
-                )
-            )
+            do_backup = self.backupDeviceTakesFileType(backup_type, rpd_file.file_type)
             if do_backup:
                 logging.debug("Backing up to %s", path)
             else:
@@ -3650,7 +3713,8 @@ Do you want to proceed with the download?
                 backup_duplicate_overwrite=self.prefs.backup_duplicate_overwrite,
                 verify_file=self.prefs.verify_file,
                 download_count=download_count,
-                save_fdo_thumbnail=self.prefs.save_fdo_thumbnails
+                save_fdo_thumbnail=self.prefs.save_fdo_thumbnails,
+                copy_engine=CopyEngine(self.prefs.copy_engine)
             )
             self.sendDataMessageToThread(self.backup_controller, worker_id=device_id, data=data)
 
@@ -5987,6 +6051,11 @@ def get_versions(file_manager: Optional[str],
         versions.append('Tornado: {}'.format(tornado.version))
     except ImportError:
         pass
+    try:
+        import numpy
+        versions.append('NumPy: {}'.format(numpy.__version__))
+    except ImportError:
+        pass
     versions.append(
         "Can read HEIF/HEIC metadata: {}".format('yes' if fileformats.heif_capable() else 'no')
     )
@@ -6734,6 +6803,8 @@ def main():
     splash.show()
     app.processEvents()
 
+    create_ipc_directory()
+
     rw = RapidWindow(
         photo_rename=photo_rename,
         video_rename=video_rename,
@@ -30,14 +30,16 @@ __copyright__ = "Copyright 2011-2020, Damon Lynch"
 import os
 from datetime import datetime
 from enum import Enum
-from collections import namedtuple
+from collections import namedtuple, deque
 import errno
 import logging
 import pickle
 import sys
-from typing import Union, Tuple, Dict, Optional
+from typing import Union, Tuple, Dict, Optional, List
 import sqlite3
 import locale
+
+import zmq
 try:
     # Use the default locale as defined by the LANG variable
     locale.setlocale(locale.LC_ALL, '')
@@ -47,6 +49,7 @@ except locale.Error:
 
 
 import raphodo.exiftool as exiftool
+from raphodo.exiftoolpool import ExifToolPool
 import raphodo.generatename as gn
 from raphodo.preferences import DownloadsTodayTracker, Preferences
 from raphodo.constants import ConflictResolution, FileType, DownloadStatus, RenameAndMoveStatus
@@ -266,6 +269,9 @@ class RenameMoveFileWorker(DaemonProcess):
 
         self.platform_c_maxint = platform_c_maxint()
 
+        # Assigned again when each download starts
+        self.must_synchronize_raw_jpg = False
+
         # This will be assigned again in run(), but initializing it here
         # clarifies any problems with type checking in an IDE
         self.problems = RenamingProblems()
@@ -683,6 +689,30 @@ class RenameMoveFileWorker(DaemonProcess):
         except OSError:
             logging.error("Failed to delete temporary file %s", rpd_file.temp_full_file_name)
 
+    def metadata_summary_sufficient(self, rpd_file: Union[Photo, Video]) -> bool:
+        """
+        Determine if the metadata values captured when the file's thumbnail was
+        generated include every value the subfolder and file name preferences use.
+
+        :param rpd_file: photo or video
+        :return: True if the file's metadata need not be read from the file
+        """
+
+        summary = rpd_file.metadata_summary
+        if summary is None:
+            return False
+
+        if rpd_file.file_type == FileType.photo:
+            pref_lists = self.prefs.photo_subfolder, self.prefs.photo_rename
+        else:
+            pref_lists = self.prefs.video_subfolder, self.prefs.video_rename
+        needed = set()
+        for pref_list in pref_lists:
+            needed |= gn.metadata_needed(pref_list, rpd_file.file_type)
+        if self.must_synchronize_raw_jpg and rpd_file.file_type == FileType.photo:
+            needed.add('date_time')
+        return summary.provides(needed)
+
     def generate_names(self, rpd_file: Union[Photo, Video], synchronize_raw_jpg: bool) -> bool:
 
         rpd_file.strip_characters = self.prefs.strip_characters
@@ -791,6 +821,9 @@ class RenameMoveFileWorker(DaemonProcess):
 
         self.prepare_rpd_file(rpd_file)
 
+        if rpd_file.metadata is None and self.metadata_summary_sufficient(rpd_file):
+            rpd_file.metadata = rpd_file.metadata_summary
+
         synchronize_raw_jpg = self.must_synchronize_raw_jpg and rpd_file.file_type == FileType.photo
 
         if synchronize_raw_jpg:
@@ -874,6 +907,44 @@ class RenameMoveFileWorker(DaemonProcess):
         self.uses_sequence_letter = self.prefs.any_pref_uses_sequence_letter_value()
         self.uses_stored_sequence_no = self.prefs.any_pref_uses_stored_sequence_no()
 
+    def receive_messages(self) -> List[Tuple[bytes, Union[bytes, RenameAndMoveFileData]]]:
+        """
+        Wait for the next message, and receive any others already waiting.
+
+        Request the metadata of each received file that ExifTool will read,
+        so that when files arrive faster than they can be renamed, ExifTool
+        reads the metadata of many of them using a single command.
+
+        :return: directive and either the unpickled data or, for a command,
+         the content
+        """
+
+        messages = [self.receiver.recv_multipart()]
+        while len(messages) < exiftool.max_metadata_batch_size:
+            try:
+                messages.append(self.receiver.recv_multipart(zmq.NOBLOCK))
+            except zmq.Again:
+                break
+
+        received = []
+        for directive, content in messages:
+            if directive != b'cmd':
+                content = pickle.loads(content)
+                rpd_file = content.rpd_file
+                if content.download_succeeded and rpd_file.metadata is None and \
+                        rpd_file.metadata_uses_exiftool() and \
+                        not self.metadata_summary_sufficient(rpd_file):
+                    self.exiftool_process.request_metadata(rpd_file.temp_full_file_name)
+            received.append((directive, content))
+        return received
+
+    def cleanup_pre_stop(self) -> None:
+        # Write any downloaded files still buffered to the database
+        try:
+            self.downloaded.close()
+        except sqlite3.OperationalError as e:
+            logging.error("Database error adding downloaded files: %s", e)
+
     def run(self) -> None:
         """
         Generate subfolder and filename, and attempt to move the file
@@ -897,18 +968,23 @@ class RenameMoveFileWorker(DaemonProcess):
             self.downloads_today_tracker, self.prefs.stored_sequence_no
         )
 
+        messages = deque()  # type: deque
+
         with stdchannel_redirected(sys.stderr, os.devnull):
-            with exiftool.ExifTool() as self.exiftool_process:
+            with ExifToolPool() as self.exiftool_process:
                 while True:
                     if i:
                         logging.debug("Finished %s. Getting next task.", i)
 
                     # rename file and move to generated subfolder
-                    directive, content = self.receiver.recv_multipart()
+                    if not messages:
+                        # Metadata requested for files that did not need it
+                        self.exiftool_process.discard_metadata_requests()
+                        messages.extend(self.receive_messages())
+                    directive, data = messages.popleft()
 
-                    self.check_for_command(directive, content)
+                    self.check_for_command(directive, data)
 
-                    data = pickle.loads(content) # type: RenameAndMoveFileData
                     if data.message == RenameAndMoveStatus.download_started:
 
                         # reinitialize downloads today and stored sequence number
@@ -927,6 +1003,14 @@ class RenameMoveFileWorker(DaemonProcess):
                         self.problems = RenamingProblems()
 
                     elif data.message == RenameAndMoveStatus.download_completed:
+                        # Write any downloaded files still buffered to the database
+                        try:
+                            self.downloaded.flush()
+                        except sqlite3.OperationalError as e:
+                            logging.error(
+                                "Database error adding downloaded files: %s. Will not retry.", e
+                            )
+
                         if len(self.problems):
                             self.content = pickle.dumps(
                                 RenameAndMoveFileResults(problems=self.problems),
@@ -976,6 +1060,8 @@ class RenameMoveFileWorker(DaemonProcess):
                             move_succeeded = False
 
                         rpd_file.metadata = None
+                        # The main process has its own sequence numbers
+                        rpd_file.sequences = None
                         self.content = pickle.dumps(
                             RenameAndMoveFileResults(
                                 move_succeeded=move_succeeded,
@@ -25,9 +25,11 @@ from datetime import datetime
 import uuid
 import logging
 import mimetypes
+import operator
+import copyreg
 from collections import Counter, UserDict
 import locale
-from typing import Optional, List, Tuple, Union, Any
+from typing import Optional, List, Tuple, Union, Any, Dict
 
 import gi
 
@@ -37,7 +39,7 @@ from gi.repository import GLib
 import raphodo.exiftool as exiftool
 from raphodo.constants import (
     DownloadStatus, FileType, FileExtension, FileSortPriority, ThumbnailCacheStatus, Downloaded,
-    DeviceTimestampTZ, ThumbnailCacheDiskStatus, ExifSource,
+    DeviceTimestampTZ, ThumbnailCacheDiskStatus, ExifSource, HashAlgorithm
 )
 
 from raphodo.storage import get_uri, CameraDetails
@@ -310,6 +312,43 @@ class FileTypeCounter(Counter):
             return s.lower()
 
 
+# Wire format used when an RPDFile is pickled to send it between processes.
+#
+# Attributes are sent as a tuple of values in the order listed here, rather than as
+# a dictionary keyed by attribute name. RPDFiles are only pickled to send them between
+# processes of the same program, so attributes can be added or reordered freely.
+_wire_format_fields = (
+    'from_camera', 'camera_details', 'device_display_name', 'device_uri', 'camera_model',
+    'camera_port', 'camera_display_name', 'is_mtp_device', 'camera_storage_descriptions',
+    'path', 'name', 'prev_full_name', 'prev_datetime', 'previously_downloaded',
+    'full_file_name', 'raw_exif_bytes', 'exif_source', 'file_type', 'extension',
+    'extension_type', 'mime_type', 'size', '_datetime', '_no_datetime_metadata',
+    'never_read_mdatatime', 'device_timestamp_type', 'mdatatime_caused_ctime_change',
+    '_mtime', '_raw_mtime', 'ctime', '_mdatatime', 'camera_memory_card_identifiers',
+    'thm_full_name', 'audio_file_full_name', 'xmp_file_full_name', 'log_file_full_name',
+    'status', 'problem', 'scan_id', 'uid', 'job_code', 'thumbnail_status',
+    'fdo_thumbnail_128_name', 'fdo_thumbnail_256_name', 'fdo_thumbnail_256',
+    'thumbnail_cache_status', 'cache_full_file_name', 'temp_sample_full_file_name',
+    'temp_sample_is_complete_file', 'temp_full_file_name', 'temp_thm_full_name',
+    'temp_audio_full_name', 'temp_xmp_full_name', 'temp_log_full_name',
+    'temp_cache_full_file_chunk', 'digest', 'digest_algorithm', 'backup_fan_out',
+    'download_start_time', 'download_folder', 'download_subfolder', 'download_path',
+    'download_name', 'download_full_file_name', 'download_full_base_name',
+    'download_thm_full_name', 'download_xmp_full_name', 'download_log_full_name',
+    'download_audio_full_name', 'thm_extension', 'audio_extension', 'xmp_extension',
+    'log_extension', 'metadata', 'metadata_failure', 'subfolder_pref_list',
+    'name_pref_list', 'generate_extension_case', 'modified_via_daemon_process',
+    'name_generation_problem', 'metadata_summary', 'strip_characters',
+)
+_wire_format_field_names = frozenset(_wire_format_fields)
+
+# Values of the attributes in the wire format, read from an attribute dictionary
+# that has exactly those attributes
+_wire_format_values = operator.itemgetter(*_wire_format_fields)
+_wire_format_field_count = len(_wire_format_fields)
+_newobj = copyreg.__newobj__
+
+
 class RPDFile:
     """
     Base class for photo or video file, with metadata
@@ -530,6 +569,15 @@ class RPDFile:
         self.temp_log_full_name = ''
         self.temp_cache_full_file_chunk = ''
 
+        # hex digest of the file's contents, generated while copying it when verifying files
+        self.digest = ''
+        self.digest_algorithm = None  # type: Optional[HashAlgorithm]
+
+        # Backups written while copying the file. Key is the backup device id,
+        # value is the temporary file name (empty if writing it failed) and how
+        # many bytes written to it have been reported as backed up
+        self.backup_fan_out = dict()  # type: Dict[int, Tuple[str, int]]
+
         self.download_start_time = None
 
         self.download_folder = ''
@@ -550,11 +598,15 @@ class RPDFile:
 
         self.metadata = None  # type: Optional[Union[metadataphoto.MetaData, metadatavideo.MetaData, metadataexiftool.MetadataExiftool]]
         self.metadata_failure = False  # type: bool
+        # Metadata values used in name generation, captured when the thumbnail was
+        # generated
+        self.metadata_summary = None  # type: Optional[metadataexiftool.MetadataSummary]
 
         # User preference values used for name generation
         self.subfolder_pref_list = []  # type: List[str]
         self.name_pref_list = []  # type: List[str]
         self.generate_extension_case = ''  # type: str
+        self.strip_characters = False  # type: bool
 
         self.modified_via_daemon_process = False
 
@@ -804,6 +856,59 @@ class RPDFile:
         else:
             return self.full_file_name
 
+    def __getstate__(self) -> Tuple[tuple, Optional[Dict[str, Any]]]:
+        """
+        Compact representation of the file used when pickling it, typically to send it
+        to another process.
+
+        Attribute values are sent without their names.
+
+        :return: attribute values, and any other attributes keyed by name
+        """
+
+        state = self.__dict__
+        values = tuple(map(state.get, _wire_format_fields))
+        other_fields = state.keys() - _wire_format_field_names
+        if other_fields:
+            other = {field: state[field] for field in other_fields}
+        else:
+            other = None
+        return values, other
+
+    def __reduce_ex__(self, protocol: int) -> tuple:
+        """
+        Pickle the file using the state returned by __getstate__(), generating it
+        directly when the file has exactly the attributes in the wire format.
+
+        Pickling a batch of files, e.g. the results of a scan, calls this for every
+        file. Letting object.__reduce_ex__() call __getstate__() instead makes pickling
+        the batch slower than pickling the files' attribute dictionaries.
+        """
+
+        state = self.__dict__
+        if len(state) == _wire_format_field_count and protocol >= 2:
+            try:
+                values = _wire_format_values(state)
+            except KeyError:
+                pass
+            else:
+                return _newobj, (type(self), ), (values, None)
+        if protocol < 2:
+            return object.__reduce_ex__(self, protocol)
+        return _newobj, (type(self), ), self.__getstate__()
+
+    def __setstate__(self, state: Tuple[tuple, Optional[Dict[str, Any]]]) -> None:
+        """
+        Restore the file from the representation returned by __getstate__().
+
+        :param state: attribute values, and any other attributes keyed by name
+        """
+
+        values, other = state
+        self.__dict__.update(zip(_wire_format_fields, values))
+        if other is not None:
+            self.__dict__.update(other)
+
     def _assign_file_type(self):
         self.file_type = None
 
@@ -821,6 +926,18 @@ class Photo(RPDFile):
     def _assign_file_type(self):
         self.file_type = FileType.photo
 
+    def metadata_uses_exiftool(self, force_exiftool: Optional[bool] = False) -> bool:
+        """
+        :param force_exiftool: whether ExifTool must be used to load the
+         metadata
+        :return: True if load_metadata() reads the metadata from a file
+         using ExifTool
+        """
+
+        return force_exiftool or fileformats.use_exiftool_on_photo(
+            self.extension, preview_extraction_irrelevant=True
+        )
+
     def load_metadata(self, full_file_name: Optional[str] = None,
                       raw_bytes: Optional[bytearray] = None,
                       app1_segment: Optional[bytearray] = None,
@@ -841,9 +958,7 @@ class Photo(RPDFile):
         :return: True if successful, False otherwise
         """
 
-        if force_exiftool or fileformats.use_exiftool_on_photo(
-                self.extension, preview_extraction_irrelevant=True):
-
+        if self.metadata_uses_exiftool(force_exiftool):
             self.metadata = metadataexiftool.MetadataExiftool(
                 full_file_name=full_file_name, et_process=et_process, file_type=self.file_type
             )
@@ -873,6 +988,13 @@ class Video(RPDFile):
     def _assign_file_type(self):
         self.file_type = FileType.video
 
+    def metadata_uses_exiftool(self, force_exiftool: Optional[bool] = False) -> bool:
+        """
+        :return: always True: video metadata is always read using ExifTool
+        """
+
+        return True
+
     def load_metadata(self, full_file_name: Optional[str] = None,
                       et_process: exiftool.ExifTool = None) -> bool:
         """
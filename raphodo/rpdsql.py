@@ -23,9 +23,16 @@ __copyright__ = "Copyright 2015-2019, Damon Lynch"
 
 import sqlite3
 import os
+import sys
 import datetime
+import array
+import math
+import struct
+import threading
+import time
+import zlib
 from collections import namedtuple
-from typing import Optional, List, Tuple, Any, Sequence
+from typing import Optional, List, Tuple, Any, Sequence, Iterable, Dict
 import logging
 
 from PyQt5.QtCore import Qt
@@ -39,7 +46,10 @@ from raphodo.utilities import runs
 
 FileDownloaded = namedtuple('FileDownloaded', 'download_name, download_datetime')
 
-InCache = namedtuple('InCache', 'md5_name, mdatatime, orientation_unknown, failure')
+InCache = namedtuple(
+    'InCache', 'md5_name, mdatatime, orientation_unknown, failure, segment, offset, length'
+)
+PackedThumbnail = namedtuple('PackedThumbnail', 'rowid, offset, length')
 
 ThumbnailRow = namedtuple(
     'ThumbnailRow',
@@ -259,19 +269,51 @@ class ThumbnailRowsSQL:
             )
         return sort
 
+    def _build_sort_key(self, sort_by: Sort) -> str:
+        if sort_by == Sort.modification_time:
+            return 'mtime'
+        return '{}, mtime'.format(self.sort_map[sort_by])
+
+    def get_last_rowid(self) -> int:
+        """
+        :return: the largest rowid in the files table, or 0 if it is empty. Rows
+         added after calling this have a larger rowid.
+        """
+
+        row = self.conn.execute('SELECT MAX(rowid) FROM files').fetchone()
+        return row[0] or 0
+
     def get_view(self, sort_by: Sort,
                  sort_order: Qt.SortOrder,
                  show: Show,
                  proximity_col1: Optional[List[int]] = None,
-                 proximity_col2: Optional[List[int]] = None) -> List[Tuple[bytes, bool]]:
+                 proximity_col2: Optional[List[int]] = None,
+                 added_after: Optional[int] = None,
+                 with_sort_key: bool=False) -> List[tuple]:
+        """
+        :param added_after: if not None, return only rows whose rowid is larger
+         than this value
+        :param with_sort_key: if True, append to each row the values it is sorted by
+        :return: list of (uid, marked), followed by the sort key values if requested
+        """
 
         where, where_values = self._build_where(
             show=show, proximity_col1=proximity_col1, proximity_col2=proximity_col2
         )
 
+        if added_after is not None:
+            if where:
+                where = '{} AND files.rowid>?'.format(where)
+            else:
+                where = 'files.rowid>?'
+            where_values.append(added_after)
+
         sort = self._build_sort(sort_by, sort_order)
 
-        query = 'SELECT uid, marked FROM files'
+        if with_sort_key:
+            query = 'SELECT uid, marked, {} FROM files'.format(self._build_sort_key(sort_by))
+        else:
+            query = 'SELECT uid, marked FROM files'
 
         if sort_by == Sort.device:
             query = '{} NATURAL JOIN devices'.format(query)
@@ -644,6 +686,119 @@ class ThumbnailRowsSQL:
         self.conn.commit()
 
 
+class DownloadedFilter:
+    """
+    Bloom filter of the files in the database of previously downloaded files.
+
+    If a file is not in the filter, it was definitely never downloaded.
+    If it is in the filter, it probably was, and the database must be
+    checked.
+
+    It is a blocked Bloom filter: all the bits for a file are in one 64 bit
+    word, so checking a file needs only one word to be read.
+
+    Records the largest database rowid it includes, so that rows added
+    to the database since can be added to the filter incrementally.
+    """
+
+    header = struct.Struct('<4sIQQQ')
+    magic = b'RPDF'
+    version = 1
+    bits_per_file = 12
+    file_key = struct.Struct('<qd')
+
+    def __init__(self, capacity: int) -> None:
+        """
+        :param capacity: how many files the filter can hold before its false
+         positive rate exceeds about 1%
+        """
+
+        no_blocks = math.ceil(max(capacity, 1024) * self.bits_per_file / 64)
+        self._init(array.array('Q', bytes(no_blocks * 8)), count=0, max_rowid=0)
+
+    def _init(self, blocks: array.array, count: int, max_rowid: int) -> None:
+        self.blocks = blocks
+        self.no_blocks = len(blocks)
+        self.capacity = self.no_blocks * 64 // self.bits_per_file
+        self.count = count
+        self.max_rowid = max_rowid
+
+    def _block(self, name: str, size: int, modification_time: float) -> Tuple[int, int]:
+        """
+        :return: the index of the file's block and the bits set for the file
+        """
+
+        key = name.encode('utf-8', 'surrogateescape') + self.file_key.pack(
+            size, modification_time
+        )
+        h1 = zlib.crc32(key)
+        h2 = zlib.crc32(key, 0x5bd1e995)
+        mask = (1 << (h2 & 63)) | (1 << ((h2 >> 6) & 63)) | (1 << ((h2 >> 12) & 63)) | \
+               (1 << ((h2 >> 18) & 63)) | (1 << ((h2 >> 24) & 63)) | (1 << (h1 >> 26))
+        return h1 % self.no_blocks, mask
+
+    def add(self, name: str, size: int, modification_time: float) -> None:
+        index, mask = self._block(name, size, modification_time)
+        self.blocks[index] |= mask
+        self.count += 1
+
+    def __contains__(self, file: Tuple[str, int, float]) -> bool:
+        index, mask = self._block(*file)
+        return self.blocks[index] & mask == mask
+
+    @property
+    def full(self) -> bool:
+        return self.count > self.capacity
+
+    def save(self, path: str) -> None:
+        """
+        Save the filter, replacing any previously saved filter atomically
+        """
+
+        blocks = self.blocks
+        if sys.byteorder == 'big':
+            blocks = array.array('Q', blocks)
+            blocks.byteswap()
+        temp_path = '{}.{}'.format(path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(
+                    self.header.pack(
+                        self.magic, self.version, self.no_blocks, self.count, self.max_rowid
+                    )
+                )
+                blocks.tofile(f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning("Could not save filter of downloaded files %s: %s", path, e)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['DownloadedFilter']:
+        """
+        :return: the saved filter, or None if it does not exist or is invalid
+        """
+
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(cls.header.size)
+                data = f.read()
+        except OSError:
+            return None
+        if len(header) != cls.header.size:
+            return None
+        magic, version, no_blocks, count, max_rowid = cls.header.unpack(header)
+        if magic != cls.magic or version != cls.version or not no_blocks or \
+                len(data) != no_blocks * 8:
+            return None
+        blocks = array.array('Q')
+        blocks.frombytes(data)
+        if sys.byteorder == 'big':
+            blocks.byteswap()
+        downloaded_filter = cls.__new__(cls)
+        downloaded_filter._init(blocks, count=count, max_rowid=max_rowid)
+        return downloaded_filter
+
+
 class DownloadedSQL:
     """
     Previous file download detection.
@@ -652,20 +807,56 @@ class DownloadedSQL:
     same if the file name (excluding path), size and modification time
     are the same. For performance reasons, Exif information is never
     checked.
+
+    A single connection to the database is kept open, with the database
+    in write-ahead log mode, so that readers and the writer do not block
+    each other. Downloaded files are buffered and written in batches.
+
+    Single file lookups first check a Bloom filter of the files in the
+    database, so that files never downloaded do not need to be queried.
+    Bulk lookups do not use the filter: a query per 500 file names costs
+    less than checking every file in the filter. The filter is
+    saved alongside the database, and is brought up to date with rows
+    added to the database since it was saved.
     """
 
-    def __init__(self, data_dir: str = None) -> None:
+    def __init__(self, data_dir: str = None, batch_size: int=100,
+                 use_filter: bool=True) -> None:
         """
         :param data_dir: where the database is saved. If None, use
          default
+        :param batch_size: how many downloaded files to buffer before
+         writing them to the database
+        :param use_filter: if True, check the Bloom filter before querying
+         the database for a single file
         """
         if data_dir is None:
             data_dir = get_program_data_directory(create_if_not_exist=True)
 
         self.db = os.path.join(data_dir, 'downloaded_files.sqlite')
         self.table_name = 'downloaded'
-        self.update_table()
 
+        self.filter_path = os.path.join(data_dir, 'downloaded_files.filter')
+        self.use_filter = use_filter
+        # Loaded when first needed
+        self.filter = None  # type: Optional[DownloadedFilter]
+        # Rows added to the filter since it was last saved
+        self.filter_unsaved = 0
+        self.filter_refreshed = 0.0
+        # Seconds between checks for rows added to the database when looking up
+        # single files
+        self.filter_refresh_interval = 1.0
+        self.batch_size = batch_size
+        # Downloaded files not yet written to the database
+        self.pending = []  # type: List[Tuple[str, int, float, str, datetime.datetime]]
+
+        self.conn = sqlite3.connect(
+            self.db, detect_types=sqlite3.PARSE_DECLTYPES, timeout=sqlite3_timeout
+        )
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode, syncing only at checkpoints is safe from corruption
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.update_table()
 
     def update_table(self, reset: bool = False) -> None:
         """
@@ -674,12 +865,21 @@ class DownloadedSQL:
          build it
         """
 
-        conn = sqlite3.connect(self.db, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn = self.conn
 
         if reset:
+            self.pending = []
+            self.filter = None
+            try:
+                os.remove(self.filter_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error("Could not remove %s: %s", self.filter_path, e)
             conn.execute(r"""DROP TABLE IF EXISTS {tn}""".format(
                 tn=self.table_name)
             )
+            conn.commit()
             conn.execute("VACUUM")
 
         conn.execute(
@@ -702,13 +902,15 @@ class DownloadedSQL:
         )
 
         conn.commit()
-        conn.close()
 
-    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
     def add_downloaded_file(self, name: str, size: int,
                             modification_time: float, download_full_file_name: str) -> None:
         """
-        Add file to database of downloaded files
+        Add file to database of downloaded files.
+
+        The file is buffered, and written to the database once batch_size
+        files are buffered or flush() is called.
+
         :param name: original filename of photo / video, without path
         :param size: file size
         :param modification_time: file modification time
@@ -716,26 +918,114 @@ class DownloadedSQL:
          or the character . that the user manually marked the file
          as previously downloaded
         """
-        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
 
         logging.debug('Adding %s to downloaded files', name)
 
+        self.pending.append(
+            (name, size, modification_time, download_full_file_name, datetime.datetime.now())
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
+    def flush(self) -> None:
+        """
+        Write buffered downloaded files to the database, in one transaction
+        """
+
+        if not self.pending:
+            return
+
         try:
-            conn.execute(
-                r"""INSERT OR REPLACE INTO {tn} (file_name, size, mtime,
-                download_name, download_datetime) VALUES (?,?,?,?,?)""".format(tn=self.table_name),
-                (name, size, modification_time, download_full_file_name, datetime.datetime.now())
-            )
+            with self.conn:
+                self.conn.executemany(
+                    r"""INSERT OR REPLACE INTO {tn} (file_name, size, mtime,
+                    download_name, download_datetime) VALUES (?,?,?,?,?)""".format(
+                        tn=self.table_name
+                    ), self.pending
+                )
         except sqlite3.OperationalError as e:
             logging.warning(
-                "Database error adding download file %s: %s. May retry.",
-                download_full_file_name, e
+                "Database error adding %s downloaded files: %s. May retry.", len(self.pending), e
             )
-            conn.close()
             raise sqlite3.OperationalError from e
         else:
-            conn.commit()
-            conn.close()
+            logging.debug('Wrote %s downloaded files to the database', len(self.pending))
+            self.pending = []
+
+    def close(self) -> None:
+        """
+        Write any buffered downloaded files and close the database connection
+        """
+
+        self.flush()
+        if self.filter is not None:
+            self.refresh_filter()
+            if self.filter_unsaved:
+                self.save_filter()
+        self.conn.close()
+
+    def build_filter(self) -> None:
+        """
+        Build the Bloom filter from every file in the database
+        """
+
+        count = self.conn.execute(
+            'SELECT COUNT(*) FROM {tn}'.format(tn=self.table_name)
+        ).fetchone()[0]
+        logging.debug("Building filter of %s downloaded files", count)
+        self.filter = DownloadedFilter(capacity=max(count * 2, 100000))
+        self.filter_unsaved = 0
+        self.add_rows_to_filter()
+        self.save_filter()
+
+    def add_rows_to_filter(self) -> None:
+        """
+        Add rows added to the database since the filter was last updated
+        """
+
+        c = self.conn.execute(
+            'SELECT rowid, file_name, size, mtime FROM {tn} WHERE rowid > ?'.format(
+                tn=self.table_name
+            ), (self.filter.max_rowid, )
+        )
+        for rowid, name, size, modification_time in c:
+            self.filter.add(name, size, modification_time)
+            self.filter.max_rowid = max(self.filter.max_rowid, rowid)
+            self.filter_unsaved += 1
+
+    def save_filter(self) -> None:
+        self.filter.save(self.filter_path)
+        self.filter_unsaved = 0
+
+    def refresh_filter(self) -> None:
+        """
+        Load the Bloom filter if needed, and add to it any rows added to the
+        database since it was last updated.
+
+        Rebuilds the filter if it is invalid or has become too full.
+        """
+
+        max_rowid = self.conn.execute(
+            'SELECT MAX(rowid) FROM {tn}'.format(tn=self.table_name)
+        ).fetchone()[0] or 0
+        self.filter_refreshed = time.monotonic()
+
+        if self.filter is None:
+            self.filter = DownloadedFilter.load(self.filter_path)
+            if self.filter is None:
+                self.build_filter()
+                return
+
+        if max_rowid < self.filter.max_rowid:
+            # The database was reset
+            self.build_filter()
+        elif max_rowid > self.filter.max_rowid:
+            self.add_rows_to_filter()
+            if self.filter.full:
+                self.build_filter()
+            elif self.filter_unsaved >= 1000:
+                self.save_filter()
 
     def file_downloaded(self, name: str,
                         size: int, modification_time: float) -> Optional[FileDownloaded]:
@@ -748,8 +1038,14 @@ class DownloadedSQL:
         :return: download name (including path) and when it was
          downloaded, else None if never downloaded
         """
-        conn = sqlite3.connect(self.db, detect_types=sqlite3.PARSE_DECLTYPES)
-        c = conn.cursor()
+        if self.use_filter:
+            if self.filter is None or \
+                    time.monotonic() - self.filter_refreshed > self.filter_refresh_interval:
+                self.refresh_filter()
+            if (name, size, modification_time) not in self.filter:
+                return None
+
+        c = self.conn.cursor()
         c.execute(
             """SELECT download_name, download_datetime as [timestamp] FROM {tn} WHERE
             file_name=? AND size=? AND mtime=?""".format(tn=self.table_name),
@@ -761,32 +1057,126 @@ class DownloadedSQL:
         else:
             return None
 
+    def files_downloaded_bulk(self, files: Iterable[Tuple[str, int, float]]) \
+            -> Dict[Tuple[str, int, float], FileDownloaded]:
+        """
+        Determine which of many files have previously been downloaded,
+        using one query per 500 distinct file names rather than one
+        query per file. The Bloom filter is not checked, because doing so
+        costs more than the queries it saves.
+
+        :param files: file name (not including path), size in bytes and
+         modification time of each file
+        :return: download name (including path) and when it was
+         downloaded for each file previously downloaded, keyed by its
+         file name, size and modification time. Files never downloaded
+         are not included.
+        """
+
+        files = set(files)
+        names = list({name for name, size, modification_time in files})
+        downloaded = dict()  # type: Dict[Tuple[str, int, float], FileDownloaded]
+        c = self.conn.cursor()
+        for chunk in divide_list_on_length(names, 500):
+            c.execute(
+                """SELECT file_name, size, mtime, download_name,
+                download_datetime as [timestamp] FROM {tn} WHERE file_name IN ({values})
+                """.format(tn=self.table_name, values=','.join('?' * len(chunk))),
+                chunk
+            )
+            for name, size, modification_time, download_name, download_datetime in c:
+                key = (name, size, modification_time)
+                if key in files:
+                    downloaded[key] = FileDownloaded(download_name, download_datetime)
+        return downloaded
+
 
 class CacheSQL:
-    def __init__(self, location: str=None, create_table_if_not_exists: bool=True) -> None:
+    """
+    Thumbnail cache database.
+
+    Every CacheSQL in a process uses the same connection to the database,
+    which is kept open with the database in write-ahead log mode, so that
+    thumbnail workers reading the cache do not block the workers writing
+    to it. SQLite connections cannot be used by more than one thread, so
+    each thread has its own connection.
+
+    Thumbnails can be buffered and written in batches.
+
+    A thumbnail is either saved in its own file named by its md5 name, or
+    packed into a segment file at an offset, in which case its segment,
+    offset and length are recorded.
+    """
+
+    # Connections keyed by database and thread
+    _connections = dict()  # type: Dict[Tuple[str, int], sqlite3.Connection]
+
+    def __init__(self, location: str=None, create_table_if_not_exists: bool=True,
+                 batch_size: int=1) -> None:
         """
 
         :param location: path on the file system where the Table exists
         :param create_table_if_not_exists:
+        :param batch_size: how many thumbnails to buffer before writing
+         them to the database. If 1, thumbnails are written immediately.
         """
         if location is None:
             location = get_program_cache_directory(create_if_not_exist=True)
         self.db = os.path.join(location, self.db_fs_name())
         self.table_name = 'cache'
+        self.batch_size = batch_size
+        # Thumbnails not yet written to the database
+        self.pending = []  # type: List[Tuple]
+        # md5 names of packed thumbnails read since the last flush, which
+        # records when they were last accessed
+        self.accessed = []  # type: List[str]
         if create_table_if_not_exists:
             self.update_table()
 
     def db_fs_name(self) -> str:
         return 'thumbnail_cache.sqlite'
 
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """
+        :return: this thread's connection to the database, opening it if
+         necessary
+        """
+
+        key = (self.db, threading.get_ident())
+        conn = CacheSQL._connections.get(key)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db, detect_types=sqlite3.PARSE_DECLTYPES, timeout=sqlite3_timeout
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            # In WAL mode, syncing only at checkpoints is safe from corruption
+            conn.execute('PRAGMA synchronous=NORMAL')
+            CacheSQL._connections[key] = conn
+        return conn
+
+    def close(self) -> None:
+        """
+        Write any buffered thumbnails and close the database connections.
+
+        Connections belonging to other threads cannot be closed from this
+        thread, and are instead forgotten. Call before deleting the
+        database.
+        """
+
+        self.flush()
+        thread_id = threading.get_ident()
+        for key in [key for key in CacheSQL._connections if key[0] == self.db]:
+            conn = CacheSQL._connections.pop(key)
+            if key[1] == thread_id:
+                conn.close()
+
     def cache_exists(self) -> bool:
-        conn = sqlite3.connect(self.db)
-        row = conn.execute(
+        row = self.conn.execute(
             """SELECT name FROM sqlite_master WHERE type='table' AND name='{}'""".format(
                 self.table_name
             )
         ).fetchone()
-        conn.close()
         return row is not None
 
 
@@ -796,10 +1186,12 @@ class CacheSQL:
         :param reset: if True, delete the contents of the table and
          build it
         """
-        conn = sqlite3.connect(self.db, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn = self.conn
 
         if reset:
+            self.pending = []
             conn.execute(r"""DROP TABLE IF EXISTS {tn}""".format(tn=self.table_name))
+            conn.commit()
             conn.execute("VACUUM")
 
         conn.execute(
@@ -811,26 +1203,50 @@ class CacheSQL:
             md5_name TEXT NOT NULL,
             orientation_unknown BOOLEAN NOT NULL,
             failure BOOLEAN NOT NULL,
+            segment TEXT,
+            offset INTEGER,
+            length INTEGER,
+            accessed REAL,
             PRIMARY KEY (uri, mtime, size)
             )""".format(tn=self.table_name)
         )
 
+        # Add the columns for packed thumbnails to tables created by
+        # earlier versions of the program
+        columns = {
+            row[1] for row in conn.execute('PRAGMA table_info({tn})'.format(tn=self.table_name))
+        }
+        for column, column_type in (
+                ('segment', 'TEXT'), ('offset', 'INTEGER'), ('length', 'INTEGER'),
+                ('accessed', 'REAL')):
+            if column not in columns:
+                conn.execute('ALTER TABLE {tn} ADD COLUMN {column} {column_type}'.format(
+                    tn=self.table_name, column=column, column_type=column_type)
+                )
+
         conn.execute("""CREATE INDEX IF NOT EXISTS md5_name_idx ON
         {tn} (md5_name)""".format(tn=self.table_name))
+        conn.execute("""CREATE INDEX IF NOT EXISTS segment_idx ON
+        {tn} (segment)""".format(tn=self.table_name))
 
         conn.commit()
-        conn.close()
 
-    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
     def add_thumbnail(self, uri: str,
                       size: int,
                       mtime: float,
                       mdatatime: float,
                       md5_name: str,
                       orientation_unknown: bool,
-                      failure: bool) -> None:
+                      failure: bool,
+                      segment: Optional[str]=None,
+                      offset: Optional[int]=None,
+                      length: Optional[int]=None) -> None:
         """
-        Add file to database of downloaded files
+        Add file to database of downloaded files.
+
+        The file is buffered, and written to the database once batch_size
+        files are buffered or flush() is called.
+
         :param uri: original filename of photo / video with path
         :param size: file size
         :param mtime: file modification time
@@ -840,24 +1256,66 @@ class CacheSQL:
          file could not be determined, else False
         :param failure: if True, indicates the thumbnail could not be
          generated, otherwise False
+        :param segment: if the thumbnail is packed, the segment file it is
+         in, else None
+        :param offset: offset of the packed thumbnail in the segment file
+        :param length: length in bytes of the packed thumbnail
+        """
+
+        self.pending.append(
+            (
+                uri, size, mtime, mdatatime, md5_name, orientation_unknown, failure, segment,
+                offset, length, time.time()
+            )
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
+    def flush(self) -> None:
+        """
+        Write buffered thumbnails to the database, in one transaction
         """
 
-        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
+        if not self.pending and not self.accessed:
+            return
 
         try:
-            conn.execute(
-                r"""INSERT OR REPLACE INTO {tn} (uri, size, mtime, mdatatime,
-                md5_name, orientation_unknown, failure) VALUES (?,?,?,?,?,?,?)""".format(
-                    tn=self.table_name
-                ), (uri, size, mtime, mdatatime, md5_name, orientation_unknown, failure)
-            )
+            with self.conn:
+                self.conn.executemany(
+                    r"""INSERT OR REPLACE INTO {tn} (uri, size, mtime, mdatatime,
+                    md5_name, orientation_unknown, failure, segment, offset, length, accessed)
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?)""".format(tn=self.table_name), self.pending
+                )
+                now = time.time()
+                self.conn.executemany(
+                    'UPDATE {tn} SET accessed=? WHERE md5_name=? AND segment IS NOT NULL'.format(
+                        tn=self.table_name
+                    ), ((now, md5_name) for md5_name in self.accessed)
+                )
         except sqlite3.OperationalError as e:
-            logging.warning("Database error adding thumbnail for %s: %s. May retry.", uri, e)
-            conn.close()
+            logging.warning(
+                "Database error adding %s thumbnails: %s. May retry.", len(self.pending), e
+            )
             raise sqlite3.OperationalError from e
         else:
-            conn.commit()
-            conn.close()
+            self.pending = []
+            self.accessed = []
+
+    def thumbnail_accessed(self, md5_name: str) -> None:
+        """
+        Record that a packed thumbnail was read. Packed thumbnails do not have
+        their own file whose access time can be checked when cleaning up
+        the cache.
+
+        The access is written to the database on the next flush().
+
+        :param md5_name: md5 name of the packed thumbnail
+        """
+
+        self.accessed.append(md5_name)
+        if len(self.accessed) >= 500:
+            self.flush()
 
     @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
     def have_thumbnail(self, uri: str, size: int, mtime: float) -> Optional[InCache]:
@@ -872,18 +1330,16 @@ class CacheSQL:
          present
         """
 
-        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
-
+        self.flush()
         try:
-            c = conn.cursor()
-            c.execute(
-                """SELECT md5_name, mdatatime, orientation_unknown, failure FROM {tn} WHERE
-                uri=? AND size=? AND mtime=?""".format(tn=self.table_name), (uri, size, mtime)
-            )
-            row = c.fetchone()
+            row = self.conn.execute(
+                """SELECT md5_name, mdatatime, orientation_unknown, failure, segment, offset,
+                length FROM {tn} WHERE uri=? AND size=? AND mtime=?""".format(
+                    tn=self.table_name
+                ), (uri, size, mtime)
+            ).fetchone()
         except sqlite3.OperationalError as e:
             logging.warning("Database error reading thumbnail for %s: %s. May retry.", uri, e)
-            conn.close()
             raise sqlite3.OperationalError from e
 
         if row is not None:
@@ -891,6 +1347,47 @@ class CacheSQL:
         else:
             return None
 
+    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
+    def have_thumbnails(self, files: Iterable[Tuple[str, int, float]]) \
+            -> Dict[Tuple[str, int, float], InCache]:
+        """
+        Determine which of many files have a thumbnail in the cache,
+        using one query per 900 distinct uris rather than one query
+        per file.
+
+        :param files: uri, size in bytes and modification time of each
+         file
+        :return: md5 name (excluding path), time recorded in metadata,
+         whether the orientation is unknown and whether the value
+         indicates a thumbnail generation failure, keyed by the file's
+         uri, size and modification time. Files not in the cache are not
+         included.
+        """
+
+        self.flush()
+        files = set(files)
+        uris = list({uri for uri, size, mtime in files})
+        in_cache = dict()  # type: Dict[Tuple[str, int, float], InCache]
+        c = self.conn.cursor()
+        try:
+            for chunk in divide_list_on_length(uris, 900):
+                c.execute(
+                    """SELECT uri, size, mtime, md5_name, mdatatime, orientation_unknown, failure,
+                    segment, offset, length FROM {tn} WHERE uri IN ({values})""".format(
+                        tn=self.table_name, values=','.join('?' * len(chunk))
+                    ), chunk
+                )
+                for row in c:
+                    key = row[:3]
+                    if key in files:
+                        in_cache[key] = InCache._make(row[3:])
+        except sqlite3.OperationalError as e:
+            logging.warning(
+                "Database error reading %s thumbnails: %s. May retry.", len(files), e
+            )
+            raise sqlite3.OperationalError from e
+        return in_cache
+
     @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
     def _delete(self, names: List[str], conn):
         conn.execute("""DELETE FROM {tn} WHERE md5_name IN ({values})""".format(
@@ -905,7 +1402,8 @@ class CacheSQL:
         if len(md5_names) == 0:
             return
 
-        conn = sqlite3.connect(self.db)
+        self.flush()
+        conn = self.conn
         # Limit to number of parameters: 900
         # See https://www.sqlite.org/limits.html
         try:
@@ -917,9 +1415,9 @@ class CacheSQL:
                 self._delete(md5_names, conn)
         except sqlite3.OperationalError as e:
             logging.error("Database error while deleting %s thumbnails: %s", len(md5_names), e)
+            conn.rollback()
         else:
             conn.commit()
-        conn.close()
 
 
     def no_thumbnails(self) -> int:
@@ -927,23 +1425,97 @@ class CacheSQL:
         :return: how many thumbnails are in the db
         """
 
-        conn = sqlite3.connect(self.db)
-        c = conn.cursor()
+        self.flush()
+        c = self.conn.cursor()
         c.execute('SELECT COUNT(*) FROM {tn}'.format(tn=self.table_name))
         count = c.fetchall()
         return count[0][0]
 
     def md5_names(self) -> List[Tuple[str]]:
-        conn = sqlite3.connect(self.db)
-        c = conn.cursor()
-        c.execute('SELECT md5_name FROM {tn}'.format(tn=self.table_name))
+        """
+        :return: md5 names of thumbnails that are not packed
+        """
+
+        self.flush()
+        c = self.conn.cursor()
+        c.execute('SELECT md5_name FROM {tn} WHERE segment IS NULL'.format(tn=self.table_name))
         rows = c.fetchall()
         return rows
 
+    def segment_usage(self) -> Dict[str, int]:
+        """
+        :return: bytes used by thumbnails in each segment file
+        """
+
+        self.flush()
+        return dict(
+            self.conn.execute(
+                """SELECT segment, SUM(length) FROM {tn} WHERE segment IS NOT NULL
+                GROUP BY segment""".format(tn=self.table_name)
+            ).fetchall()
+        )
+
+    def packed_thumbnails(self, segment: str) -> List[PackedThumbnail]:
+        """
+        :param segment: segment file
+        :return: location of each thumbnail in the segment file, ordered by
+         offset
+        """
+
+        self.flush()
+        return [
+            PackedThumbnail._make(row) for row in self.conn.execute(
+                """SELECT rowid, offset, length FROM {tn} WHERE segment=?
+                ORDER BY offset""".format(tn=self.table_name), (segment, )
+            )
+        ]
+
+    def move_packed_thumbnails(self, moves: List[Tuple[str, int, int]]) -> None:
+        """
+        Record new locations of packed thumbnails, in one transaction
+
+        :param moves: new segment, new offset and rowid of each thumbnail
+        """
+
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE {tn} SET segment=?, offset=? WHERE rowid=?'.format(tn=self.table_name),
+                moves
+            )
+
+    def delete_packed_thumbnails(self, accessed_before: Optional[float]=None,
+                                 segments: Optional[List[str]]=None) -> int:
+        """
+        Delete packed thumbnails last accessed before a time, or that are in
+        any of the segment files
+
+        :param accessed_before: time since the epoch
+        :param segments: segment files
+        :return: number of thumbnails deleted
+        """
+
+        self.flush()
+        deleted = 0
+        with self.conn:
+            if accessed_before is not None:
+                deleted += self.conn.execute(
+                    """DELETE FROM {tn} WHERE segment IS NOT NULL AND
+                    (accessed IS NULL OR accessed < ?)""".format(tn=self.table_name),
+                    (accessed_before, )
+                ).rowcount
+            for chunk in divide_list_on_length(segments or [], 900):
+                deleted += self.conn.execute(
+                    'DELETE FROM {tn} WHERE segment IN ({values})'.format(
+                        tn=self.table_name, values=','.join('?' * len(chunk))
+                    ), chunk
+                ).rowcount
+        return deleted
+
     def vacuum(self) -> None:
-        conn = sqlite3.connect(self.db)
-        conn.execute("VACUUM")
-        conn.close()
+        self.flush()
+        self.conn.execute("VACUUM")
+        # Move the vacuumed database out of the write-ahead log
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
 class FileFormatSQL:
     def __init__(self, data_dir: str=None) -> None:
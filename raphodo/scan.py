@@ -53,6 +53,7 @@ from collections import (namedtuple, defaultdict, deque)
 from datetime import datetime
 import tempfile
 import operator
+from itertools import groupby
 import locale
 try:
     # Use the default locale as defined by the LANG variable
@@ -65,7 +66,7 @@ if sys.version_info < (3,5):
     walk = scandir.walk
 else:
     walk = os.walk
-from typing import List, Dict, Union, Optional, Iterator, Tuple, DefaultDict
+from typing import List, Dict, Union, Optional, Iterator, Tuple, DefaultDict, Set
 
 import gphoto2 as gp
 
@@ -115,6 +116,11 @@ class ScanWorker(WorkerInPublishPullPipeline):
 
     def __init__(self):
         self.downloaded = DownloadedSQL()
+        # Files whose previous download status was looked up as a batch,
+        # and those of them that were previously downloaded. Key is file
+        # name, size and adjusted modification time.
+        self.downloaded_batch = set()  # type: Set[Tuple[str, int, float]]
+        self.downloaded_batch_results = dict()  # type: Dict[Tuple[str, int, float], FileDownloaded]
         self.thumbnail_cache = ThumbnailCacheSql(create_table_if_not_exists=False)
         self.no_previously_downloaded = 0
         self.file_batch = []
@@ -363,10 +369,14 @@ class ScanWorker(WorkerInPublishPullPipeline):
         for path in paths:
             if scanning_specific_path:
                 logging.info("Scanning {} on {}".format(path, self.display_name))
-            for dir_name, name in self.walk_file_system(path):
-                self.dir_name = dir_name
-                self.file_name = name
-                self.process_file()
+            for dir_name, files in groupby(
+                    self.walk_file_system(path), key=operator.itemgetter(0)):
+                names = [name for dir_name, name in files]
+                self.lookup_downloaded_in_dir(dir_name, names)
+                for name in names:
+                    self.dir_name = dir_name
+                    self.file_name = name
+                    self.process_file()
 
     def scan_camera(self, scan_arguments: ScanArguments) -> None:
         """
@@ -484,9 +494,19 @@ class ScanWorker(WorkerInPublishPullPipeline):
             if self._camera_photos_videos_by_type:
                 self.identify_camera_tz_and_sample_files()
 
-            # now, process each file
-            for self.dir_name, self.file_name in self._camera_folders_and_files:
-                self.process_file()
+            # now, process each file, a folder at a time
+            for dir_name, files in groupby(
+                    self._camera_folders_and_files, key=operator.itemgetter(0)):
+                names = [name for dir_name, name in files]
+                self.lookup_downloaded(
+                    (name, file_info.size, file_info.modification_time)
+                    for name in names for file_info in self._camera_file_names[name]
+                    if file_info.path == dir_name
+                )
+                for name in names:
+                    self.dir_name = dir_name
+                    self.file_name = name
+                    self.process_file()
         else:
             logging.warning(
                 "Unable to detect any specific folders (like DCIM) on %s", self.display_name
@@ -739,6 +759,59 @@ class ScanWorker(WorkerInPublishPullPipeline):
                 if not (need_sample_photo or need_sample_video):
                     break
 
+    def lookup_downloaded(self, files: Iterator[Tuple[str, int, float]]) -> None:
+        """
+        Determine which of a batch of files were previously downloaded,
+        using one database lookup for the entire batch.
+
+        :param files: file name, size and raw modification time of files
+         that will next be processed
+        """
+
+        self.downloaded_batch = {
+            (name, size, self.adjusted_mtime(modification_time))
+            for name, size, modification_time in files
+        }
+        self.downloaded_batch_results = self.downloaded.files_downloaded_bulk(
+            self.downloaded_batch
+        )
+
+    def lookup_downloaded_in_dir(self, dir_name: str, names: List[str]) -> None:
+        """
+        Determine which photos and videos in a directory on the file system
+        were previously downloaded.
+
+        :param dir_name: the directory
+        :param names: files in the directory
+        """
+
+        files = []
+        for name in names:
+            ext = os.path.splitext(name)[1][1:].lower()
+            if fileformats.file_type(ext) is not None:
+                try:
+                    stat = os.stat(os.path.join(dir_name, name))
+                except OSError:
+                    continue
+                files.append((name, stat.st_size, stat.st_mtime))
+        self.lookup_downloaded(files)
+
+    def file_downloaded(self, name: str, size: int,
+                        modification_time: float) -> Optional[FileDownloaded]:
+        """
+        Determine if a file was previously downloaded, using the results of
+        the batch lookup if the file was in the batch
+
+        :param modification_time: adjusted modification time
+        """
+
+        key = (name, size, modification_time)
+        if key in self.downloaded_batch:
+            return self.downloaded_batch_results.get(key)
+        return self.downloaded.file_downloaded(
+            name=name, size=size, modification_time=modification_time
+        )
+
     def process_file(self) -> None:
         # Check to see if the process has received a command to terminate or
         # pause
@@ -830,7 +903,7 @@ class ScanWorker(WorkerInPublishPullPipeline):
                 # note: we should use the adjusted mtime, not the raw one
                 adjusted_mtime = self.adjusted_mtime(modification_time)
 
-                downloaded = self.downloaded.file_downloaded(
+                downloaded = self.file_downloaded(
                     name=self.file_name, size=size, modification_time=adjusted_mtime
                 )
 
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+__author__ = 'Damon Lynch'
+
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the engines FileCopy uses to copy files from a file system.
+
+Reports throughput and the CPU time (user and system) of each engine.
+The source file is evicted from the page cache before each run, but
+results are only indicative: use a source on the device being tested,
+e.g. a memory card, and a destination on the download volume.
+"""
+
+import os
+import argparse
+import tempfile
+import time
+import resource
+from collections import namedtuple
+
+from raphodo.copyfiles import FileCopy
+from raphodo.constants import CopyEngine
+
+
+BenchmarkFile = namedtuple('BenchmarkFile', 'size')
+
+
+class BenchmarkFileCopy(FileCopy):
+    def __init__(self, copy_engine: CopyEngine) -> None:
+        super().__init__()
+        self.copy_engine = copy_engine
+        self.verify_file = False
+        self.problems = []
+
+    def check_for_controller_directive(self) -> None:
+        pass
+
+    def update_progress(self, amount_downloaded: int, total: int) -> None:
+        pass
+
+
+def evict_from_page_cache(full_file_name: str) -> None:
+    fd = os.open(full_file_name, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def benchmark(source: str, dest_dir: str, copy_engine: CopyEngine, runs: int) -> None:
+    size = os.path.getsize(source)
+    destination = os.path.join(dest_dir, 'benchmark-copy')
+    copier = BenchmarkFileCopy(copy_engine)
+
+    elapsed = cpu_user = cpu_sys = 0.0
+    for i in range(runs):
+        evict_from_page_cache(source)
+        start_usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        assert copier.copy_from_filesystem(source, destination, BenchmarkFile(size))
+        # Include the time taken to write the file to disk
+        evict_from_page_cache(destination)
+        elapsed += time.perf_counter() - start
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_user += end_usage.ru_utime - start_usage.ru_utime
+        cpu_sys += end_usage.ru_stime - start_usage.ru_stime
+        os.remove(destination)
+
+    mb = size * runs / 1024 / 1024
+    print(
+        "{:<8} {:>10.1f} MB/s   user {:>7.3f}s   sys {:>7.3f}s   CPU per GB {:>7.3f}s".format(
+            copy_engine.name, mb / elapsed, cpu_user, cpu_sys,
+            (cpu_user + cpu_sys) / (mb / 1024)
+        )
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark file copy engines')
+    parser.add_argument('-s', '--source', help='file to copy (default: generate one)')
+    parser.add_argument('-d', '--destination', help='directory to copy to (default: temp dir)')
+    parser.add_argument(
+        '--size', type=int, default=1024, help='size of generated file in MB (default: 1024)'
+    )
+    parser.add_argument('-r', '--runs', type=int, default=3, help='runs per engine (default: 3)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.destination) as tempdir:
+        source = args.source
+        if source is None:
+            source = os.path.join(tempdir, 'benchmark-source')
+            chunk = os.urandom(1024 * 1024)
+            with open(source, 'wb') as f:
+                for i in range(args.size):
+                    f.write(chunk)
+        print("Copying {} ({} bytes), {} runs per engine".format(
+            source, os.path.getsize(source), args.runs)
+        )
+        for copy_engine in CopyEngine:
+            benchmark(source, tempdir, copy_engine, args.runs)
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+__author__ = 'Damon Lynch'
+
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark how long a scan spends determining which files were previously
+downloaded.
+
+Creates a database of previously downloaded files, then looks up the files
+on a simulated memory card the way ScanWorker does: one bulk lookup per
+directory, or one lookup per file. Lookups per file are run with and without
+the Bloom filter, which bulk lookups do not use.
+
+By default the database is evicted from the page cache before each run, as
+is the case the first time a device is scanned after the computer starts.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from raphodo.rpdsql import DownloadedSQL
+
+
+def history_file(i: int):
+    return 'IMG_{:07d}.JPG'.format(i), 1000000 + i, 1400000000.5 + i
+
+
+def card_file(i: int, previously_downloaded: int):
+    if i < previously_downloaded:
+        return history_file(i)
+    return 'DSC_{:07d}.ARW'.format(i), 2000000 + i, 1600000000.5 + i
+
+
+def create_history(data_dir: str, no_files: int) -> None:
+    d = DownloadedSQL(data_dir=data_dir, batch_size=10000, use_filter=False)
+    for i in range(no_files):
+        name, size, modification_time = history_file(i)
+        d.add_downloaded_file(name, size, modification_time, '/photos/{}'.format(name))
+    d.close()
+
+
+def evict_from_page_cache(data_dir: str) -> None:
+    """
+    Simulate the first scan after the computer starts, when the database
+    is not yet in the page cache
+    """
+
+    for name in os.listdir(data_dir):
+        fd = os.open(os.path.join(data_dir, name), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def scan(data_dir: str, files: list, dir_size: int, bulk: bool, use_filter: bool,
+         cold: bool) -> None:
+    if cold:
+        evict_from_page_cache(data_dir)
+    start = time.perf_counter()
+    d = DownloadedSQL(data_dir=data_dir, use_filter=use_filter)
+    if use_filter:
+        # Include the time to load the filter
+        d.refresh_filter()
+    found = 0
+    if bulk:
+        for i in range(0, len(files), dir_size):
+            found += len(d.files_downloaded_bulk(files[i:i + dir_size]))
+    else:
+        for name, size, modification_time in files:
+            if d.file_downloaded(name, size, modification_time) is not None:
+                found += 1
+    elapsed = time.perf_counter() - start
+    d.close()
+    print(
+        "{:<6} {:<16} {:>8.3f}s  {:>6.2f}µs per file  {} previously downloaded".format(
+            'bulk' if bulk else 'single', 'with filter' if use_filter else 'without filter',
+            elapsed, elapsed / len(files) * 1000000, found
+        )
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark previously downloaded file detection during a scan'
+    )
+    parser.add_argument(
+        '--history', type=int, default=1000000,
+        help='files in the database of previously downloaded files (default: 1000000)'
+    )
+    parser.add_argument(
+        '--files', type=int, default=100000, help='files on the memory card (default: 100000)'
+    )
+    parser.add_argument(
+        '--downloaded', type=int, default=0,
+        help='files on the memory card previously downloaded (default: 0)'
+    )
+    parser.add_argument(
+        '--dir-size', type=int, default=999, help='files per directory (default: 999)'
+    )
+    parser.add_argument(
+        '--warm', action='store_true',
+        help='do not evict the database from the page cache before each run'
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        print("Creating database of {} previously downloaded files".format(args.history))
+        create_history(data_dir, args.history)
+
+        files = [card_file(i, min(args.downloaded, args.history)) for i in range(args.files)]
+        print("Scanning {} files".format(args.files))
+        # Build the filter outside of the timed runs, as happens after the first scan
+        d = DownloadedSQL(data_dir=data_dir)
+        d.refresh_filter()
+        d.close()
+        for bulk, use_filter in ((False, False), (False, True), (True, False)):
+            scan(data_dir, files, args.dir_size, bulk, use_filter, not args.warm)
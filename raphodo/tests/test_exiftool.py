@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+__author__ = 'Damon Lynch'
+
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark reading preview images from ExifTool, e.g. the full size previews
+embedded in 45 megapixel raw files.
+
+Every preview image in each file is extracted three ways: using the reader
+ExifTool.execute() used before it read into a growable buffer, using
+ExifTool.execute_binary(), and streamed into a reused buffer using
+ExifTool.execute_binary_to(). The output of each is checked to be identical.
+
+With --metadata, instead compare reading the metadata of each file using one
+ExifTool command per file to reading it using ExifTool.request_metadata(),
+which reads the metadata of many files with a single command, and to reading
+it that way using a pool of ExifTool processes running in parallel. Videos and
+CR3 and HEIF files are where this matters most.
+"""
+
+import argparse
+import os
+import time
+
+import raphodo.exiftool as exiftool
+from raphodo.exiftoolpool import ExifToolPool
+from raphodo.metadataexiftool import MetadataExiftool
+from raphodo.fileformats import file_type_from_splitext
+
+
+class LegacyExifTool(exiftool.ExifTool):
+    """
+    Read ExifTool's output by concatenating blocks, as ExifTool did previously
+    """
+
+    def execute(self, *params):
+        if not self.running:
+            raise ValueError("ExifTool instance not running.")
+        self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
+        self._process.stdin.flush()
+        output = b""
+        fd = self._process.stdout.fileno()
+        while not output[-32:].strip().endswith(exiftool.sentinel):
+            output += os.read(fd, exiftool.block_size)
+        return output.strip()[:-len(exiftool.sentinel)]
+
+
+def files_to_benchmark(paths: list) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                full_file_name = os.path.join(path, name)
+                if os.path.isfile(full_file_name) and \
+                        file_type_from_splitext(file_name=name) is not None:
+                    files.append(full_file_name)
+        else:
+            files.append(path)
+    return files
+
+
+def benchmark(files: list) -> None:
+    with exiftool.ExifTool() as et_process, LegacyExifTool() as legacy_process:
+        previews = []
+        for full_file_name in files:
+            m = MetadataExiftool(full_file_name, et_process)
+            names = m.preview_names()
+            if names:
+                previews.extend((full_file_name, name) for name in names)
+        if not previews:
+            print("No preview images found")
+            return
+
+        results = {}
+        buffer = bytearray()
+        for method in ('legacy', 'bytes', 'stream'):
+            size = 0
+            output = []
+            start = time.perf_counter()
+            for full_file_name, name in previews:
+                tag = '-{}'.format(name)
+                if method == 'legacy':
+                    preview = legacy_process.execute_binary(tag, full_file_name)
+                elif method == 'bytes':
+                    preview = et_process.execute_binary(tag, full_file_name)
+                else:
+                    del buffer[:]
+                    et_process.execute_binary_to(buffer, tag, full_file_name)
+                    preview = bytes(buffer)
+                size += len(preview)
+                output.append(preview)
+            elapsed = time.perf_counter() - start
+            results[method] = output
+
+            print(
+                "{:<7} {:>4} previews {:>8,.1f} MB {:>7.3f}s {:>8,.1f} MB/s".format(
+                    method, len(previews), size / 1024 ** 2, elapsed,
+                    size / 1024 ** 2 / elapsed
+                )
+            )
+
+        assert results['legacy'] == results['bytes'] == results['stream']
+        largest = max(len(preview) for preview in results['bytes'])
+        print("Largest preview: {:,} bytes".format(largest))
+
+
+def benchmark_metadata(files: list, pool_size: int) -> None:
+    with exiftool.ExifTool() as single_process, ExifToolPool(pool_size) as pool:
+        # Start every process in the pool before timing it
+        pool.get_metadata_batch(files[:pool.min_files_per_process * pool_size])
+        results = {}
+        for method in ('each', 'batch', 'pool'):
+            et_process = pool if method == 'pool' else single_process
+            start = time.perf_counter()
+            if method != 'each':
+                for full_file_name in files:
+                    et_process.request_metadata(full_file_name)
+            metadata = []
+            for full_file_name in files:
+                try:
+                    metadata.append(et_process.get_metadata(full_file_name))
+                except ValueError:
+                    metadata.append(None)
+            elapsed = time.perf_counter() - start
+            results[method] = metadata
+            print(
+                "{:<5} {:>5} files {:>7.3f}s {:>8,.1f} files/s".format(
+                    method, len(files), elapsed, len(files) / elapsed
+                )
+            )
+
+        assert results['each'] == results['batch'] == results['pool']
+        for index, usage in enumerate(pool.utilisation()):
+            print(
+                "pool process {}: {:>5} commands {:>5.0%} busy".format(
+                    index, usage.commands, usage.utilisation
+                )
+            )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark extracting preview images using ExifTool'
+    )
+    parser.add_argument(
+        'paths', nargs='+',
+        help='photos, e.g. 45 megapixel raw files, or folders containing them'
+    )
+    parser.add_argument(
+        '--metadata', action='store_true',
+        help='benchmark reading the metadata of many files with a single command'
+    )
+    parser.add_argument(
+        '-p', '--pool', type=int, default=4,
+        help='number of ExifTool processes in the pool used with --metadata (default: 4)'
+    )
+    args = parser.parse_args()
+    if args.metadata:
+        benchmark_metadata(files_to_benchmark(args.paths), args.pool)
+    else:
+        benchmark(files_to_benchmark(args.paths))
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 __author__ = 'Damon Lynch'
 
-# Copyright (C) 2015 Damon Lynch <damonlynch@gmail.com>
+# Copyright (C) 2015-2020 Damon Lynch <damonlynch@gmail.com>
 
 # This file is part of Rapid Photo Downloader.
 #
@@ -19,11 +19,131 @@ __author__ = 'Damon Lynch'
 # along with Rapid Photo Downloader.  If not,
 # see <http://www.gnu.org/licenses/>.
 
+"""
+Generate the Timeline from test data, or benchmark generating it.
+
+The benchmark simulates a session of photos and videos taken in bursts
+over several years, and times building the Timeline with and without
+NumPy, as happens each time the Timeline's time span is changed.
+
+With --incremental, the benchmark instead times regenerating the Timeline as
+files are added in batches and the time span is changed, with and without the
+timestamp index retained between generations.
+"""
+
+import sys
 import pickle
-import proximity
+import random
+import argparse
+import time
+
+from PyQt5.QtWidgets import QApplication
+
+import raphodo.proximity as proximity
+from raphodo.viewutils import ThumbnailDataForProximity
+from raphodo.constants import FileType
+
+
+def simulated_session(no_files: int, seed: int=0) -> list:
+    r = random.Random(seed)
+    ctime = 1420070400.0
+    rows = []
+    for i in range(no_files):
+        if r.random() < 0.01:
+            # A new burst of photos, hours or days after the last
+            ctime += r.uniform(3600, 86400 * 10)
+        else:
+            ctime += r.expovariate(1 / 30)
+        rows.append(
+            ThumbnailDataForProximity(
+                uid=i.to_bytes(4, 'big'), ctime=ctime,
+                file_type=FileType.video if r.random() < 0.1 else FileType.photo,
+                previously_downloaded=r.random() < 0.2
+            )
+        )
+    return rows
+
+
+def benchmark(no_files: int, temporal_span: int, runs: int) -> None:
+    rows = simulated_session(no_files)
+    have_numpy = proximity.have_numpy
+    for use_numpy in (False, True):
+        if use_numpy and not have_numpy:
+            print("NumPy is not installed")
+            break
+        proximity.have_numpy = use_numpy
+        elapsed = []
+        for i in range(runs):
+            start = time.perf_counter()
+            groups = proximity.TemporalProximityGroups(list(rows), temporal_span)
+            elapsed.append(time.perf_counter() - start)
+        print(
+            "{:<14} {:>8.3f}s for {} files in {} Timeline rows".format(
+                'with NumPy' if use_numpy else 'without NumPy', min(elapsed), no_files,
+                len(groups)
+            )
+        )
+    proximity.have_numpy = have_numpy
+
+
+def benchmark_incremental(no_files: int, batch: int, runs: int) -> None:
+    rows = simulated_session(no_files)
+    random.Random(1).shuffle(rows)
+    spans = (300, 900, 3600, 7200)
+    for retain in (False, True):
+        elapsed = []
+        for i in range(runs):
+            timestamps = proximity.TimestampIndex()
+            start = time.perf_counter()
+            for end in range(batch, no_files + batch, batch):
+                proximity.TemporalProximityGroups(
+                    rows[:end], 3600, timestamps=timestamps if retain else None
+                )
+            for temporal_span in spans:
+                proximity.TemporalProximityGroups(
+                    rows, temporal_span, timestamps=timestamps if retain else None
+                )
+            elapsed.append(time.perf_counter() - start)
+        print(
+            "{:<18} {:>8.3f}s for {} files added {} at a time, then {} span changes".format(
+                'index retained' if retain else 'index not retained', min(elapsed), no_files,
+                batch, len(spans)
+            )
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate or benchmark the Timeline')
+    parser.add_argument(
+        '-d', '--data', default='proximity_test_data',
+        help='pickled thumbnail rows to generate the Timeline from '
+             '(default: proximity_test_data)'
+    )
+    parser.add_argument(
+        '--benchmark', type=int, metavar='FILES',
+        help='benchmark generating the Timeline for this many simulated files'
+    )
+    parser.add_argument(
+        '--span', type=int, default=3600,
+        help='Timeline time span in seconds (default: 3600)'
+    )
+    parser.add_argument(
+        '--incremental', type=int, metavar='BATCH',
+        help='with --benchmark, add the simulated files this many at a time'
+    )
+    parser.add_argument('-r', '--runs', type=int, default=3, help='runs (default: 3)')
+    args = parser.parse_args()
+
+    # Needed to determine the size of Timeline rows
+    app = QApplication(sys.argv)
 
-with open('proximity_test_data', 'rb') as data:
-    test_rows = pickle.load(data)
+    if args.benchmark is not None and args.incremental:
+        benchmark_incremental(args.benchmark, args.incremental, args.runs)
+    elif args.benchmark is not None:
+        benchmark(args.benchmark, args.span, args.runs)
+    else:
+        with open(args.data, 'rb') as data:
+            test_rows = pickle.load(data)
 
-p = proximity.TemporalProximityGroups(test_rows)
-print(p.depth())
+        p = proximity.TemporalProximityGroups(test_rows, args.span)
+        print(p.depth())
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+__author__ = 'Damon Lynch'
+
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark pickling RPDFiles using their compact wire format, compared to pickling
+their attribute dictionaries, which is what pickle does by default.
+
+Files are pickled as they are after a scan, and again after they have been
+downloaded. Each is pickled individually, as when the copy and rename processes
+return a file to the main process, and as a single list, as when the scan process
+returns a batch of files.
+
+With --catalogue, instead compare the memory used by the main window's file
+catalogue to the memory used by a dictionary of RPDFiles.
+"""
+
+import argparse
+import gc
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+
+from raphodo.constants import (
+    DeviceTimestampTZ, ThumbnailCacheDiskStatus, FileType, DownloadStatus, ExifSource,
+    ThumbnailCacheStatus, HashAlgorithm
+)
+from raphodo.rpdfile import get_rpdfile, RPDFile
+from raphodo.filecatalogue import FileCatalogue
+from raphodo.storage import CameraDetails
+
+
+class PlainFile:
+    """
+    File restored from its attribute dictionary, which RPDFile cannot be
+    """
+
+
+class LegacyPickle:
+    """
+    Pickle a file the way pickle does when RPDFile does not define its wire format
+    """
+
+    def __init__(self, rpd_file: RPDFile) -> None:
+        self.rpd_file = rpd_file
+
+    def __reduce__(self):
+        return object.__new__, (PlainFile, ), self.rpd_file.__dict__
+
+
+def simulated_card(no_files: int, from_camera: bool, seed: int=0) -> list:
+    r = random.Random(seed)
+    if from_camera:
+        camera_details = CameraDetails(
+            model='Canon EOS 5D Mark IV', port='usb:001,012', display_name='Canon EOS 5D Mark IV',
+            is_mtp=False, storage_desc=['SD', 'CF']
+        )
+        path = '/store_00020001/DCIM/100CANON'
+        device_display_name = 'Canon EOS 5D Mark IV'
+        device_uri = 'gphoto2://usb:001,012/'
+    else:
+        camera_details = None
+        path = '/media/user/EOS_DIGITAL/DCIM/100CANON'
+        device_display_name = 'EOS_DIGITAL'
+        device_uri = 'file:///media/user/EOS_DIGITAL'
+    mtime = 1577836800.0
+    files = []
+    for i in range(no_files):
+        video = r.random() < 0.1
+        mtime += r.expovariate(1 / 30)
+        files.append(
+            get_rpdfile(
+                name='{}_{:04}.{}'.format('MVI' if video else 'IMG', i % 10000,
+                                          'MP4' if video else 'CR2'),
+                path=path, size=r.randint(1000000, 30000000), prev_full_name=None,
+                prev_datetime=None, device_timestamp_type=DeviceTimestampTZ.is_local,
+                mtime=mtime, mdatatime=0.0,
+                thumbnail_cache_status=ThumbnailCacheDiskStatus.not_found, thm_full_name=None,
+                audio_file_full_name=None, xmp_file_full_name=None, log_file_full_name=None,
+                scan_id=b'3', file_type=FileType.video if video else FileType.photo,
+                from_camera=from_camera, camera_details=camera_details,
+                camera_memory_card_identifiers=[1] if from_camera else None,
+                never_read_mdatatime=False, device_display_name=device_display_name,
+                device_uri=device_uri, raw_exif_bytes=None,
+                exif_source=None if video else ExifSource.app1_segment, problem=None
+            )
+        )
+    return files
+
+
+def simulate_download(files: list) -> None:
+    for rpd_file in files:
+        rpd_file.mdatatime = rpd_file.modification_time
+        rpd_file.thumbnail_status = ThumbnailCacheStatus.ready
+        rpd_file.status = DownloadStatus.downloaded
+        rpd_file.temp_full_file_name = '/home/user/Pictures/.rpd-tmp-x7w/{}'.format(rpd_file.name)
+        rpd_file.digest = '{:032x}'.format(random.getrandbits(128))
+        rpd_file.digest_algorithm = HashAlgorithm.md5
+        rpd_file.download_start_time = rpd_file.modification_time
+        rpd_file.download_folder = '/home/user/Pictures'
+        rpd_file.download_subfolder = '2020/20200101'
+        rpd_file.download_path = '/home/user/Pictures/2020/20200101'
+        rpd_file.download_name = '20200101-{}'.format(rpd_file.name)
+        rpd_file.download_full_file_name = '{}/{}'.format(
+            rpd_file.download_path, rpd_file.download_name
+        )
+        rpd_file.download_full_base_name = rpd_file.download_full_file_name[:-4]
+        rpd_file.subfolder_pref_list = ['Date time', 'Image date', 'YYYY', '/', '', '',
+                                        'Date time', 'Image date', 'YYYYMMDD']
+        rpd_file.name_pref_list = ['Date time', 'Image date', 'YYYYMMDD', 'Text', '-', '',
+                                   'Filename', 'Name', 'Original Case']
+        rpd_file.generate_extension_case = 'lower case'
+        rpd_file.strip_characters = True
+
+
+def benchmark(files: list, stage: str) -> None:
+    for name, pickled in (('dictionary', [LegacyPickle(f) for f in files]), ('wire', files)):
+        start = time.perf_counter()
+        messages = [pickle.dumps(f, pickle.HIGHEST_PROTOCOL) for f in pickled]
+        dumps = time.perf_counter() - start
+        start = time.perf_counter()
+        for message in messages:
+            pickle.loads(message)
+        loads = time.perf_counter() - start
+        size = sum(len(message) for message in messages)
+
+        start = time.perf_counter()
+        batch = pickle.dumps(pickled, pickle.HIGHEST_PROTOCOL)
+        batch_dumps = time.perf_counter() - start
+        start = time.perf_counter()
+        pickle.loads(batch)
+        batch_loads = time.perf_counter() - start
+
+        print(
+            "{:<5} {:<10} each: {:>5,} bytes, {:>6.1f}ms dumps, {:>6.1f}ms loads   "
+            "batch: {:>6,} KB, {:>6.1f}ms dumps, {:>6.1f}ms loads".format(
+                stage, name, size // len(files), dumps * 1000, loads * 1000,
+                len(batch) // 1024, batch_dumps * 1000, batch_loads * 1000
+            )
+        )
+
+
+def benchmark_batch(files: list, stage: str, repeat: int=50) -> None:
+    """
+    Time pickling and unpickling a batch of files using the wire format and using
+    their attribute dictionaries.
+
+    Runs alternate between the two, and the fastest of each is reported, so that other
+    activity on the system affects both equally. As with timeit, garbage collection is
+    disabled while timing.
+    """
+
+    pickled = dict(dictionary=[LegacyPickle(f) for f in files], wire=files)
+    fastest = {}
+    gc.disable()
+    order = list(pickled.items())
+    for _ in range(repeat):
+        # Whichever runs second tends to be slower, so alternate which runs first
+        order.reverse()
+        for name, batch in order:
+            start = time.perf_counter()
+            message = pickle.dumps(batch, pickle.HIGHEST_PROTOCOL)
+            dumps = time.perf_counter() - start
+            start = time.perf_counter()
+            pickle.loads(message)
+            loads = time.perf_counter() - start
+            previous = fastest.get(name, (dumps, loads))
+            fastest[name] = min(previous[0], dumps), min(previous[1], loads)
+            del message
+    gc.enable()
+
+    print(
+        "{:<5} fastest batch dumps: {:.1f}ms wire, {:.1f}ms dictionary   "
+        "loads: {:.1f}ms wire, {:.1f}ms dictionary".format(
+            stage, fastest['wire'][0] * 1000, fastest['dictionary'][0] * 1000,
+            fastest['wire'][1] * 1000, fastest['dictionary'][1] * 1000
+        )
+    )
+
+
+def check_round_trip(files: list) -> None:
+    for rpd_file in files:
+        restored = pickle.loads(pickle.dumps(rpd_file, pickle.HIGHEST_PROTOCOL))
+        assert type(restored) is type(rpd_file)
+        assert restored.__dict__ == rpd_file.__dict__, rpd_file.name
+
+
+def benchmark_catalogue(no_files: int, from_camera: bool) -> None:
+    for name in ('dictionary', 'catalogue'):
+        tracemalloc.start()
+        files = simulated_card(no_files, from_camera)
+        if name == 'catalogue':
+            catalogue = FileCatalogue()
+            for rpd_file in files:
+                catalogue[rpd_file.uid] = rpd_file
+        else:
+            catalogue = {rpd_file.uid: rpd_file for rpd_file in files}
+        del files
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        uids = list(catalogue)
+        start = time.perf_counter()
+        for uid in uids:
+            catalogue[uid]
+        elapsed = time.perf_counter() - start
+        print(
+            "{:<10} {:>7,} KB {:>6,} bytes per file, {:>6.1f}ms to retrieve every file".format(
+                name, size // 1024, size // no_files, elapsed * 1000
+            )
+        )
+        del catalogue
+
+
+def check_catalogue(files: list) -> None:
+    catalogue = FileCatalogue()
+    for rpd_file in files:
+        catalogue[rpd_file.uid] = rpd_file
+    del catalogue[files[0].uid]
+    catalogue[files[0].uid] = files[0]
+    assert len(catalogue) == len(files)
+    for rpd_file in files:
+        assert catalogue[rpd_file.uid].__dict__ == rpd_file.__dict__, rpd_file.name
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark pickling RPDFiles')
+    parser.add_argument(
+        '-f', '--files', type=int, default=50000,
+        help='number of files on the simulated memory card (default: 50,000)'
+    )
+    parser.add_argument(
+        '-c', '--camera', action='store_true', help='simulate downloading from a camera'
+    )
+    parser.add_argument(
+        '--catalogue', action='store_true',
+        help="benchmark the memory used by the main window's file catalogue"
+    )
+    args = parser.parse_args()
+
+    if args.catalogue:
+        check_catalogue(simulated_card(1000, args.camera))
+        benchmark_catalogue(args.files, args.camera)
+        sys.exit(0)
+
+    files = simulated_card(args.files, args.camera)
+    # Timing a batch repeatedly takes too long with the whole card
+    batch_files = 3000
+    check_round_trip(files)
+    benchmark(files, 'scan')
+    benchmark_batch(files[:batch_files], 'scan')
+    simulate_download(files)
+    check_round_trip(files)
+    benchmark(files, 'copy')
+    benchmark_batch(files[:batch_files], 'copy')
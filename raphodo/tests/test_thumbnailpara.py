@@ -25,6 +25,8 @@ import shutil
 import pickle
 import tempfile
 import argparse
+import timeit
+from collections import deque
 
 from PyQt5.QtCore import QSize
 from PyQt5.QtWidgets import (QApplication, QTextEdit)
@@ -38,6 +40,46 @@ from raphodo.thumbnailer import Thumbnailer
 from raphodo.rpdfile import RPDFile
 from raphodo.cache import ThumbnailCacheSql
 from raphodo.camera import autodetect_cameras
+from raphodo.thumbnailpara import split_indexes
+
+
+def quadratic_split_indexes(length: int):
+    """
+    The original implementation of split_indexes, which repeatedly slices
+    lists, to compare against
+    """
+
+    def split_list(alist: list, wanted_parts=2):
+        length = len(alist)
+        return [alist[i * length // wanted_parts: (i + 1) * length // wanted_parts]
+                for i in range(wanted_parts)]
+
+    l = list(range(length))
+    n = []
+    master = deque([l])
+    while master:
+        l1, l2 = split_list(master.popleft())
+        if l2:
+            n.append(l2[0])
+            l2 = l2[1:]
+        if l1:
+            master.append(l1)
+        if l2:
+            master.append(l2)
+    return n
+
+
+def benchmark_split_indexes(length: int, runs: int=5) -> None:
+    """
+    Compare the time taken to prioritise the thumbnails of a device with
+    this many files, and check both implementations give the same order
+    """
+
+    assert split_indexes(length) == quadratic_split_indexes(length)
+    for name, function in (
+            ('quadratic', quadratic_split_indexes), ('linear', split_indexes)):
+        elapsed = min(timeit.repeat(lambda: function(length), number=1, repeat=runs))
+        print("{:<10} {:>10.2f}ms for {} files".format(name, elapsed * 1000, length))
 
 
 class TestThumbnail(QTextEdit):
@@ -88,7 +130,14 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--profile', dest='profile', action="store_true")
     parser.add_argument("--reset", action="store_true", dest="reset",
                  help="reset all thumbnail caches and exit")
+    parser.add_argument(
+        '--benchmark-split', type=int, metavar='FILES',
+        help="benchmark prioritising the thumbnails of this many files and exit"
+    )
     args = parser.parse_args()
+    if args.benchmark_split is not None:
+        benchmark_split_indexes(args.benchmark_split)
+        sys.exit(0)
     if args.reset:
         cache = ThumbnailCacheSql(create_table_if_not_exists=False)
         cache.purge_cache()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+__author__ = 'Damon Lynch'
+
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the transports used between processes: messages per second and
+megabytes per second when sending thumbnails of various sizes over tcp://,
+over ipc://, and over ipc:// with the thumbnail in shared memory.
+
+Thumbnails are sent the way thumbnail workers send them: as a pickled
+GenerateThumbnailsResults, sent to a sink in another process that
+unpickles it.
+
+With --thumbnails, instead compare thumbnails per second when the thumbnail
+extractor sends thumbnails as PNGs and as raw pixels, including encoding the
+thumbnail in the worker and converting it to a QPixmap in the sink.
+"""
+
+import argparse
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+
+import zmq
+from PyQt5.QtCore import Qt, QSize
+from PyQt5.QtGui import QImage, QPainter, QLinearGradient, QColor, QGuiApplication
+
+import raphodo.transport as transport
+from raphodo.interprocess import GenerateThumbnailsResults, qimage_to_raw
+from raphodo.thumbnailextractor import qimage_to_png_buffer
+
+
+def sink(port: int, reply_port: int, no_messages: int) -> None:
+    context = zmq.Context()
+    receiver = context.socket(zmq.PULL)
+    receiver.connect(transport.endpoint(port))
+    reply = context.socket(zmq.PUSH)
+    reply.connect(transport.endpoint(reply_port))
+    for i in range(no_messages):
+        data = pickle.loads(receiver.recv())  # type: GenerateThumbnailsResults
+        assert data.thumbnail_bytes is not None
+    reply.send(b'done')
+    receiver.close()
+    reply.close(linger=-1)
+    context.term()
+
+
+def benchmark(name: str, size: int, no_messages: int) -> None:
+    context = zmq.Context()
+    sender = context.socket(zmq.PUSH)
+    port = transport.bind_to_random_port(sender)
+    reply = context.socket(zmq.PULL)
+    reply_port = transport.bind_to_random_port(reply)
+
+    process = multiprocessing.Process(target=sink, args=(port, reply_port, no_messages))
+    process.start()
+
+    thumbnail = os.urandom(size)
+    start = time.perf_counter()
+    for i in range(no_messages):
+        sender.send(
+            pickle.dumps(
+                GenerateThumbnailsResults(thumbnail_bytes=thumbnail), pickle.HIGHEST_PROTOCOL
+            )
+        )
+    reply.recv()
+    elapsed = time.perf_counter() - start
+    process.join()
+
+    print(
+        "{:<16} {:>9,} bytes {:>10,.0f} messages/s {:>9,.1f} MB/s".format(
+            name, size, no_messages / elapsed, size * no_messages / elapsed / 1024 ** 2
+        )
+    )
+    sender.close()
+    reply.close()
+    context.term()
+
+
+def thumbnail_sink(port: int, reply_port: int, no_messages: int) -> None:
+    app = QGuiApplication(sys.argv[:1])
+    context = zmq.Context()
+    receiver = context.socket(zmq.PULL)
+    receiver.connect(transport.endpoint(port))
+    reply = context.socket(zmq.PUSH)
+    reply.connect(transport.endpoint(reply_port))
+    for i in range(no_messages):
+        data = pickle.loads(receiver.recv())  # type: GenerateThumbnailsResults
+        assert not data.thumbnail().isNull()
+    reply.send(b'done')
+    receiver.close()
+    reply.close(linger=-1)
+    context.term()
+
+
+def sample_thumbnail(path: str) -> QImage:
+    if path:
+        image = QImage(path)
+        assert not image.isNull(), "Could not load {}".format(path)
+        return image.scaled(QSize(160, 120), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+    image = QImage(160, 120, QImage.Format_RGB32)
+    gradient = QLinearGradient(0, 0, 160, 120)
+    gradient.setColorAt(0, QColor(38, 84, 124))
+    gradient.setColorAt(1, QColor(239, 171, 92))
+    painter = QPainter(image)
+    painter.fillRect(image.rect(), gradient)
+    painter.end()
+    return image
+
+
+def benchmark_thumbnails(thumbnail: QImage, no_messages: int) -> None:
+    for name in ('png', 'raw'):
+        context = zmq.Context()
+        sender = context.socket(zmq.PUSH)
+        port = transport.bind_to_random_port(sender)
+        reply = context.socket(zmq.PULL)
+        reply_port = transport.bind_to_random_port(reply)
+
+        process = multiprocessing.Process(
+            target=thumbnail_sink, args=(port, reply_port, no_messages)
+        )
+        process.start()
+
+        size = 0
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        for i in range(no_messages):
+            if name == 'png':
+                results = GenerateThumbnailsResults(
+                    thumbnail_bytes=qimage_to_png_buffer(thumbnail).data()
+                )
+            else:
+                results = GenerateThumbnailsResults(thumbnail_image=qimage_to_raw(thumbnail))
+            message = pickle.dumps(results, pickle.HIGHEST_PROTOCOL)
+            size += len(message)
+            sender.send(message)
+        cpu = time.process_time() - cpu_start
+        reply.recv()
+        elapsed = time.perf_counter() - start
+        process.join()
+
+        print(
+            "{:<4} {:>7,} bytes {:>8,.0f} thumbnails/s {:>6.3f}ms worker CPU per "
+            "thumbnail".format(
+                name, size // no_messages, no_messages / elapsed, cpu / no_messages * 1000
+            )
+        )
+        sender.close()
+        reply.close()
+        context.term()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark interprocess transports')
+    parser.add_argument(
+        '-s', '--sizes', type=int, nargs='+', default=[1024, 32 * 1024, 256 * 1024, 4096 * 1024],
+        help='thumbnail sizes in bytes (default: 1 KB, 32 KB, 256 KB and 4 MB)'
+    )
+    parser.add_argument(
+        '-d', '--data', type=int, default=256,
+        help='megabytes to send for each size, to a maximum of 10,000 messages (default: 256)'
+    )
+    parser.add_argument(
+        '--thumbnails', action='store_true',
+        help='benchmark sending thumbnails as PNGs compared to raw pixels'
+    )
+    parser.add_argument(
+        '-n', '--number', type=int, default=10000,
+        help='number of thumbnails to send with --thumbnails (default: 10,000)'
+    )
+    parser.add_argument(
+        '-i', '--image', default='',
+        help='image to make the thumbnail from with --thumbnails (default: a gradient)'
+    )
+    args = parser.parse_args()
+
+    if sys.platform.startswith('linux'):
+        multiprocessing.set_start_method('fork')
+
+    # Removed on exit
+    ipc_directory = transport.create_ipc_directory()
+
+    if args.thumbnails:
+        benchmark_thumbnails(sample_thumbnail(args.image), args.number)
+        sys.exit(0)
+    if ipc_directory is None:
+        transports = ('tcp', )
+    else:
+        print("ipc directory: {}\n".format(ipc_directory))
+        transports = ('tcp', 'ipc', 'ipc + shm')
+
+    for size in args.sizes:
+        no_messages = max(1, min(10000, args.data * 1024 ** 2 // size))
+        for name in transports:
+            if name == 'tcp':
+                os.environ.pop(transport.ipc_directory_variable, None)
+            else:
+                os.environ[transport.ipc_directory_variable] = ipc_directory
+            if name == 'ipc + shm':
+                transport.shared_memory_threshold = 0
+            else:
+                transport.shared_memory_threshold = sys.maxsize
+            benchmark(name, size, no_messages)
+        print()
+    os.environ[transport.ipc_directory_variable] = ipc_directory
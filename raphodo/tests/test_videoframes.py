@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+__author__ = 'Damon Lynch'
+
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark extracting the frames video thumbnails are generated from, e.g. from a
+card of drone or action camera clips.
+
+Each video's frame is extracted using get_video_frame(), which builds a playbin
+for every video and encodes the frame as PNG, and using VideoFrameExtractor, which
+reuses a single pipeline and decodes the frame straight to a scaled QImage.
+"""
+
+import argparse
+import os
+import time
+
+from PyQt5.QtGui import QImage
+
+from raphodo.thumbnailextractor import get_video_frame, VideoFrameExtractor, have_gst
+from raphodo.fileformats import file_type_from_splitext
+from raphodo.constants import FileType
+
+
+def videos_to_benchmark(paths: list) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                full_file_name = os.path.join(path, name)
+                if os.path.isfile(full_file_name) and \
+                        file_type_from_splitext(file_name=name) == FileType.video:
+                    files.append(full_file_name)
+        else:
+            files.append(path)
+    return files
+
+
+def benchmark(files: list, max_size: int) -> None:
+    extractor = VideoFrameExtractor(max_size)
+    for method in ('playbin', 'reused'):
+        latencies = []
+        failures = 0
+        start = time.perf_counter()
+        for full_file_name in files:
+            clip_start = time.perf_counter()
+            if method == 'playbin':
+                png = get_video_frame(full_file_name, 1.0)
+                image = QImage.fromData(png) if png else None
+            else:
+                image = extractor.get_frame(full_file_name, 1.0)
+            latencies.append(time.perf_counter() - clip_start)
+            if image is None or image.isNull():
+                failures += 1
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        print(
+            "{:<7} {:>5} videos {:>7.3f}s  per video: {:>6.1f}ms median {:>6.1f}ms maximum  "
+            "{} failures".format(
+                method, len(files), elapsed, latencies[len(latencies) // 2] * 1000,
+                latencies[-1] * 1000, failures
+            )
+        )
+    extractor.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark extracting video frames')
+    parser.add_argument('paths', nargs='+', help='videos, or folders containing them')
+    parser.add_argument(
+        '-s', '--size', type=int, default=512,
+        help='maximum width or height of frames decoded by the reused pipeline '
+             '(default: 512)'
+    )
+    args = parser.parse_args()
+    if not have_gst:
+        parser.error('GStreamer could not be initialized')
+    files = videos_to_benchmark(args.paths)
+    if not files:
+        parser.error('no videos found')
+    benchmark(files, args.size)
@@ -53,6 +53,7 @@ from raphodo.interprocess import (
     ThumbnailDaemonData, GenerateThumbnailsResults, DaemonProcess, ThumbnailExtractorArgument
 )
 from raphodo.rpdfile import RPDFile
+from raphodo.transport import endpoint
 from raphodo.thumbnailpara import GetThumbnailFromCache, preprocess_thumbnail_from_disk
 from raphodo.cache import FdoCacheLarge, FdoCacheNormal
 
@@ -87,7 +88,7 @@ class DameonThumbnailWorker(DaemonProcess):
 
         data = pickle.loads(content) # type: ThumbnailDaemonData
         assert data.frontend_port is not None
-        self.frontend.connect("tcp://localhost:{}".format(data.frontend_port))
+        self.frontend.connect(endpoint(data.frontend_port))
 
         # handle freedesktop.org cache files directly
         fdo_cache_large = FdoCacheLarge()
@@ -21,15 +21,17 @@ __copyright__ = "Copyright 2015-2020, Damon Lynch"
 
 import pickle
 import os
+import bisect
 import sys
 import datetime
 from collections import (namedtuple, defaultdict, deque)
-from operator import attrgetter
+from operator import attrgetter, itemgetter
+from itertools import groupby
 import subprocess
 import shlex
 import logging
 from timeit import timeit
-from typing import Optional, Dict, List, Set, Tuple, Sequence
+from typing import Optional, Dict, List, Set, Tuple, Sequence, Iterable, Iterator
 import locale
 import pkg_resources as pkgr
 
@@ -42,7 +44,7 @@ from colour import Color
 from PyQt5.QtCore import (
     QAbstractListModel, QModelIndex, Qt, pyqtSignal, QSizeF, QSize, QRect, QRectF, QEvent, QPoint,
     QItemSelectionModel, QAbstractItemModel, pyqtSlot, QItemSelection, QTimeLine, QPointF,
-    QT_VERSION_STR
+    QT_VERSION_STR, QTimer
 )
 from PyQt5.QtWidgets import (
     QListView, QStyledItemDelegate, QStyleOptionViewItem, QApplication, QStyle, QStyleOptionButton,
@@ -54,13 +56,17 @@ from PyQt5.QtGui import (
 )
 
 from raphodo.rpdfile import RPDFile, FileTypeCounter
+from raphodo.filecatalogue import FileCatalogue
+from raphodo.pixmapcache import ThumbnailPixmapCache
+from raphodo.cache import ThumbnailCacheSql, GetThumbnailPath
 from raphodo.fileformats import ALL_USER_VISIBLE_EXTENSIONS, MUST_CACHE_VIDEOS
 from raphodo.interprocess import GenerateThumbnailsArguments, Device, GenerateThumbnailsResults
 from raphodo.constants import (
     DownloadStatus, Downloaded, FileType, DownloadingFileTypes, ThumbnailSize,
     ThumbnailCacheStatus, Roles, DeviceType, CustomColors, Show, Sort, ThumbnailBackgroundName,
     Desktop, DeviceState, extensionColor, FadeSteps, FadeMilliseconds, PaleGray, DarkGray,
-    DoubleDarkGray, Plural, manually_marked_previously_downloaded, thumbnail_margin
+    DoubleDarkGray, Plural, manually_marked_previously_downloaded, thumbnail_margin,
+    ThumbnailCacheDiskStatus
 )
 from raphodo.storage import (
     get_program_cache_directory, get_desktop, validate_download_folder, open_in_file_manager
@@ -92,12 +98,36 @@ class DownloadStats:
         self.post_download_thumb_generation = 0
 
 
+def insertion_point(keys: List[tuple], key: tuple, lo: int, descending: bool) -> int:
+    """
+    Locate where to insert key into a list of sort keys, after any equal keys.
+
+    :param keys: sort keys in ascending or descending order
+    :param key: sort key to insert
+    :param lo: position in keys to start searching from
+    :param descending: True if the keys are in descending order
+    :return: position at which to insert key
+    """
+
+    if not descending:
+        return bisect.bisect_right(keys, key, lo)
+    hi = len(keys)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key > keys[mid]:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
 class AddBuffer:
     """
     Buffers thumbnail rows for display.
 
-    Add thumbnail rows to the listview is a relatively expensive operation, as the
-    model must be reset. Buffer the rows here, and then when big enough, flush it.
+    Adding thumbnail rows to the listview is a relatively expensive operation, as the
+    rows must be inserted into the database and merged into the view. Buffer the
+    rows here, and then when big enough, flush it.
     """
 
     min_buffer_length = 10
@@ -156,6 +186,12 @@ class ThumbnailListModel(QAbstractListModel):
         self.sort_order = Qt.AscendingOrder
         self.show = Show.all
 
+        # Thumbnails evicted from memory are reloaded from the thumbnail cache
+        if self.prefs.use_thumbnail_cache:
+            self.thumbnail_cache = ThumbnailCacheSql(create_table_if_not_exists=False)
+        else:
+            self.thumbnail_cache = None
+
         self.initialize()
 
         no_workers = parent.prefs.max_cpu_cores
@@ -176,7 +212,11 @@ class ThumbnailListModel(QAbstractListModel):
 
     def initialize(self) -> None:
         # uid: QPixmap
-        self.thumbnails = {}  # type: Dict[bytes, QPixmap]
+        self.thumbnails = ThumbnailPixmapCache(
+            max_size_mb=self.prefs.thumbnail_memory_cache_mb,
+            locate=self._locateThumbnail, load=self._loadThumbnail,
+            placeholder=self._placeholderThumbnail
+        )
 
         self.add_buffer = AddBuffer()
 
@@ -190,8 +230,8 @@ class ThumbnailListModel(QAbstractListModel):
         # Files are hidden when the combo box "Show" in the main window is set to
         # "New" instead of the default "All".
 
-        # uid: RPDFile
-        self.rpd_files = {}  # type: Dict[bytes, RPDFile]
+        # Files and the attributes used to display them
+        self.catalogue = FileCatalogue()
 
         # In memory database to hold all thumbnail rows
         self.tsql = ThumbnailRowsSQL()
@@ -201,6 +241,9 @@ class ThumbnailListModel(QAbstractListModel):
         # index 0 in the list is row 0 in the view
         # [(uid, marked)]
         self.rows = []  # type: List[Tuple[bytes, bool]]
+        # The values each row was sorted by when it was added to self.rows. The rows
+        # are in the order of these values, even if the values have since changed.
+        self.sort_keys = []  # type: List[tuple]
         # {uid: row}
         self.uid_to_row = {}  # type: Dict[bytes, int]
 
@@ -231,6 +274,52 @@ class ThumbnailListModel(QAbstractListModel):
 
         self._resetRememberSelection()
 
+    def _locateThumbnail(self, uid: bytes) -> Optional[GetThumbnailPath]:
+        """
+        :return: location of the thumbnail in the thumbnail cache, or None if it
+         is not there
+        """
+
+        if self.thumbnail_cache is None or not self.thumbnail_cache.valid:
+            return None
+        rpd_file = self.catalogue[uid]
+        get_thumbnail = self.thumbnail_cache.get_thumbnail_path(
+            full_file_name=rpd_file.full_file_name, mtime=rpd_file.modification_time,
+            size=rpd_file.size, camera_model=rpd_file.camera_model
+        )
+        if get_thumbnail.disk_status == ThumbnailCacheDiskStatus.found:
+            return get_thumbnail
+        return None
+
+    def _loadThumbnail(self, location: GetThumbnailPath) -> Optional[QPixmap]:
+        data = self.thumbnail_cache.read_thumbnail(location)
+        if data is not None:
+            thumbnail = QImage.fromData(data)
+            if not thumbnail.isNull():
+                return QPixmap.fromImage(thumbnail)
+        logging.warning("Could not reload thumbnail from the thumbnail cache")
+        return None
+
+    def _placeholderThumbnail(self, uid: bytes) -> QPixmap:
+        catalogue = self.catalogue
+        if catalogue.file_type[catalogue.ids[uid]] == FileType.photo:
+            return self.photo_icon
+        else:
+            return self.video_icon
+
+    def prefetchThumbnails(self, rows: Iterable[int]) -> None:
+        """
+        Ensure thumbnails that are displayed or about to be displayed are in memory.
+
+        :param rows: rows to prefetch, most important last
+        """
+
+        no_rows = len(self.rows)
+        uids = [self.rows[row][0] for row in rows if 0 <= row < no_rows]
+        reloaded = self.thumbnails.prefetch(uids)
+        if reloaded:
+            logging.debug("Reloaded %s thumbnails from the thumbnail cache", reloaded)
+
     def stopThumbnailer(self) -> None:
         self.thumbnailer.stop()
 
@@ -249,9 +338,9 @@ class ThumbnailListModel(QAbstractListModel):
         db_length = self.tsql.get_count()
         db_length_and_buffer_length = db_length + len(self.add_buffer)
         if (len(self.thumbnails) != db_length_and_buffer_length or
-                db_length_and_buffer_length != len(self.rpd_files)):
+                db_length_and_buffer_length != len(self.catalogue)):
             logging.error("Conflicting values: %s thumbnails; %s database rows; %s rpd_files",
-                          len(self.thumbnails), db_length, len(self.rpd_files))
+                          len(self.thumbnails), db_length, len(self.catalogue))
         else:
             logging.debug("%s thumbnails (%s marked)",
                           db_length, self.tsql.get_count(marked=True))
@@ -264,6 +353,7 @@ class ThumbnailListModel(QAbstractListModel):
         if self.total_thumbs_to_generate:
             logging.debug("%s to be generated; %s generated", self.total_thumbs_to_generate,
                           self.thumbnails_generated)
+        self.thumbnails.log_state()
 
         scan_ids = self.tsql.get_all_devices()
         active_devices = ', '.join(self.rapidApp.devices[scan_id].display_name
@@ -280,23 +370,24 @@ class ThumbnailListModel(QAbstractListModel):
 
         for idx, row in enumerate(self.rows):
             uid = row[0]
-            if self.rpd_files.get(uid) is None:
+            if uid not in self.catalogue:
                 raise KeyError('Missing key in rpd files at row {}'.format(idx))
-            if self.thumbnails.get(uid) is None:
+            if uid not in self.thumbnails:
                 raise KeyError('Missing key in thumbnails at row {}'.format(idx))
 
         [self.tsql.validate_uid(uid=row[0]) for row in self.rows]
         for uid, row in self.uid_to_row.items():
             assert self.rows[row][0] == uid
         for uid in self.tsql.get_uids():
-            assert uid in self.rpd_files
+            assert uid in self.catalogue
             assert uid in self.thumbnails
         logging.debug("...thumbnail model looks okay")
 
     def refresh(self, suppress_signal=False, rememberSelection=False) -> None:
         """
-        Refresh thumbnail view after files have been added, the proximity filters
-        are used, or the sort criteria is changed.
+        Refresh thumbnail view after the proximity filters are used, or the sort
+        criteria is changed. Files that are added are merged into the view using
+        insertSortedRows() instead.
 
         :param suppress_signal: if True don't emit signals that layout is changing
         :param rememberSelection: remember which uids were selected before change,
@@ -309,11 +400,13 @@ class ThumbnailListModel(QAbstractListModel):
         if not suppress_signal:
             self.layoutAboutToBeChanged.emit()
 
-        self.rows = self.tsql.get_view(
+        rows = self.tsql.get_view(
             sort_by=self.sort_by, sort_order=self.sort_order,
             show=self.show, proximity_col1=self.proximity_col1,
-            proximity_col2=self.proximity_col2
+            proximity_col2=self.proximity_col2, with_sort_key=True
         )
+        self.rows = [row[:2] for row in rows]
+        self.sort_keys = [row[2:] for row in rows]
         self.uid_to_row = {row[0]: idx for idx, row in enumerate(self.rows)}
 
         if not suppress_signal:
@@ -365,9 +458,9 @@ class ThumbnailListModel(QAbstractListModel):
             return Qt.NoItemFlags
 
         uid = self.rows[row][0]
-        rpd_file = self.rpd_files[uid]  # type: RPDFile
+        catalogue = self.catalogue
 
-        if rpd_file.status == DownloadStatus.not_downloaded:
+        if catalogue.status[catalogue.ids[uid]] == DownloadStatus.not_downloaded:
             return super().flags(index) | Qt.ItemIsEnabled | Qt.ItemIsSelectable
         else:
             return Qt.NoItemFlags
@@ -381,13 +474,14 @@ class ThumbnailListModel(QAbstractListModel):
             return None
 
         uid = self.rows[row][0]
-        rpd_file = self.rpd_files[uid]  # type: RPDFile
+        catalogue = self.catalogue
+        i = catalogue.ids[uid]
 
         if role == Qt.DisplayRole:
             # This is never displayed, but is (was?) used for filtering!
-            return rpd_file.modification_time
+            return catalogue.modification_time[i]
         elif role == Roles.highlight:
-            if rpd_file.scan_id == self.currently_highlighting_scan_id:
+            if catalogue.scan_id[i] == self.currently_highlighting_scan_id:
                 return self.highlight_value
             else:
                 return 0
@@ -399,42 +493,39 @@ class ThumbnailListModel(QAbstractListModel):
             else:
                 return Qt.Unchecked
         elif role == Roles.sort_extension:
-            return rpd_file.extension
+            return catalogue.extension[i]
         elif role == Roles.filename:
-            return rpd_file.name
+            return catalogue.name[i]
         elif role == Roles.previously_downloaded:
-            return rpd_file.previously_downloaded
+            return catalogue.previously_downloaded[i]
         elif role == Roles.extension:
-            return rpd_file.extension, rpd_file.extension_type
+            return catalogue.extension[i], catalogue.extension_type[i]
         elif role == Roles.download_status:
-            return rpd_file.status
+            return catalogue.status[i]
         elif role == Roles.job_code:
-            return rpd_file.job_code
+            return catalogue.job_code[i]
         elif role == Roles.has_audio:
-            return rpd_file.has_audio()
+            return catalogue.has_audio[i]
         elif role == Roles.secondary_attribute:
-            if rpd_file.xmp_file_full_name:
-                return 'XMP'
-            elif rpd_file.log_file_full_name:
-                return 'LOG'
-            else:
-                return None
+            return catalogue.secondary_attribute[i]
         elif role == Roles.path:
+            rpd_file = catalogue[uid]
             if rpd_file.status in Downloaded:
                 return rpd_file.download_full_file_name
             else:
                 return rpd_file.full_file_name
         elif role == Roles.uri:
-            return rpd_file.get_uri()
+            return catalogue[uid].get_uri()
         elif role == Roles.camera_memory_card:
-            return rpd_file.camera_memory_card_identifiers
+            return catalogue.camera_memory_card_identifiers[i]
         elif role == Roles.mtp:
-            return rpd_file.is_mtp_device
+            return catalogue.is_mtp_device[i]
         elif role == Roles.scan_id:
-            return rpd_file.scan_id
+            return catalogue.scan_id[i]
         elif role == Roles.is_camera:
-            return rpd_file.from_camera
+            return catalogue.from_camera[i]
         elif role == Qt.ToolTipRole:
+            rpd_file = catalogue[uid]
             devices = self.rapidApp.devices
             if len(devices) > 1:
                 # To account for situations where the device has been removed, use
@@ -586,7 +677,7 @@ class ThumbnailListModel(QAbstractListModel):
             self.dataChanged.emit(index, index)
             return True
         elif role == Roles.job_code:
-            self.rpd_files[uid].job_code = value
+            self.catalogue.set_job_code(uids=[uid], job_code=value)
             self.tsql.set_job_code_assigned(uids=[uid], job_code=True)
             self.dataChanged.emit(index, index)
             return True
@@ -615,16 +706,19 @@ class ThumbnailListModel(QAbstractListModel):
             self.tsql.set_list_previously_downloaded(uids=uids, previously_downloaded=value)
             d = DownloadedSQL()
             now = datetime.datetime.now()
+            catalogue = self.catalogue
             for uid in uids:
-                rpd_file = self.rpd_files[uid]
-                rpd_file.previously_downloaded = value
-                rpd_file.prev_full_name = manually_marked_previously_downloaded
-                rpd_file.prev_datetime = now
+                catalogue.set_previously_downloaded(
+                    uid=uid, previously_downloaded=value,
+                    prev_full_name=manually_marked_previously_downloaded, prev_datetime=now
+                )
+                i = catalogue.ids[uid]
                 d.add_downloaded_file(
-                    name=rpd_file.name, size=rpd_file.size,
-                    modification_time=rpd_file.modification_time,
+                    name=catalogue.name[i], size=catalogue.size[i],
+                    modification_time=catalogue.modification_time[i],
                     download_full_file_name=manually_marked_previously_downloaded
                 )
+            d.close()
             # Update Timeline formatting, if needed
             self.rapidApp.temporalProximity.previouslyDownloadedManuallySet(uids=uids)
 
@@ -643,12 +737,11 @@ class ThumbnailListModel(QAbstractListModel):
 
         uids = self.tsql.get_uids(marked=True, job_code=False)
         logging.debug("Assigning job code to %s files because a download was initiated", len(uids))
-        for uid in uids:
-            self.rpd_files[uid].job_code = job_code
-            rows = [self.uid_to_row[uid] for uid in uids if uid in self.uid_to_row]
-            rows.sort()
-            for first, last in runs(rows):
-                self.dataChanged.emit(self.index(first, 0), self.index(last, 0))
+        self.catalogue.set_job_code(uids=uids, job_code=job_code)
+        rows = [self.uid_to_row[uid] for uid in uids if uid in self.uid_to_row]
+        rows.sort()
+        for first, last in runs(rows):
+            self.dataChanged.emit(self.index(first, 0), self.index(last, 0))
         self.tsql.set_job_code_assigned(uids=uids, job_code=True)
 
     def updateDisplayPostDataChange(self, scan_id: Optional[int]=None):
@@ -663,13 +756,14 @@ class ThumbnailListModel(QAbstractListModel):
 
     def removeRows(self, position, rows=1, index=QModelIndex()) -> bool:
         """
-        Removes Python list rows only, i.e. self.rows.
+        Removes Python list rows only, i.e. self.rows and self.sort_keys.
 
         Does not touch database or other variables.
         """
 
         self.beginRemoveRows(QModelIndex(), position, position + rows - 1)
         del self.rows[position:position + rows]
+        del self.sort_keys[position:position + rows]
         self.endRemoveRows()
         return True
 
@@ -685,12 +779,12 @@ class ThumbnailListModel(QAbstractListModel):
 
         for rpd_file in rpd_files:
             uid = rpd_file.uid
-            self.rpd_files[uid] = rpd_file
+            self.catalogue[uid] = rpd_file
 
             if rpd_file.file_type == FileType.photo:
-                self.thumbnails[uid] = self.photo_icon
+                self.thumbnails.set_placeholder(uid, self.photo_icon)
             else:
-                self.thumbnails[uid] = self.video_icon
+                self.thumbnails.set_placeholder(uid, self.video_icon)
 
             if generate_thumbnail:
                 self.total_thumbs_to_generate += 1
@@ -729,18 +823,61 @@ class ThumbnailListModel(QAbstractListModel):
 
     def flushAddBuffer(self):
         if len(self.add_buffer):
-            self.beginResetModel()
-
+            last_rowid = self.tsql.get_last_rowid()
             for buffer in self.add_buffer.buffer.values():
                 self.tsql.add_thumbnail_rows(thumbnail_rows=buffer)
-            self.refresh(suppress_signal=True)
 
-            self.add_buffer.reset(buffer_length=len(self.rows))
+            # Only the rows just added, filtered and sorted like the rest of the view
+            rows = self.tsql.get_view(
+                sort_by=self.sort_by, sort_order=self.sort_order,
+                show=self.show, proximity_col1=self.proximity_col1,
+                proximity_col2=self.proximity_col2, added_after=last_rowid,
+                with_sort_key=True
+            )
+            self.insertSortedRows(rows)
 
-            self.endResetModel()
+            self.add_buffer.reset(buffer_length=len(self.rows))
 
             self._resetHighlightingValues()
-            self._resetRememberSelection()
+
+    def insertSortedRows(self, rows: List[tuple]) -> None:
+        """
+        Merge rows into the view, preserving its sort order.
+
+        Each run of rows that goes between the same two existing rows is inserted
+        with beginInsertRows() and endInsertRows(), so the view only lays out
+        the new rows, and keeps its selection.
+
+        :param rows: rows returned by ThumbnailRowsSQL.get_view() with their sort
+         key, in sort order
+        """
+
+        if not rows:
+            return
+
+        descending = self.sort_order == Qt.DescendingOrder
+        keys = self.sort_keys
+        positions = []
+        position = 0
+        for row in rows:
+            position = insertion_point(keys, row[2:], position, descending)
+            positions.append(position)
+
+        offset = 0
+        for position, group in groupby(zip(positions, rows), key=itemgetter(0)):
+            group = [row for position, row in group]
+            first = position + offset
+            last = first + len(group) - 1
+            self.beginInsertRows(QModelIndex(), first, last)
+            self.rows[first:first] = [row[:2] for row in group]
+            self.sort_keys[first:first] = [row[2:] for row in group]
+            self.endInsertRows()
+            offset += len(group)
+
+        rows = self.rows
+        uid_to_row = self.uid_to_row
+        for row in range(positions[0], len(rows)):
+            uid_to_row[rows[row][0]] = row
 
     def getMarkedSummary(self) -> MarkedSummary:
         """
@@ -784,7 +921,7 @@ class ThumbnailListModel(QAbstractListModel):
         uid = rpd_file.uid
         scan_id = rpd_file.scan_id
 
-        if uid not in self.rpd_files or scan_id not in self.rapidApp.devices:
+        if uid not in self.catalogue or scan_id not in self.rapidApp.devices:
             # A thumbnail has been generated for a no longer displayed file
             return
 
@@ -795,11 +932,12 @@ class ThumbnailListModel(QAbstractListModel):
             if scan_id not in self.ctimes_differ:
                 self.addCtimeDisparity(rpd_file=rpd_file)
 
-        if not rpd_file.modified_via_daemon_process and self.rpd_files[uid].status in (
+        catalogue = self.catalogue
+        if not rpd_file.modified_via_daemon_process and catalogue.status[catalogue.ids[uid]] in (
                 DownloadStatus.not_downloaded, DownloadStatus.download_pending):
             # Only update the rpd_file if the file has not already been downloaded
             # TODO consider merging this no matter what the status
-            self.rpd_files[uid] = rpd_file
+            catalogue[uid] = rpd_file
 
         if not thumbnail.isNull():
             self.thumbnails[uid] = thumbnail
@@ -823,7 +961,7 @@ class ThumbnailListModel(QAbstractListModel):
 
                 if scan_id in self.ctimes_differ:
                     uids = self.tsql.get_uids_for_device(scan_id=scan_id)
-                    rpd_files = [self.rpd_files[uid] for uid in uids]
+                    rpd_files = catalogue.rpd_files(uids)
                     self.rapidApp.folder_preview_manager.add_rpd_files(rpd_files=rpd_files)
                     self.processCtimeDisparity(scan_id=scan_id)
                 log_state = True
@@ -906,7 +1044,7 @@ class ThumbnailListModel(QAbstractListModel):
             self.rapidApp.updateProgressBarState()
             cache_dirs = self.getCacheLocations()
             uids = self.tsql.get_uids_for_device(scan_id=scan_id)
-            rpd_files = list((self.rpd_files[uid] for uid in uids))
+            rpd_files = self.catalogue.rpd_files(uids)
 
             need_video_cache_dir = need_photo_cache_dir = False
             if device.device_type == DeviceType.camera:
@@ -949,7 +1087,7 @@ class ThumbnailListModel(QAbstractListModel):
     def purgeRpdFiles(self, uids: List[bytes]) -> None:
         for uid in uids:
             del self.thumbnails[uid]
-            del self.rpd_files[uid]
+            del self.catalogue[uid]
 
     def clearAll(self, scan_id: Optional[int]=None, keep_downloaded_files: bool=False) -> bool:
         """
@@ -1083,7 +1221,7 @@ class ThumbnailListModel(QAbstractListModel):
 
     def getSizeOfFilesMarkedForDownload(self, file_type: FileType) -> int:
         uids = self.tsql.get_uids(marked=True, file_type=file_type)
-        return sum(self.rpd_files[uid].size for uid in uids)
+        return self.catalogue.total_size(uids)
 
     def getNoFilesAvailableForDownload(self) -> FileTypeCounter:
         no_photos = self.tsql.get_count(downloaded=False, file_type=FileType.photo)
@@ -1100,7 +1238,7 @@ class ThumbnailListModel(QAbstractListModel):
         if not len(selected) == len(self.rows):
             # not all files are selected
             selected_uids = [self.rows[index.row()][0] for index in selected.indexes()]
-            return FileTypeCounter(self.rpd_files[uid].file_type for uid in selected_uids)
+            return FileTypeCounter(self.catalogue.file_types(selected_uids))
         else:
             return self.getDisplayedCounter()
 
@@ -1109,7 +1247,7 @@ class ThumbnailListModel(QAbstractListModel):
 
     def getAllDownloadableRPDFiles(self) -> List[RPDFile]:
         uids = self.tsql.get_uids(downloaded=False)
-        return [self.rpd_files[uid] for uid in uids]
+        return self.catalogue.rpd_files(uids)
 
     def getFilesMarkedForDownload(self, scan_id: Optional[int]) -> DownloadFiles:
         """
@@ -1140,7 +1278,7 @@ class ThumbnailListModel(QAbstractListModel):
                                   exclude_scan_ids=exclude_scan_ids)
 
         for uid in uids:
-            rpd_file = self.rpd_files[uid] # type: RPDFile
+            rpd_file = self.catalogue[uid] # type: RPDFile
 
             scan_id = rpd_file.scan_id
             files[scan_id].append(rpd_file)
@@ -1212,8 +1350,10 @@ class ThumbnailListModel(QAbstractListModel):
             self.rows[row] = (uid, False)
         self.tsql.set_list_marked(uids=uids, marked=False)
 
-        for uid in uids:
-            self.rpd_files[uid].status = DownloadStatus.download_pending
+        self.catalogue.set_status(uids=uids, status=DownloadStatus.download_pending)
+        for scan_id in files:
+            for rpd_file in files[scan_id]:
+                rpd_file.status = DownloadStatus.download_pending
 
         rows.sort()
         for first, last in runs(rows):
@@ -1306,8 +1446,10 @@ class ThumbnailListModel(QAbstractListModel):
             else:
                 keep_type = FileType.photo
             # print("filtering", keep_type)
+            catalogue = self.catalogue
             keep_rows = [index.row() for index in selected.indexes()
-                         if self.rpd_files[self.rows[index.row()][0]].file_type == keep_type]
+                         if catalogue.file_type[catalogue.ids[self.rows[index.row()][0]]] ==
+                         keep_type]
             rows = [index.row() for index in selected.indexes()]
             # print(len(keep_rows), len(rows))
             # print("sorting rows to keep")
@@ -1370,7 +1512,7 @@ class ThumbnailListModel(QAbstractListModel):
         else:
             col1id = [col1id]
         uids = self.tsql.get_uids(proximity_col1=col1id, proximity_col2=col2id)
-        file_types = (self.rpd_files[uid].file_type for uid in uids)
+        file_types = self.catalogue.file_types(uids)
         return FileTypeCounter(file_types).summarize_file_count()[0]
 
     def getDisplayedUids(self, scan_id: Optional[int]=None,
@@ -1424,7 +1566,7 @@ class ThumbnailListModel(QAbstractListModel):
         uid = self.tsql.get_single_file_of_type(file_type=file_type,
                                                 exclude_scan_ids=exclude_scan_ids)
         if uid is not None:
-            return self.rpd_files[uid]
+            return self.catalogue[uid]
         else:
             return None
 
@@ -1454,7 +1596,7 @@ class ThumbnailListModel(QAbstractListModel):
                 scan_id=scan_id, file_type=file_type, downloaded=True
             )
             if uid is not None:
-                return self.rpd_files[uid]
+                return self.catalogue[uid]
             else:
                 # try find a *downloaded* file from another camera
 
@@ -1471,14 +1613,14 @@ class ThumbnailListModel(QAbstractListModel):
                     file_type=file_type, downloaded=True, exclude_scan_ids=exclude_scan_ids
                 )
                 if uid is not None:
-                    return self.rpd_files[uid]
+                    return self.catalogue[uid]
                 else:
                     return self._getSampleFileNonCamera(file_type=file_type)
 
         else:
             uid = self.tsql.get_single_file_of_type(scan_id=scan_id, file_type=file_type)
             if uid is not None:
-                return self.rpd_files[uid]
+                return self.catalogue[uid]
             else:
                 return self._getSampleFileNonCamera(file_type=file_type)
 
@@ -1575,7 +1717,7 @@ class ThumbnailListModel(QAbstractListModel):
         # self.validateModelConsistency()
 
         uid = rpd_file.uid
-        self.rpd_files[uid] = rpd_file
+        self.catalogue[uid] = rpd_file
         self.tsql.set_downloaded(uid=uid, downloaded=True)
         row = self.uid_to_row.get(uid)
 
@@ -1590,11 +1732,12 @@ class ThumbnailListModel(QAbstractListModel):
         return self.tsql.any_files_to_download(scan_id)
 
     def dataForProximityGeneration(self) -> List[ThumbnailDataForProximity]:
-        return [ThumbnailDataForProximity(uid=rpd_file.uid,
-                                          ctime=rpd_file.ctime,
-                                          file_type=rpd_file.file_type,
-                                          previously_downloaded=rpd_file.previously_downloaded)
-                for rpd_file in self.rpd_files.values()]
+        return [ThumbnailDataForProximity(uid=uid,
+                                          ctime=ctime,
+                                          file_type=file_type,
+                                          previously_downloaded=previously_downloaded)
+                for uid, ctime, file_type, previously_downloaded
+                in self.catalogue.proximity_data()]
 
     def assignProximityGroups(self, col1_col2_uid: List[Tuple[int, int, bytes]]) -> None:
         """
@@ -1692,6 +1835,41 @@ class ThumbnailView(QListView):
 
         self.possiblyPreserveSelectionPostClick = False
 
+        # Prefetch thumbnails once scrolling pauses
+        self.scroll_value = 0
+        self.scroll_direction = 1
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(100)
+        self.prefetch_timer.timeout.connect(self.prefetchThumbnails)
+        self.verticalScrollBar().valueChanged.connect(self.scrolled)
+
+    @pyqtSlot(int)
+    def scrolled(self, value: int) -> None:
+        if value != self.scroll_value:
+            self.scroll_direction = 1 if value > self.scroll_value else -1
+            self.scroll_value = value
+        self.prefetch_timer.start()
+
+    @pyqtSlot()
+    def prefetchThumbnails(self) -> None:
+        """
+        Load the thumbnails of the visible rows, and of the page of rows beyond them in the
+        direction the user is scrolling, so that they are ready to be displayed.
+        """
+
+        rows = list(self.visibleRows())
+        if not rows:
+            return
+        first, last = rows[0], rows[-1]
+        page = len(rows)
+        if self.scroll_direction > 0:
+            ahead = range(last + page, last, -1)
+        else:
+            ahead = range(first - page, first)
+        # Most important last, i.e. the visible rows
+        self.model().prefetchThumbnails(rows=list(ahead) + rows)
+
     def setScrollTogether(self, on: bool) -> None:
         """
         Turn on or off the linking of scrolling the Timeline with the Thumbnail display.
@@ -1786,22 +1964,21 @@ class ThumbnailView(QListView):
     def topLeft(self) -> QPoint:
         return QPoint(thumbnail_margin, thumbnail_margin)
 
-    def visibleRows(self):
+    def visibleRows(self) -> Iterator[int]:
         """
-        Yield rows visible in viewport. Not currently used or properly tested.
+        Yield rows visible in viewport, possibly with some rows just beyond it.
         """
 
         rect = self.viewport().contentsRect()
-        width = self.itemDelegate().width
-        last_row = rect.bottomRight().x() // width * width
-        topLeft = rect.topLeft() + QPoint(10, 10)
-        top = self.indexAt(topLeft)
+        top = self.indexAt(rect.topLeft() + QPoint(10, 10))
         if top.isValid():
-            bottom = self.indexAt(QPoint(last_row, rect.bottomRight().y()))
-            if not bottom.isValid():
-                # take a guess with an arbitrary figure
-                bottom = self.index(top.row() + 15)
-            for row in range(top.row(), bottom.row() + 1):
+            size = self.sizeHintForIndex(top)
+            spacing = self.spacing()
+            columns = max(rect.width() // (size.width() + spacing), 1)
+            # Include any partially visible rows
+            rows = rect.height() // (size.height() + spacing) + 2
+            last = min(top.row() + columns * rows, self.model().rowCount())
+            for row in range(top.row(), last):
                 yield row
 
     def scrollToUids(self, uids: List[bytes]) -> None:
@@ -25,7 +25,7 @@ import logging
 
 import zmq
 from PyQt5.QtCore import (QThread, QTimer, pyqtSignal, pyqtBoundSignal, pyqtSlot, QObject)
-from PyQt5.QtGui import (QPixmap, QImage)
+from PyQt5.QtGui import QPixmap
 
 from raphodo.interprocess import (LoadBalancerManager, PublishPullPipelineManager,
                                   GenerateThumbnailsArguments, GenerateThumbnailsResults,
@@ -56,16 +56,7 @@ class ThumbnailManagerPara(PublishPullPipelineManager):
     def process_sink_data(self) -> None:
         data = pickle.loads(self.content) # type: GenerateThumbnailsResults
         if data.rpd_file is not None:
-            if data.thumbnail_bytes is None:
-                thumbnail = QPixmap()
-            else:
-                thumbnail = QImage.fromData(data.thumbnail_bytes)
-                if thumbnail.isNull():
-                    thumbnail = QPixmap()
-                else:
-                    thumbnail = QPixmap.fromImage(thumbnail)
-
-            self.message.emit(data.rpd_file, thumbnail)
+            self.message.emit(data.rpd_file, data.thumbnail())
         elif data.camera_removed:
             assert data.scan_id is not None
             self.cameraRemoved.emit(data.scan_id)
@@ -26,10 +26,11 @@ import logging
 from urllib.request import pathname2url
 import pickle
 import os
-from collections import namedtuple
+import time
+from collections import namedtuple, deque
 import tempfile
 from datetime import datetime
-from typing import Optional, Set, Union, Tuple
+from typing import Optional, Set, Union, Tuple, List
 
 import gi
 gi.require_version('Gst', '1.0')
@@ -46,8 +47,9 @@ except ImportError:
     have_rawkit = False
 
 from raphodo.interprocess import (
-    LoadBalancerWorker, ThumbnailExtractorArgument, GenerateThumbnailsResults
+    LoadBalancerWorker, ThumbnailExtractorArgument, GenerateThumbnailsResults, qimage_to_raw
 )
+from raphodo.transport import send_raw_thumbnails
 
 from raphodo.constants import (
     ThumbnailSize, ExtractionTask, ExtractionProcessing, ThumbnailCacheStatus,
@@ -60,6 +62,7 @@ from raphodo.utilities import (
 )
 from raphodo.filmstrip import add_filmstrip
 from raphodo.cache import ThumbnailCacheSql, FdoCacheLarge, FdoCacheNormal
+from raphodo.preferences import Preferences
 import raphodo.exiftool as exiftool
 from raphodo.heif import have_heif_module, load_heif
 
@@ -180,6 +183,203 @@ def get_video_frame(full_file_name: str,
         return None
 
 
+class VideoFrameExtractor:
+    """
+    Extract frames from videos using a GStreamer pipeline that is built once and
+    reused for every video, rather than building a playbin for each one.
+
+    Frames are decoded straight to raw pixels, scaled by videoscale to be no larger
+    than needed to generate the thumbnails, and loaded into a QImage without being
+    encoded as PNG.
+    """
+
+    # Seconds to wait for a video to be prerolled
+    preroll_timeout = 20
+
+    def __init__(self, max_size: int=512) -> None:
+        """
+        :param max_size: maximum width or height of the frames. Must be larger than
+         256 for freedesktop.org large thumbnails to be generated from them.
+        """
+
+        self.max_size = max_size
+
+        # QImage.Format_RGB32 stores each pixel as 0xffRRGGBB in native byte order
+        self.pixel_format = 'BGRx' if sys.byteorder == 'little' else 'xRGB'
+
+        self.pipeline = Gst.Pipeline.new('frame-extractor')
+        self.decoder = Gst.ElementFactory.make('uridecodebin', 'decoder')
+        self.convert = Gst.ElementFactory.make('videoconvert', 'convert')
+        self.scale = Gst.ElementFactory.make('videoscale', 'scale')
+        self.capsfilter = Gst.ElementFactory.make('capsfilter', 'capsfilter')
+        self.video_sink = Gst.ElementFactory.make('appsink', 'videosink')
+        self.audio_sink = Gst.ElementFactory.make('fakesink', 'fakeaudio')
+        elements = (
+            self.decoder, self.convert, self.scale, self.capsfilter, self.video_sink,
+            self.audio_sink
+        )
+        if None in elements:
+            raise RuntimeError("GStreamer elements needed to extract video frames are missing")
+
+        self.video_sink.props.sync = False
+        self.video_sink.props.max_buffers = 1
+        self.video_sink.props.drop = True
+        self.audio_sink.props.sync = False
+        # async is a reserved word in Python
+        self.audio_sink.set_property('async', False)
+
+        for element in elements:
+            self.pipeline.add(element)
+        self.convert.link(self.scale)
+        self.scale.link(self.capsfilter)
+        self.capsfilter.link(self.video_sink)
+        self.decoder.connect('pad-added', self.on_pad_added)
+        self.bus = self.pipeline.get_bus()
+
+        self.no_frames = self.no_failures = 0
+        self.total_latency = self.max_latency = 0.0
+
+    def frame_size(self, structure: Gst.Structure) -> Tuple[int, int]:
+        """
+        :param structure: caps of the decoded video
+        :return: width and height of the frame once scaled, with square pixels
+        """
+
+        width = structure.get_int('width')[1]
+        height = structure.get_int('height')[1]
+        found, numerator, denominator = structure.get_fraction('pixel-aspect-ratio')
+        if found and numerator and denominator:
+            width = width * numerator // denominator
+        scale = min(1.0, self.max_size / max(width, height, 1))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def on_pad_added(self, decoder: Gst.Element, pad: Gst.Pad) -> None:
+        caps = pad.get_current_caps() or pad.query_caps(None)
+        structure = caps.get_structure(0)
+        if structure.get_name().startswith('video/'):
+            sink_pad = self.convert.get_static_pad('sink')
+            if not sink_pad.is_linked():
+                width, height = self.frame_size(structure)
+                self.capsfilter.props.caps = Gst.Caps.from_string(
+                    'video/x-raw,format={},width={},height={},pixel-aspect-ratio=1/1'.format(
+                        self.pixel_format, width, height
+                    )
+                )
+                pad.link(sink_pad)
+        elif structure.get_name().startswith('audio/'):
+            sink_pad = self.audio_sink.get_static_pad('sink')
+            if not sink_pad.is_linked():
+                pad.link(sink_pad)
+
+    def get_frame(self, full_file_name: str, offset: Optional[float]=5.0) -> Optional[QImage]:
+        """
+        :param full_file_name: file and path of the video
+        :param offset: how far into the video to read, interpreted as
+         get_video_frame() does
+        :return: the frame, or None if it could not be extracted
+        """
+
+        start = time.perf_counter()
+        try:
+            image = self._get_frame(full_file_name, offset)
+        except Exception:
+            logging.exception("Error extracting video frame from %s", full_file_name)
+            image = None
+
+        if image is None:
+            self.no_failures += 1
+            # Start afresh with the next video
+            self.pipeline.set_state(Gst.State.NULL)
+        else:
+            self.pipeline.set_state(Gst.State.READY)
+        self.pipeline.get_state(Gst.CLOCK_TIME_NONE)
+        self.log_bus_errors(full_file_name)
+
+        latency = time.perf_counter() - start
+        if image is not None:
+            self.no_frames += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            logging.debug(
+                "Extracted %sx%s frame from %s in %.1fms", image.width(), image.height(),
+                full_file_name, latency * 1000
+            )
+        return image
+
+    def _get_frame(self, full_file_name: str, offset: Optional[float]) -> Optional[QImage]:
+        self.decoder.props.uri = 'file://{}'.format(
+            pathname2url(os.path.abspath(full_file_name))
+        )
+        self.pipeline.set_state(Gst.State.PAUSED)
+        # Wait for the first frame to be decoded. Unlike a playbin, the pipeline will
+        # never preroll if the video sink is not linked, e.g. when there is no video
+        # stream the decoder can handle, so do not wait indefinitely.
+        result = self.pipeline.get_state(self.preroll_timeout * Gst.SECOND)[0]
+        if result != Gst.StateChangeReturn.SUCCESS:
+            if result == Gst.StateChangeReturn.ASYNC:
+                logging.warning("Timed out decoding the video %s", full_file_name)
+            return None
+        if not self.convert.get_static_pad('sink').is_linked():
+            logging.warning("No video stream found in %s", full_file_name)
+            return None
+
+        # Same offset semantics as get_video_frame()
+        if not offset:
+            offset = 0.5 * Gst.SECOND
+        found, duration = self.pipeline.query_duration(Gst.Format.TIME)
+        if found:
+            offset = min(duration, offset)
+
+        if not self.pipeline.seek_simple(
+                Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, offset):
+            logging.warning(
+                'seek_simple() failed for %s. Is the necessary gstreamer plugin installed for '
+                'this file format?', full_file_name
+            )
+            return None
+        # Wait for the seek to finish
+        self.pipeline.get_state(Gst.CLOCK_TIME_NONE)
+
+        sample = self.video_sink.emit('pull-preroll')
+        if sample is None:
+            return None
+        structure = sample.get_caps().get_structure(0)
+        width = structure.get_int('width')[1]
+        height = structure.get_int('height')[1]
+        buffer = sample.get_buffer()
+        data = buffer.extract_dup(0, buffer.get_size())
+        # Copy the image so it does not refer to data, which Python will free
+        return QImage(data, width, height, len(data) // height, QImage.Format_RGB32).copy()
+
+    def log_bus_errors(self, full_file_name: str) -> None:
+        """
+        Log and discard the messages posted while processing the video, which would
+        otherwise accumulate on the bus of the reused pipeline.
+        """
+
+        message = self.bus.pop()
+        while message is not None:
+            if message.type == Gst.MessageType.ERROR:
+                error, debug = message.parse_error()
+                logging.debug(
+                    "GStreamer error extracting video frame from %s: %s", full_file_name,
+                    error.message
+                )
+            message = self.bus.pop()
+
+    def log_latency(self) -> None:
+        if self.no_frames:
+            logging.debug(
+                "Extracted %s video frames: average %.1fms, maximum %.1fms per video; "
+                "%s failures", self.no_frames, self.total_latency / self.no_frames * 1000,
+                self.max_latency * 1000, self.no_failures
+            )
+
+    def terminate(self) -> None:
+        self.log_latency()
+        self.pipeline.set_state(Gst.State.NULL)
+
+
 PhotoDetails = namedtuple('PhotoDetails', 'thumbnail, orientation')
 
 
@@ -228,9 +428,18 @@ class ThumbnailExtractor(LoadBalancerWorker):
 
     def __init__(self) -> None:
         self.thumbnailSizeNeeded = QSize(ThumbnailSize.width, ThumbnailSize.height)
-        self.thumbnail_cache = ThumbnailCacheSql(create_table_if_not_exists=False)
+        self.send_raw_thumbnails = send_raw_thumbnails()
+        # Thumbnails are written to the database in batches, and when the
+        # worker becomes idle
+        self.thumbnail_cache = ThumbnailCacheSql(
+            create_table_if_not_exists=False, batch_size=50,
+            packed=Preferences().pack_thumbnail_cache
+        )
         self.fdo_cache_large = FdoCacheLarge()
         self.fdo_cache_normal = FdoCacheNormal()
+        # Created when the first video is processed, and reused for every video
+        self.video_frame_extractor = None  # type: Optional[VideoFrameExtractor]
+        self.use_video_frame_extractor = have_gst
 
         super().__init__('Thumbnail Extractor')
 
@@ -516,6 +725,52 @@ class ThumbnailExtractor(LoadBalancerWorker):
             return True
         return False
 
+    @staticmethod
+    def exiftool_metadata_file(data: ThumbnailExtractorArgument) -> Optional[str]:
+        """
+        :return: the file whose metadata the task will read using ExifTool,
+         or None if it will not use ExifTool to read metadata from a file
+        """
+
+        rpd_file = data.rpd_file
+        task = data.task
+        if rpd_file.fdo_thumbnail_256 is not None and data.write_fdo_thumbnail:
+            return None
+        if not rpd_file.metadata_uses_exiftool(data.force_exiftool):
+            return None
+        if task in (ExtractionTask.load_file_directly_metadata_from_secondary,
+                    ExtractionTask.load_from_bytes_metadata_from_temp_extract):
+            return data.secondary_full_file_name
+        if task in (ExtractionTask.load_from_exif,
+                    ExtractionTask.load_file_and_exif_directly,
+                    ExtractionTask.load_heif_and_exif_directly,
+                    ExtractionTask.extract_from_file,
+                    ExtractionTask.extract_from_file_and_load_metadata):
+            return data.full_file_name_to_work_on
+        return None
+
+    def load_tasks(self, tasks: List[Tuple[bytes, bytes]]
+                   ) -> List[Tuple[bytes, Union[bytes, ThumbnailExtractorArgument]]]:
+        """
+        Unpickle a batch of tasks, and request the metadata of each file in the
+        batch that ExifTool will read, so that ExifTool reads the metadata of all
+        of them using a single command.
+
+        :param tasks: directive and content for each task
+        :return: directive and either the unpickled task or, for a command,
+         the content
+        """
+
+        loaded = []
+        for directive, content in tasks:
+            if directive != b'cmd':
+                content = pickle.loads(content)
+                full_file_name = self.exiftool_metadata_file(content)
+                if full_file_name is not None:
+                    self.exiftool_process.request_metadata(full_file_name)
+            loaded.append((directive, content))
+        return loaded
+
     def extract_thumbnail(self, task: ExtractionTask,
                           rpd_file: Union[Photo, Video],
                           processing: Set[ExtractionProcessing],
@@ -639,15 +894,13 @@ class ThumbnailExtractor(LoadBalancerWorker):
                 if not have_gst:
                     thumbnail = None
                 else:
-                    png = get_video_frame(data.full_file_name_to_work_on, 1.0)
-                    if not png:
-                        thumbnail = None
+                    thumbnail = self.video_frame(data.full_file_name_to_work_on)
+                    if thumbnail is None:
                         logging.warning(
                             "Could not extract video thumbnail from %s",
                             data.rpd_file.get_display_full_name()
                         )
                     else:
-                        thumbnail = QImage.fromData(png)
                         if thumbnail.isNull():
                             thumbnail = None
                         else:
@@ -661,6 +914,40 @@ class ThumbnailExtractor(LoadBalancerWorker):
 
         return thumbnail, orientation
 
+    def video_frame(self, full_file_name: str) -> Optional[QImage]:
+        """
+        Extract a frame from the video using the worker's frame extractor, falling
+        back to get_video_frame() if it fails, or if the GStreamer elements it needs
+        are missing.
+
+        :param full_file_name: file and path of the video
+        :return: the frame, or None if it could not be extracted
+        """
+
+        if self.video_frame_extractor is None and self.use_video_frame_extractor:
+            try:
+                self.video_frame_extractor = VideoFrameExtractor()
+            except RuntimeError as e:
+                logging.warning("%s: using a playbin for each video instead", e)
+                self.use_video_frame_extractor = False
+
+        if self.video_frame_extractor is not None:
+            image = self.video_frame_extractor.get_frame(full_file_name, 1.0)
+            if image is not None:
+                return image
+            # A playbin may cope with streams the frame extractor does not
+            logging.debug("Retrying extracting video frame from %s using a playbin", full_file_name)
+
+        png = get_video_frame(full_file_name, 1.0)
+        if not png:
+            return None
+        return QImage.fromData(png)
+
+    def terminate_video_frame_extractor(self) -> None:
+        if self.video_frame_extractor is not None:
+            self.video_frame_extractor.terminate()
+            self.video_frame_extractor = None
+
     def process_files(self):
         """
         Loop continuously processing photo and video thumbnails
@@ -668,14 +955,21 @@ class ThumbnailExtractor(LoadBalancerWorker):
 
         logging.debug("{} worker started".format(self.requester.identity.decode()))
 
+        tasks = deque()  # type: deque
         while True:
-            directive, content = self.requester.recv_multipart()
-            if self.check_for_stop(directive, content):
+            if not tasks:
+                if self.thumbnail_cache.pending() and not self.requester.poll(500):
+                    # No more work for now, so don't leave thumbnails unsaved in the buffer
+                    self.thumbnail_cache.flush()
+                # Metadata requested for the previous batch that was not needed
+                self.exiftool_process.discard_metadata_requests()
+                tasks.extend(self.load_tasks(self.receive_tasks()))
+            directive, data = tasks.popleft()
+            if self.check_for_stop(directive, data):
+                self.thumbnail_cache.flush()
                 break
 
-            data = pickle.loads(content)  # type: ThumbnailExtractorArgument
-
-            thumbnail_256 = png_data = None
+            thumbnail_256 = png_data = raw_data = None
             task = data.task
             processing = data.processing
             rpd_file = data.rpd_file
@@ -756,9 +1050,11 @@ class ThumbnailExtractor(LoadBalancerWorker):
                         if thumbnail_256 is not None:
                             thumbnail = add_filmstrip(thumbnail_256)
 
-                    if thumbnail is not None:
-                        buffer = qimage_to_png_buffer(thumbnail)
-                        png_data = buffer.data()
+                    if thumbnail is not None and data.send_thumb_to_main:
+                        if self.send_raw_thumbnails:
+                            raw_data = qimage_to_raw(thumbnail)
+                        else:
+                            png_data = qimage_to_png_buffer(thumbnail).data()
 
                     orientation_unknown = (
                         ExtractionProcessing.orient in processing and orientation is None
@@ -826,6 +1122,8 @@ class ThumbnailExtractor(LoadBalancerWorker):
 
             except SystemExit as e:
                 self.exiftool_process.terminate()
+                self.terminate_video_frame_extractor()
+                self.thumbnail_cache.flush()
                 sys.exit(e)
             except:
                 logging.error("Exception working on file %s", rpd_file.full_file_name)
@@ -833,20 +1131,39 @@ class ThumbnailExtractor(LoadBalancerWorker):
                 logging.error("Processing tasks: %s", processing)
                 logging.exception("Traceback:")
 
+            if rpd_file.metadata is not None:
+                # Keep the values used in name generation, so the rename process need
+                # not read the metadata again. Metadata read from an excerpt of the
+                # file or from a secondary file provides only the values it has.
+                source = rpd_file.metadata.full_file_name
+                complete = bool(source) and source in (
+                    rpd_file.full_file_name, rpd_file.cache_full_file_name
+                )
+                try:
+                    rpd_file.metadata_summary = rpd_file.metadata.summary(complete=complete)
+                except Exception:
+                    logging.exception(
+                        "Could not summarize the metadata of %s", rpd_file.full_file_name
+                    )
+
             # Purge metadata, as it cannot be pickled
             if not data.send_thumb_to_main:
-                png_data = None
+                png_data = raw_data = None
             rpd_file.metadata = None
             self.sender.send_multipart(
                 [
                     b'0', b'data',
                     pickle.dumps(
-                        GenerateThumbnailsResults(rpd_file=rpd_file, thumbnail_bytes=png_data),
+                        GenerateThumbnailsResults(
+                            rpd_file=rpd_file, thumbnail_bytes=png_data, thumbnail_image=raw_data
+                        ),
                         pickle.HIGHEST_PROTOCOL
                     )
                 ]
             )
-            self.requester.send_multipart([b'', b'', b'OK'])
+            if not tasks:
+                # Ready for the next batch
+                self.requester.send_multipart([b'', b'', b'OK'])
 
     def do_work(self):
         if False:
@@ -871,6 +1188,7 @@ class ThumbnailExtractor(LoadBalancerWorker):
             "Terminating thumbnail extractor ExifTool process for %s", self.identity.decode()
         )
         self.exiftool_process.terminate()
+        self.terminate_video_frame_extractor()
 
 
 if __name__ == "__main__":
@@ -53,7 +53,7 @@ import logging
 import pickle
 from collections import deque
 from operator import attrgetter
-from typing import Optional, Tuple, Set
+from typing import Optional, Tuple, Set, List, Iterator
 
 import zmq
 from PyQt5.QtGui import QImage
@@ -69,6 +69,7 @@ except ImportError:
     have_rawkit = False
 
 from raphodo.rpdfile import RPDFile
+from raphodo.transport import endpoint
 from raphodo.interprocess import (
     WorkerInPublishPullPipeline, GenerateThumbnailsArguments, GenerateThumbnailsResults,
     ThumbnailExtractorArgument
@@ -94,45 +95,51 @@ def cache_dir_name(device_name: str) -> str:
     return 'rpd-cache-{}-'.format(device_name[:10].replace(' ', '_'))
 
 
-def split_list(alist: list, wanted_parts=2):
+def iter_split_indexes(length: int) -> Iterator[int]:
     """
-    Split list into smaller parts
-    http://stackoverflow.com/questions/752308/split-list-into-smaller-lists
-    :param alist: the list
-    :param wanted_parts: how many lists it should be split into
-    :return: the split lists
+    For the length of a list, generate indexes into it such that the
+    indexes start with the middle item, then the middle item of the
+    remaining two parts of the list, and so forth.
+
+    The parts of the list are tracked by their bounds, so generating
+    all the indexes takes linear time.
+
+    >>> list(iter_split_indexes(10))
+    [5, 2, 8, 1, 4, 7, 9, 0, 3, 6]
+    >>> list(iter_split_indexes(1))
+    [0]
+    >>> list(iter_split_indexes(0))
+    []
+
+    :param length: the length of the list i.e. the number of indexes
+     to be generated
+    :return: the indexes
     """
-    length = len(alist)
-    return [alist[i * length // wanted_parts: (i + 1) * length // wanted_parts]
-            for i in range(wanted_parts)]
+
+    parts = deque([(0, length)])
+    while parts:
+        start, end = parts.popleft()
+        middle = start + (end - start) // 2
+        if middle < end:
+            yield middle
+        if start < middle:
+            parts.append((start, middle))
+        if middle + 1 < end:
+            parts.append((middle + 1, end))
 
 
-def split_indexes(length: int):
+def split_indexes(length: int) -> List[int]:
     """
     For the length of a list, return a list of indexes into it such
     that the indexes start with the middle item, then the middle item
     of the remaining two parts of the list, and so forth.
 
-    Perhaps this algorithm could be optimized, as I did it myself. But
-    hey it works and for now that's the main thing.
-
     :param length: the length of the list i.e. the number of indexes
      to be created
     :return: the list of indexes
     """
-    l = list(range(length))
-    n = []
-    master = deque([l])
-    while master:
-        l1, l2 = split_list(master.popleft())
-        if l2:
-            n.append(l2[0])
-            l2 = l2[1:]
-        if l1:
-            master.append(l1)
-        if l2:
-            master.append(l2)
-    return n
+
+    return list(iter_split_indexes(length))
 
 
 def get_temporal_gaps_and_sequences(rpd_files, temporal_span):
@@ -192,6 +199,31 @@ class GetThumbnailFromCache:
         return (size.width() >= self.thumbnail_size_needed.width() or
                 size.height() >= self.thumbnail_size_needed.height())
 
+    def look_up(self, rpd_files: List[RPDFile]) -> None:
+        """
+        Look up files in the Rapid Photo Downloader thumbnail cache in
+        bulk, so that get_from_cache() does not need to query the database
+        for each file.
+
+        :param rpd_files: files whose thumbnails will be requested
+        """
+
+        if self.thumbnail_cache is not None:
+            self.thumbnail_cache.look_up_thumbnails(
+                (
+                    rpd_file.full_file_name, rpd_file.modification_time, rpd_file.size,
+                    rpd_file.camera_model
+                ) for rpd_file in rpd_files
+            )
+
+    def flush(self) -> None:
+        """
+        Record in the thumbnail cache which thumbnails have been read
+        """
+
+        if self.thumbnail_cache is not None:
+            self.thumbnail_cache.flush()
+
     def get_from_cache(self, rpd_file: RPDFile,
                        use_thumbnail_cache: bool = True
                        ) -> Tuple[ExtractionTask, bytes, str, ThumbnailCacheOrigin]:
@@ -217,6 +249,10 @@ class GetThumbnailFromCache:
                 mtime=rpd_file.modification_time,
                 size=rpd_file.size,
                 camera_model=rpd_file.camera_model)
+            if get_thumbnail.disk_status == ThumbnailCacheDiskStatus.found:
+                thumbnail_bytes = self.thumbnail_cache.read_thumbnail(get_thumbnail)
+                if thumbnail_bytes is None:
+                    get_thumbnail = self.thumbnail_cache.not_found
             rpd_file.thumbnail_cache_status = get_thumbnail.disk_status
             if get_thumbnail.disk_status != ThumbnailCacheDiskStatus.not_found:
                 origin = ThumbnailCacheOrigin.thumbnail_cache
@@ -230,8 +266,6 @@ class GetThumbnailFromCache:
                         rpd_file.thumbnail_status = ThumbnailCacheStatus.orientation_unknown
                     else:
                         rpd_file.thumbnail_status = ThumbnailCacheStatus.ready
-                    with open(get_thumbnail.path, 'rb') as thumbnail:
-                        thumbnail_bytes = thumbnail.read()
 
         # Attempt to get thumbnail from large FDO Cache if not found in Thumbnail Cache
         # and it's not being downloaded directly from a camera (if it's from a camera, it's
@@ -485,7 +519,7 @@ class GenerateThumbnails(WorkerInPublishPullPipeline):
             self.gphoto2_logging = gphoto2_python_logging()
 
         self.frontend = self.context.socket(zmq.PUSH)
-        self.frontend.connect("tcp://localhost:{}".format(arguments.frontend_port))
+        self.frontend.connect(endpoint(arguments.frontend_port))
 
         self.prefs = Preferences()
 
@@ -602,6 +636,9 @@ class GenerateThumbnails(WorkerInPublishPullPipeline):
                     )
                     self.send_message_to_sink()
 
+        if use_thumbnail_cache:
+            thumbnail_caches.look_up(rpd_files)
+
         for rpd_file in rpd_files:  # type: RPDFile
             # Check to see if the process has received a command
             self.check_for_controller_directive()
@@ -833,6 +870,8 @@ class GenerateThumbnails(WorkerInPublishPullPipeline):
                 if not os.listdir(self.video_cache_dir):
                     os.rmdir(self.video_cache_dir)
 
+        thumbnail_caches.flush()
+
         logging.debug("Finished phase 1 of thumbnail generation for %s", self.device_name)
         if from_thumb_cache:
             logging.info(
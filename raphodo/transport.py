@@ -0,0 +1,218 @@
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Transport used by the 0MQ sockets that connect Rapid Photo Downloader's processes.
+
+By default sockets use ipc:// endpoints: Unix domain sockets in a private directory in
+the user's runtime directory, which bypass the loopback TCP stack. The directory is
+created by the main process and passed to every process it starts in an environment
+variable. Sockets are still identified by a "port" number, which for ipc:// is the
+name of the socket in the directory, meaning code that passes ports between processes
+works with either transport.
+
+Large payloads, such as thumbnails and EXIF buffers, are written to shared memory
+segments in the same directory, and only a handle to the segment is pickled.
+
+Set the environment variable RPD_TRANSPORT to tcp to use tcp://localhost instead.
+
+Thumbnail extractors send the thumbnails they generate to the main process as raw
+pixels, which is much cheaper than encoding and decoding them as PNG. Set the
+environment variable RPD_THUMBNAIL_TRANSPORT to png to send PNGs instead.
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+import atexit
+from collections import namedtuple
+import itertools
+import logging
+import os
+import random
+import shutil
+import tempfile
+from typing import Optional, Union
+
+import zmq
+
+# Set by the main process, and inherited by the processes it starts
+ipc_directory_variable = 'RPD_IPC_DIR'
+transport_variable = 'RPD_TRANSPORT'
+thumbnail_transport_variable = 'RPD_THUMBNAIL_TRANSPORT'
+
+# Payloads smaller than this are sent inline. Determined using
+# tests/test_transport.py: below it, creating and removing a segment costs
+# more than sending the bytes over a Unix domain socket.
+shared_memory_threshold = 256 * 1024
+
+SharedMemoryHandle = namedtuple('SharedMemoryHandle', 'name, size, mutable')
+
+_segment_counter = itertools.count()
+
+
+def create_ipc_directory() -> Optional[str]:
+    """
+    Create the directory for ipc:// sockets and shared memory segments, unless the
+    user has requested the tcp transport.
+
+    Must be called in the main process before any sockets are bound or
+    processes started. The directory is removed when the main process exits.
+
+    :return: the directory, or None if the tcp transport is to be used
+    """
+
+    os.environ.pop(ipc_directory_variable, None)
+    if os.getenv(transport_variable, 'ipc').lower() == 'tcp':
+        logging.info("Using the tcp transport for interprocess communication")
+        return None
+
+    # Prefer a directory in memory
+    for base in (os.getenv('XDG_RUNTIME_DIR'), '/dev/shm', tempfile.gettempdir()):
+        if base and os.access(base, os.W_OK | os.X_OK):
+            try:
+                directory = tempfile.mkdtemp(prefix='rpd-', dir=base)
+            except OSError as e:
+                logging.warning("Could not create ipc directory in %s: %s", base, e)
+            else:
+                os.environ[ipc_directory_variable] = directory
+                atexit.register(remove_ipc_directory)
+                logging.debug("Using the ipc transport in %s", directory)
+                return directory
+
+    logging.warning("Using the tcp transport for interprocess communication")
+    return None
+
+
+def send_raw_thumbnails() -> bool:
+    """
+    :return: True if thumbnails should be sent as raw pixels, False if they should be
+     sent as PNGs
+    """
+
+    return os.getenv(thumbnail_transport_variable, 'raw').lower() != 'png'
+
+
+def remove_ipc_directory() -> None:
+    """
+    Remove the directory created by create_ipc_directory(), including any shared memory
+    segments that were never read.
+    """
+
+    directory = os.environ.pop(ipc_directory_variable, None)
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def ipc_directory() -> Optional[str]:
+    """
+    :return: the directory for ipc:// sockets and shared memory segments, or None
+     if the tcp transport is being used
+    """
+
+    return os.getenv(ipc_directory_variable)
+
+
+def endpoint(port: Union[int, str]) -> str:
+    """
+    :param port: port as returned by bind_to_random_port(), possibly passed as a string
+     on a command line
+    :return: the endpoint to connect a socket to
+    """
+
+    directory = ipc_directory()
+    if directory is None:
+        return 'tcp://localhost:{}'.format(port)
+    return 'ipc://{}'.format(os.path.join(directory, str(port)))
+
+
+def bind_to_random_port(socket: zmq.Socket) -> int:
+    """
+    Bind the socket to an unused ipc:// endpoint, or a random tcp port if the tcp
+    transport is being used.
+
+    :param socket: socket to bind
+    :return: the port, to be passed to endpoint() by whatever connects to the socket
+    """
+
+    directory = ipc_directory()
+    if directory is None:
+        return socket.bind_to_random_port('tcp://*')
+
+    # 0MQ silently replaces an existing ipc:// socket of the same name, so reserve
+    # the name first
+    while True:
+        port = random.randint(1024, 65535)
+        path = os.path.join(directory, str(port))
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        socket.bind('ipc://{}'.format(path))
+        return port
+
+
+def to_shared_memory(data: Optional[Union[bytes, bytearray]]) \
+        -> Optional[Union[bytes, bytearray, SharedMemoryHandle]]:
+    """
+    Place a large payload in a shared memory segment.
+
+    :param data: payload to be pickled
+    :return: a handle to the segment, or the payload itself if it is small or the
+     tcp transport is being used
+    """
+
+    directory = ipc_directory()
+    if directory is None or data is None or len(data) < shared_memory_threshold:
+        return data
+
+    name = 'shm-{}-{}'.format(os.getpid(), next(_segment_counter))
+    try:
+        with open(os.path.join(directory, name), 'xb') as segment:
+            segment.write(data)
+    except OSError as e:
+        logging.warning("Could not create shared memory segment: %s", e)
+        return data
+    return SharedMemoryHandle(name=name, size=len(data), mutable=isinstance(data, bytearray))
+
+
+def from_shared_memory(value: Optional[Union[bytes, bytearray, SharedMemoryHandle]]) \
+        -> Optional[Union[bytes, bytearray]]:
+    """
+    Retrieve a payload from the shared memory segment created by to_shared_memory(),
+    and remove the segment.
+
+    :param value: the value returned by to_shared_memory()
+    :return: the payload, of the same type it was when it was placed in the segment
+    """
+
+    if not isinstance(value, SharedMemoryHandle):
+        return value
+
+    path = os.path.join(ipc_directory(), value.name)
+    try:
+        with open(path, 'rb') as segment:
+            if value.mutable:
+                data = bytearray(value.size)
+                segment.readinto(data)
+            else:
+                data = segment.read()
+    finally:
+        os.remove(path)
+    return data